@@ -0,0 +1,123 @@
+"""
+Overload behaviour with and without the admission controller.
+
+Simulated traffic: verifications and registrations arrive at `--rate` requests per
+second (a `--register-share` of them registrations), each holding one of `--workers`
+inference slots for `--verify-ms` or `--register-ms` of blocking work in a thread
+pool, like the inference pool does. A client gives up after its deadline.
+
+- "unbounded": every request goes straight to the pool and queues there, FIFO.
+- "admission": requests go through server.utils.admission.AdmissionController.
+
+Reported per class: latency of the requests answered in time, how many missed their
+deadline (a kiosk timeout) and how many were rejected with a fast 503.
+
+Usage:
+    python -m benchmarks.admission [--rate 30] [--duration 10] [--workers 2]
+                                   [--verify-ms 150] [--register-ms 600] [--output results.json]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from benchmarks.harness import percentiles, save_results
+
+VERIFY, REGISTER = 0, 1
+CLASSES = {VERIFY: "verify", REGISTER: "register"}
+
+
+async def simulate(mode: str, args) -> Dict[str, Any]:
+    from server.utils.admission import AdmissionController, AdmissionRejected
+
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    controller = AdmissionController(max_active=args.workers, queue_size=args.queue_size)
+    deadlines = {VERIFY: args.verify_deadline_ms / 1000, REGISTER: args.register_deadline_ms / 1000}
+    work = {VERIFY: args.verify_ms / 1000, REGISTER: args.register_ms / 1000}
+
+    outcomes: Dict[int, Dict[str, Any]] = {
+        kind: {"latencies": [], "timed_out": 0, "rejected": 0, "total": 0} for kind in CLASSES
+    }
+
+    async def request(kind: int):
+        started = time.monotonic()
+        deadline = started + deadlines[kind]
+        outcome = outcomes[kind]
+        outcome["total"] += 1
+
+        try:
+            if mode == "admission":
+                async with controller.slot(kind, deadline):
+                    await loop.run_in_executor(executor, time.sleep, work[kind])
+            else:
+                await loop.run_in_executor(executor, time.sleep, work[kind])
+        except AdmissionRejected:
+            outcome["rejected"] += 1
+            return
+
+        elapsed = time.monotonic() - started
+        if elapsed > deadlines[kind]:
+            outcome["timed_out"] += 1
+        else:
+            outcome["latencies"].append(elapsed * 1000)
+
+    rng = random.Random(0)
+    tasks: List[asyncio.Task] = []
+    stop = time.monotonic() + args.duration
+    while time.monotonic() < stop:
+        kind = REGISTER if rng.random() < args.register_share else VERIFY
+        tasks.append(asyncio.create_task(request(kind)))
+        await asyncio.sleep(rng.expovariate(args.rate))
+
+    await asyncio.gather(*tasks)
+    executor.shutdown(wait=True)
+
+    results = {}
+    for kind, outcome in outcomes.items():
+        total = outcome["total"] or 1
+        results[CLASSES[kind]] = {
+            "requests": outcome["total"],
+            "answered_in_time": len(outcome["latencies"]) / total,
+            "timed_out": outcome["timed_out"] / total,
+            "rejected_503": outcome["rejected"] / total,
+            **(percentiles(outcome["latencies"]) if outcome["latencies"] else {}),
+        }
+    if mode == "admission":
+        results["controller"] = controller.stats()
+
+    logging.info(
+        f"{mode}: verify in time {results['verify']['answered_in_time']:.2f}, "
+        f"register in time {results['register']['answered_in_time']:.2f}"
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overload behaviour with and without admission control.")
+    parser.add_argument("--rate", type=float, default=30.0, help="Arrivals per second")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=32)
+    parser.add_argument("--register-share", type=float, default=0.1)
+    parser.add_argument("--verify-ms", type=float, default=150.0)
+    parser.add_argument("--register-ms", type=float, default=600.0)
+    parser.add_argument("--verify-deadline-ms", type=float, default=5000.0)
+    parser.add_argument("--register-deadline-ms", type=float, default=30000.0)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    results = {"settings": vars(args)}
+    for mode in ("unbounded", "admission"):
+        results[mode] = asyncio.run(simulate(mode, args))
+
+    print(save_results("admission", results, args.output))
+
+
+if __name__ == "__main__":
+    main()
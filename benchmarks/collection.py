@@ -0,0 +1,161 @@
+"""
+Recall and latency of the tuned faces collection against the float32 Cosine setup.
+
+The gallery is synthetic: `--identities` random 512-d embeddings, queried with noisy
+copies of some of them (a new photo of a registered employee). Ground truth is the
+exact float32 nearest neighbour.
+
+- "float32": Cosine, default HNSW, no quantization (the collection as it was).
+- "int8_rescore": Dot on normalized vectors, tuned HNSW, int8 scalar quantization in
+  RAM with rescoring (server.utils.faces_collection).
+- "int8_no_rescore": same collection, searched without rescoring.
+
+`--url` points at a Qdrant server (e.g. a local `docker run qdrant/qdrant`). The default
+is qdrant-client's in-memory local mode, which searches exactly and ignores HNSW and
+quantization, so its recall is always 1: use it for a smoke test only. The
+`numpy_int8` section simulates int8 scalar quantization (0.99 quantile, same as the
+collection) to estimate the recall lost before and after rescoring without a server.
+
+Usage:
+    python -m benchmarks.collection [--url http://localhost:6333] [--identities 20000]
+                                    [--queries 500] [--output results.json]
+"""
+import argparse
+import logging
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.harness import percentiles, save_results
+
+
+def build_gallery(identities: int, queries: int, noise: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    gallery = rng.normal(size=(identities, 512)).astype(np.float32)
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+
+    targets = rng.choice(identities, size=queries, replace=False)
+    query = gallery[targets] + rng.normal(scale=noise / np.sqrt(512), size=(queries, 512)).astype(np.float32)
+    query /= np.linalg.norm(query, axis=1, keepdims=True)
+
+    truth = np.argmax(query @ gallery.T, axis=1)
+    return gallery, query, truth
+
+
+def _quantize(vectors: np.ndarray, quantile: float = 0.99):
+    low, high = np.quantile(vectors, 1 - quantile), np.quantile(vectors, quantile)
+    scale = (high - low) / 255
+    return np.clip(np.round((vectors - low) / scale), 0, 255).astype(np.uint8), low, scale
+
+
+def numpy_int8(gallery: np.ndarray, query: np.ndarray, truth: np.ndarray, oversampling: float) -> Dict[str, Any]:
+    """Recall@1 of exact search over int8-quantized vectors, with and without rescoring."""
+    codes, low, scale = _quantize(gallery)
+    approximate = (codes.astype(np.float32) * scale + low) @ query.T
+
+    top1 = np.argmax(approximate, axis=0)
+    candidates = max(1, int(np.ceil(oversampling)))
+    shortlist = np.argpartition(-approximate, candidates, axis=0)[:candidates].T
+    rescored = np.array([row[np.argmax(gallery[row] @ q)] for row, q in zip(shortlist, query)])
+
+    return {
+        "recall_at_1_no_rescore": float(np.mean(top1 == truth)),
+        "recall_at_1_rescore": float(np.mean(rescored == truth)),
+        "memory_mb_float32": gallery.nbytes / 1024 ** 2,
+        "memory_mb_int8": codes.nbytes / 1024 ** 2,
+    }
+
+
+def run_qdrant(url: str, gallery: np.ndarray, query: np.ndarray, truth: np.ndarray) -> Dict[str, Any]:
+    from qdrant_client import QdrantClient, models
+
+    from server.utils import faces_collection
+
+    client = QdrantClient(url) if url != ":memory:" else QdrantClient(":memory:")
+    setups = {
+        "float32": dict(
+            vectors_config=models.VectorParams(size=512, distance=models.Distance.COSINE),
+        ),
+        "int8_rescore": dict(
+            vectors_config=faces_collection.vectors_config(),
+            hnsw_config=faces_collection.hnsw_config(),
+            quantization_config=faces_collection.quantization_config(),
+        ),
+    }
+
+    results = {}
+    for name, config in setups.items():
+        collection = f"bench_faces_{name}"
+        if client.collection_exists(collection):
+            client.delete_collection(collection)
+        client.create_collection(collection, **config)
+        client.upload_collection(collection, vectors=gallery, ids=list(range(len(gallery))), wait=True)
+        _wait_indexed(client, collection)
+
+        search_variants = {name: None}
+        if name == "int8_rescore":
+            search_variants = {
+                "int8_rescore": faces_collection.search_params(),
+                "int8_no_rescore": models.SearchParams(
+                    hnsw_ef=faces_collection.QDRANT_HNSW_EF,
+                    quantization=models.QuantizationSearchParams(rescore=False),
+                ),
+            }
+
+        for variant, params in search_variants.items():
+            timings: List[float] = []
+            hits = 0
+            for vector, expected in zip(query, truth):
+                started = time.perf_counter()
+                points = client.query_points(collection, query=vector.tolist(), search_params=params, limit=1).points
+                timings.append((time.perf_counter() - started) * 1000)
+                hits += bool(points) and points[0].id == int(expected)
+
+            results[variant] = {**percentiles(timings), "recall_at_1": hits / len(query)}
+
+        client.delete_collection(collection)
+
+    return results
+
+
+def _wait_indexed(client, collection: str, timeout: float = 600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if str(client.get_collection(collection).status).lower().endswith("green"):
+            return
+        time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency of the tuned faces collection.")
+    parser.add_argument("--url", default=":memory:", help="Qdrant URL, default is the in-memory local mode")
+    parser.add_argument("--identities", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.6, help="Query noise relative to the embedding norm")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from server.utils.faces_collection import QDRANT_RESCORE_OVERSAMPLING
+
+    gallery, query, truth = build_gallery(args.identities, args.queries, args.noise)
+    results: Dict[str, Any] = {
+        "identities": args.identities,
+        "queries": args.queries,
+        "url": args.url,
+        "numpy_int8": numpy_int8(gallery, query, truth, QDRANT_RESCORE_OVERSAMPLING),
+    }
+
+    try:
+        results["qdrant"] = run_qdrant(args.url, gallery, query, truth)
+    except Exception as e:
+        logging.error(f"Qdrant benchmark failed: {e}")
+        results["qdrant"] = {"error": str(e)}
+
+    print(save_results("collection", results, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Event-loop responsiveness under mixed traffic.
+
+Concurrent verify requests run the real pipeline (`server.pipeline.extract_embeddings`)
+while a probe coroutine stands in for cheap requests like /health and /internal/jwks:
+it sleeps for a fixed interval and records how late the event loop wakes it up. With
+the "inline" executor the pipeline runs on the event loop (the behaviour before the
+inference pool), with "thread" or "process" it runs in the inference pool.
+
+Usage:
+    python -m benchmarks.concurrency [--executor inline,thread,process] [--workers 2]
+                                     [--concurrency 4] [--duration 30] [--output results.json]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List
+
+from benchmarks.harness import SAMPLE_IMAGE, encode_jpeg, load_sample, percentiles, save_results
+from server.pipeline import extract_embeddings
+from server.utils.inference_pool import InferencePool, warm_up_model
+
+
+async def run_mixed_traffic(
+    executor: str,
+    image_data: bytes,
+    workers: int = 2,
+    concurrency: int = 4,
+    duration: float = 30.0,
+    probe_interval_ms: float = 10.0,
+) -> Dict[str, Any]:
+    pool = None
+    if executor == "inline":
+        warm_up_model(SAMPLE_IMAGE)
+    else:
+        pool = InferencePool(kind=executor, max_workers=workers)
+        await pool.start(warmup_image=SAMPLE_IMAGE)
+
+    verify_ms: List[float] = []
+    probe_ms: List[float] = []
+    deadline = time.perf_counter() + duration
+
+    async def verify_loop():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            if pool:
+                await pool.run(extract_embeddings, image_data)
+            else:
+                extract_embeddings(image_data)
+                # give the other coroutines a chance, as a real request would between awaits
+                await asyncio.sleep(0)
+            verify_ms.append((time.perf_counter() - started) * 1000)
+
+    async def probe_loop():
+        interval = probe_interval_ms / 1000
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            probe_ms.append((time.perf_counter() - started - interval) * 1000)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(probe_loop(), *[verify_loop() for _ in range(concurrency)])
+    finally:
+        if pool:
+            pool.shutdown()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "executor": executor,
+        "workers": workers if pool else 1,
+        "concurrency": concurrency,
+        "verify": {**percentiles(verify_ms), "count": len(verify_ms), "throughput_per_s": len(verify_ms) / elapsed},
+        "health_probe_delay": {**percentiles(probe_ms), "count": len(probe_ms)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="p99 latency of verify and health traffic mixed together.")
+    parser.add_argument("--executor", default="inline,thread,process")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    image_data = encode_jpeg(load_sample())
+
+    results = {}
+    for executor in args.executor.split(","):
+        logging.info(f"Running mixed traffic with executor: {executor}")
+        results[executor] = asyncio.run(run_mixed_traffic(
+            executor, image_data, workers=args.workers, concurrency=args.concurrency, duration=args.duration
+        ))
+
+    print(save_results("concurrency", results, args.output))
+
+
+if __name__ == "__main__":
+    main()
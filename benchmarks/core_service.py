@@ -0,0 +1,112 @@
+"""
+Registration call latency against a local stub of the core service.
+
+Starts a stub `/api/Auth/face-register` on localhost (with a configurable service
+time) and sends concurrent registration calls, once with a new client per call (the
+behaviour before the shared client) and once through the shared pooled client with
+`request_with_retry`. Over plain local HTTP this only shows the TCP reuse, a real
+deployment additionally saves the TLS handshake.
+
+Usage:
+    python -m benchmarks.core_service [--concurrency 16] [--requests 400] [--delay-ms 5]
+"""
+import argparse
+import asyncio
+import logging
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from benchmarks.harness import percentiles, save_results
+from server.utils.http_client import create_core_client, request_with_retry
+
+PAYLOAD = {
+    "firstName": "Bench",
+    "lastName": "Mark",
+    "email": "bench@example.com",
+    "position": "Crew",
+    "departmentId": "dept-1",
+    "storeId": "store-1",
+    "timeLogged": "2024-01-01T08:00:00+00:00",
+}
+
+
+def create_stub_app(delay_ms: float) -> FastAPI:
+    stub = FastAPI()
+
+    @stub.post("/api/Auth/face-register")
+    async def face_register(body: Dict[str, Any]):
+        await asyncio.sleep(delay_ms / 1000)
+        return {"user": {"id": str(uuid.uuid4()), "email": body.get("email")}}
+
+    return stub
+
+
+def start_stub(delay_ms: float) -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(create_stub_app(delay_ms), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+
+    while not server.started:
+        time.sleep(0.05)
+
+    return f"http://127.0.0.1:{port}"
+
+
+async def run_calls(mode: str, base_url: str, concurrency: int, total: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    shared = create_core_client() if mode == "pooled" else None
+
+    async def call():
+        async with semaphore:
+            started = time.perf_counter()
+            if shared:
+                response = await request_with_retry(shared, "POST", f"{base_url}/api/Auth/face-register", json=PAYLOAD)
+            else:
+                async with httpx.AsyncClient() as client:
+                    response = await client.post(f"{base_url}/api/Auth/face-register", json=PAYLOAD)
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*[call() for _ in range(total)])
+    finally:
+        if shared:
+            await shared.aclose()
+    elapsed = time.perf_counter() - started
+
+    return {**percentiles(latencies), "requests": total, "concurrency": concurrency, "throughput_per_s": total / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registration latency against a stub core service.")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--delay-ms", type=float, default=5.0)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    base_url = start_stub(args.delay_ms)
+
+    results = {
+        mode: asyncio.run(run_calls(mode, base_url, args.concurrency, args.requests))
+        for mode in ("per_request", "pooled")
+    }
+
+    print(save_results("core_service", results, args.output))
+
+
+if __name__ == "__main__":
+    main()
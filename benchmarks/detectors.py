@@ -0,0 +1,125 @@
+"""
+Latency and detection rate of single detector backends against the detector cascade.
+
+Every image has exactly one face: the bundled sample face at several resolutions and
+lighting conditions (darkened and noisy frames like a dim store), or the images of
+`--images` (a directory of single-face photos, e.g. frames collected from kiosks).
+A detection counts as a hit when it finds one face. The images go through the same
+auto exposure as the pipeline before detection.
+
+For the cascade, `selected` is how often each backend was the one that found the
+face, the escalation rate is the share of images that needed a fallback.
+
+Usage:
+    python -m benchmarks.detectors [--cascade opencv:5,retinaface] [--resolutions 640x480,1920x1080]
+                                   [--images DIR] [--iterations 5] [--output results.json]
+"""
+import argparse
+import logging
+import os
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from benchmarks.harness import (
+    DEFAULT_RESOLUTIONS, load_sample, measure, parse_resolutions, resize_to, save_results,
+)
+
+LIGHTING = {
+    "normal": lambda image_np, rng: image_np,
+    "dim": lambda image_np, rng: (image_np.astype(np.float32) * 0.3).astype(np.uint8),
+    "dim_noisy": lambda image_np, rng: np.clip(
+        image_np.astype(np.float32) * 0.3 + rng.normal(0, 6, image_np.shape), 0, 255
+    ).astype(np.uint8),
+}
+
+
+def build_images(resolutions: List[Tuple[int, int]], directory: str) -> Dict[str, np.ndarray]:
+    from PIL import Image
+
+    if directory:
+        return {
+            name: np.array(Image.open(os.path.join(directory, name)).convert("RGB"))
+            for name in sorted(os.listdir(directory))
+            if name.lower().endswith((".jpg", ".jpeg", ".png"))
+        }
+
+    rng = np.random.default_rng(0)
+    sample = load_sample()
+    return {
+        f"sample_{w}x{h}_{lighting}": transform(resize_to(sample, (w, h)), rng)
+        for w, h in resolutions
+        for lighting, transform in LIGHTING.items()
+    }
+
+
+def _detect(image_np: np.ndarray, cascade: List[Tuple[str, float]]) -> Tuple[int, str]:
+    import face_recognition
+
+    faces, backend = face_recognition.detect_faces(image_np, cascade, enforce_detection=False, align=False)
+    found = [face for face in faces if (face["confidence"] or 0) > 0]
+    return len(found), backend
+
+
+def run(name: str, cascade: List[Tuple[str, float]], images: Dict[str, np.ndarray], iterations: int) -> Dict[str, Any]:
+    import face_recognition
+
+    hits = 0
+    selected: Counter = Counter()
+    per_image = {}
+    for label, image_np in images.items():
+        balanced = face_recognition._auto_exposure(image_np=image_np)
+        faces, backend = _detect(balanced, cascade)
+
+        hits += faces == 1
+        selected[backend if faces else "none"] += 1
+        per_image[label] = {
+            "faces": faces,
+            "backend": backend,
+            **measure(lambda: _detect(balanced, cascade), iterations, warmup=1),
+        }
+
+    latencies = [result["mean_ms"] for result in per_image.values()]
+    summary = {
+        "cascade": [f"{backend}:{min_confidence:g}" for backend, min_confidence in cascade],
+        "detection_rate": hits / len(images),
+        "mean_ms": float(np.mean(latencies)),
+        "selected": dict(selected),
+        "escalation_rate": 1 - selected.get(cascade[0][0], 0) / len(images),
+        "images": per_image,
+    }
+    logging.info(
+        f"{name}: detection rate {summary['detection_rate']:.2f}, mean {summary['mean_ms']:.1f} ms, "
+        f"escalation rate {summary['escalation_rate']:.2f}"
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single detector backends against the detector cascade.")
+    parser.add_argument("--cascade", default="opencv:5,retinaface", help="backend[:min_confidence],...")
+    parser.add_argument("--resolutions", default=",".join(f"{w}x{h}" for w, h in DEFAULT_RESOLUTIONS[:2]))
+    parser.add_argument("--images", default="", help="Directory of single-face images instead of the sample")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from server.utils.detector_cascade import parse_cascade
+
+    cascade = parse_cascade(args.cascade)
+    images = build_images(parse_resolutions(args.resolutions), args.images)
+
+    results: Dict[str, Any] = {"images": len(images)}
+    for backend, _ in cascade:
+        results[backend] = run(backend, [(backend, 0.0)], images, args.iterations)
+    if len(cascade) > 1:
+        results["cascade"] = run("cascade", cascade, images, args.iterations)
+
+    print(save_results("detectors", results, args.output))
+
+
+if __name__ == "__main__":
+    main()
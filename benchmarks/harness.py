@@ -0,0 +1,113 @@
+import datetime
+import json
+import os
+import platform
+import resource
+import time
+import tracemalloc
+from io import BytesIO
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+SAMPLE_IMAGE = os.getcwd() + "/images/sample-face.jpg"
+RESULTS_DIR = os.getcwd() + "/benchmarks/results"
+DEFAULT_RESOLUTIONS = [(640, 480), (1920, 1080), (4000, 3000)]
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    samples = np.asarray(samples_ms)
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p90_ms": float(np.percentile(samples, 90)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mean_ms": float(samples.mean()),
+        "max_ms": float(samples.max()),
+    }
+
+
+def measure(fn: Callable[[], Any], iterations: int = 20, warmup: int = 2) -> Dict[str, Any]:
+    """
+    Time `fn` over `iterations` runs after `warmup` runs.
+
+    Peak memory is measured in one extra run under tracemalloc, so the tracing overhead
+    does not end up in the timings. It covers Python and NumPy allocations, native
+    buffers of OpenCV/TF/PyTorch are only visible in the process-wide `maxrss`.
+    """
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        run_started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - run_started) * 1000)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        **percentiles(timings),
+        "iterations": iterations,
+        "throughput_per_s": iterations / elapsed if elapsed else 0.0,
+        "peak_traced_mb": peak / (1024 * 1024),
+    }
+
+
+def load_sample(path: str = SAMPLE_IMAGE) -> np.ndarray:
+    return np.array(Image.open(path).convert("RGB"))
+
+
+def resize_to(image_np: np.ndarray, resolution: Tuple[int, int]) -> np.ndarray:
+    """Resize (letterbox-free) to `resolution` (width, height), simulating other camera sizes."""
+    return np.array(Image.fromarray(image_np).resize(resolution, Image.BICUBIC))
+
+
+def encode_jpeg(image_np: np.ndarray, quality: int = 90) -> bytes:
+    buffer = BytesIO()
+    Image.fromarray(image_np).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def synthetic_frame(resolution: Tuple[int, int], seed: int = 0) -> np.ndarray:
+    """Face-less frame with smooth gradients and noise, for the reject and no-face paths."""
+    width, height = resolution
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(40, 200, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    noise = rng.normal(0, 12, (height, width, 3)).astype(np.float32)
+    return np.clip(gradient + noise, 0, 255).astype(np.uint8)
+
+
+def parse_resolutions(value: str) -> List[Tuple[int, int]]:
+    return [tuple(int(v) for v in item.split("x")) for item in value.split(",") if item]
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def save_results(name: str, results: Dict[str, Any], output: str = "") -> str:
+    """Write results as JSON, by default to benchmarks/results/<name>-<timestamp>.json."""
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{name}-{stamp}.json")
+
+    with open(output, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+
+    return output
@@ -0,0 +1,150 @@
+"""
+Concurrent face lookups: one query_points call each vs the query coalescer.
+
+Runs against qdrant-client's in-memory local mode (or `--url`). The local mode has no
+network, so `--latency-ms` adds a simulated round trip to every call, as Qdrant Cloud
+would. Every coalesced result is also checked against the direct query_points result
+for the same lookup, ids and scores must match.
+
+Usage:
+    python -m benchmarks.query_coalescing [--url http://localhost:6333] [--gallery 5000]
+                                          [--concurrency 1,8,32] [--lookups 256]
+                                          [--latency-ms 30] [--output results.json]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.harness import percentiles, save_results
+
+
+class DelayedClient:
+    """Adds a fixed round trip to the query calls of a Qdrant client."""
+
+    def __init__(self, client, latency_ms: float):
+        self.client = client
+        self.latency = latency_ms / 1000
+
+    async def query_points(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        return await self.client.query_points(**kwargs)
+
+    async def query_batch_points(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        return await self.client.query_batch_points(**kwargs)
+
+
+async def _run(lookup, requests: List[Any], concurrency: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    timings: List[float] = []
+
+    async def one(request):
+        async with semaphore:
+            started = time.perf_counter()
+            points = await lookup(request)
+            timings.append((time.perf_counter() - started) * 1000)
+            return points
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[one(request) for request in requests])
+    elapsed = time.perf_counter() - started
+
+    return {"results": results, "stats": {**percentiles(timings), "throughput_per_s": len(requests) / elapsed}}
+
+
+async def benchmark(url: str, gallery_size: int, lookups: int, concurrency_levels: List[int], latency_ms: float) -> Dict[str, Any]:
+    from qdrant_client import AsyncQdrantClient, models
+
+    from server.utils import faces_collection
+    from server.utils.query_coalescer import QueryCoalescer
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(gallery_size, 512)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    payloads = [{"user_id": f"user-{i}", "store_id": f"store-{i % 20}"} for i in range(gallery_size)]
+
+    collection = "bench_faces_coalescing"
+    base = AsyncQdrantClient(url) if url != ":memory:" else AsyncQdrantClient(":memory:")
+    if await base.collection_exists(collection):
+        await base.delete_collection(collection)
+    await base.create_collection(collection, vectors_config=faces_collection.vectors_config())
+    await base.upsert(
+        collection,
+        points=[models.PointStruct(id=i, vector=vectors[i].tolist(), payload=payloads[i]) for i in range(gallery_size)],
+        wait=True,
+    )
+    client = DelayedClient(base, latency_ms)
+
+    targets = rng.choice(gallery_size, size=lookups)
+    requests = [
+        models.QueryRequest(
+            query=faces_collection.normalize(vectors[i] + rng.normal(scale=0.02, size=512)),
+            filter=faces_collection.store_filter(f"store-{i % 20}") if n % 2 else None,
+            limit=1,
+            with_payload=["user_id"],
+            score_threshold=0.85,
+        )
+        for n, i in enumerate(targets)
+    ]
+
+    async def direct(request):
+        response = await client.query_points(
+            collection_name=collection,
+            query=request.query,
+            query_filter=request.filter,
+            limit=request.limit,
+            with_payload=request.with_payload,
+            score_threshold=request.score_threshold,
+        )
+        return response.points
+
+    results = {"gallery_size": gallery_size, "lookups": lookups, "latency_ms": latency_ms, "concurrency": {}}
+    for concurrency in concurrency_levels:
+        coalescer = QueryCoalescer(collection_name=collection)
+
+        reference = await _run(direct, requests, concurrency)
+        coalesced = await _run(lambda request: coalescer.query(client, request), requests, concurrency)
+
+        mismatches = sum(
+            [(p.id, round(p.score, 5)) for p in a] != [(p.id, round(p.score, 5)) for p in b]
+            for a, b in zip(reference["results"], coalesced["results"])
+        )
+
+        results["concurrency"][concurrency] = {
+            "query_points": reference["stats"],
+            "coalesced": {**coalesced["stats"], **coalescer.stats()},
+            "mismatched_results": mismatches,
+        }
+        logging.info(
+            f"concurrency {concurrency}: p50 {reference['stats']['p50_ms']:.1f} -> {coalesced['stats']['p50_ms']:.1f} ms, "
+            f"avg batch {coalescer.stats()['avg_batch_size']:.1f}, mismatches {mismatches}"
+        )
+
+    await base.delete_collection(collection)
+    await base.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query coalescer against one query_points call per lookup.")
+    parser.add_argument("--url", default=":memory:")
+    parser.add_argument("--gallery", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=256)
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="Simulated round trip per call")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    results = asyncio.run(benchmark(args.url, args.gallery, args.lookups, levels, args.latency_ms))
+    print(save_results("query_coalescing", results, args.output))
+
+
+if __name__ == "__main__":
+    main()
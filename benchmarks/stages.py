@@ -0,0 +1,333 @@
+"""
+Per-stage microbenchmarks of the face pipeline.
+
+Runs offline: the images are the bundled sample face resized to several camera
+resolutions plus synthetic face-less frames, Qdrant is the in-memory local mode of
+qdrant-client and the JWT keys are generated locally. The DeepFace weights must
+already be in DEEPFACE_HOME.
+
+Usage:
+    python -m benchmarks.stages [--stages decode,enhance,...] [--resolutions 640x480,4000x3000]
+                                [--iterations 20] [--output results.json]
+"""
+import argparse
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from benchmarks.harness import (
+    DEFAULT_RESOLUTIONS, encode_jpeg, load_sample, measure, parse_resolutions, resize_to,
+    save_results, synthetic_frame,
+)
+
+STAGES: Dict[str, Callable[..., Dict[str, Any]]] = {}
+
+
+def stage(name: str):
+    def register(fn):
+        STAGES[name] = fn
+        return fn
+    return register
+
+
+def _cosine(a, b) -> float:
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def _decode_pil(image_data: bytes) -> np.ndarray:
+    """The decode path before cv2.imdecode: BytesIO, PIL, convert to RGB, copy to NumPy."""
+    from io import BytesIO
+    from PIL import Image
+
+    pil_image = Image.open(BytesIO(image_data))
+    if pil_image.mode != "RGB":
+        pil_image = pil_image.convert("RGB")
+    return np.array(pil_image)
+
+
+def _upload(data: bytes):
+    from io import BytesIO
+    from fastapi import UploadFile
+
+    return UploadFile(file=BytesIO(data), size=len(data))
+
+
+def _request_legacy(data: bytes) -> np.ndarray:
+    async def read():
+        return await _upload(data).read()
+    return _decode_pil(asyncio.run(read()))
+
+
+def _request(data: bytes) -> np.ndarray:
+    from server.pipeline import decode_image
+    from server.utils.upload_limit import read_upload
+
+    return decode_image(asyncio.run(read_upload(_upload(data))))
+
+
+@stage("decode")
+def bench_decode(images: Dict[str, np.ndarray], iterations: int) -> Dict[str, Any]:
+    """
+    Decode latency and peak memory. "request_*" cover a whole upload, read into memory
+    and decoded, so their peak_traced_mb is the memory one request holds.
+    """
+    from server.pipeline import DECODE_MAX_SIDE, decode_image
+
+    results = {}
+    for label, image_np in images.items():
+        data = encode_jpeg(image_np)
+        results[label] = {
+            "jpeg_bytes": len(data),
+            "decoded_mb": image_np.nbytes / (1024 * 1024),
+            "pil": measure(lambda: _decode_pil(data), iterations),
+            "full": measure(lambda: decode_image(data), iterations),
+            "reduced": measure(lambda: decode_image(data, max_side=DECODE_MAX_SIDE), iterations),
+            "request_legacy": measure(lambda: _request_legacy(data), iterations),
+            "request": measure(lambda: _request(data), iterations),
+            "max_abs_diff_pil_vs_cv2": int(np.abs(_decode_pil(data).astype(np.int16) - decode_image(data).astype(np.int16)).max()),
+        }
+    return results
+
+
+@stage("enhance")
+def bench_enhance(images: Dict[str, np.ndarray], iterations: int) -> Dict[str, Any]:
+    import face_recognition
+
+    results = {}
+    for label, image_np in images.items():
+        legacy = face_recognition._auto_exposure(image_np=image_np)
+        fused = face_recognition._fused_auto_exposure(image_np=image_np)
+        diff = np.abs(legacy.astype(np.int16) - fused.astype(np.int16))
+
+        results[label] = {
+            "detail_enhance": measure(lambda: cv2.detailEnhance(image_np, sigma_s=4, sigma_r=0.09), iterations),
+            "auto_exposure_legacy": measure(lambda: face_recognition._auto_exposure(image_np=image_np), iterations),
+            "auto_exposure_fused": measure(lambda: face_recognition._fused_auto_exposure(image_np=image_np), iterations),
+            "fused_parity": {
+                "max_abs_diff": int(diff.max()),
+                "differing_pixels_ratio": float((diff.max(axis=2) > 0).mean()),
+            },
+        }
+    return results
+
+
+@stage("quality")
+def bench_quality(images: Dict[str, np.ndarray], iterations: int) -> Dict[str, Any]:
+    from server.utils.quality import measure_quality
+
+    return {label: measure(lambda: measure_quality(image_np), iterations) for label, image_np in images.items()}
+
+
+@stage("detection")
+def bench_detection(images: Dict[str, np.ndarray], iterations: int) -> Dict[str, Any]:
+    from deepface.modules import detection, modeling
+
+    spoof_model = modeling.build_model(task="spoofing", model_name="Fasnet")
+
+    results = {}
+    for label, image_np in images.items():
+        faces = detection.extract_faces(img_path=image_np, detector_backend="opencv", enforce_detection=False, anti_spoofing=False)
+        area = faces[0]["facial_area"]
+        box = (area["x"], area["y"], area["w"], area["h"])
+
+        results[label] = {
+            "extract_faces": measure(
+                lambda: detection.extract_faces(img_path=image_np, detector_backend="opencv", enforce_detection=False, anti_spoofing=False),
+                iterations
+            ),
+            "anti_spoofing": measure(lambda: spoof_model.analyze(img=image_np, facial_area=box), iterations),
+        }
+    return results
+
+
+@stage("forward")
+def bench_forward(images: Dict[str, np.ndarray], iterations: int) -> Dict[str, Any]:
+    import face_recognition
+    from deepface.modules import modeling
+
+    model = modeling.build_model(task="facial_recognition", model_name="Facenet512")
+    face = np.random.default_rng(0).random((1, 160, 160, 3), dtype=np.float32)
+
+    results = {"single": measure(lambda: model.forward(face), iterations)}
+    for batch_size in (1, 4, 8, 16):
+        batch = np.repeat(face, batch_size, axis=0)
+        timing = measure(lambda: face_recognition.forward_batch(batch), iterations)
+        timing["faces_per_s"] = timing["throughput_per_s"] * batch_size
+        results[f"batch_{batch_size}"] = timing
+    return results
+
+
+def _rejected(fn, *args):
+    try:
+        fn(*args)
+    except ValueError:
+        pass
+
+
+@stage("pipeline")
+def bench_pipeline(images: Dict[str, np.ndarray], iterations: int) -> Dict[str, Any]:
+    """Full against reduced pipeline mode: latency, and embedding agreement as accuracy proxy."""
+    from server.pipeline import extract_embeddings
+
+    results = {}
+    for label, image_np in images.items():
+        data = encode_jpeg(image_np)
+        try:
+            full = extract_embeddings(data, mode="full")
+            reduced = extract_embeddings(data, mode="reduced")
+        except ValueError as e:
+            # no face or rejected by the quality gate, e.g. synthetic frames
+            results[label] = {
+                "rejected": str(e),
+                "full": measure(lambda: _rejected(extract_embeddings, data, "full"), iterations, warmup=1),
+                "reduced": measure(lambda: _rejected(extract_embeddings, data, "reduced"), iterations, warmup=1),
+            }
+            continue
+
+        results[label] = {
+            "full": measure(lambda: extract_embeddings(data, mode="full"), iterations, warmup=1),
+            "reduced": measure(lambda: extract_embeddings(data, mode="reduced"), iterations, warmup=1),
+            "faces": {"full": len(full), "reduced": len(reduced)},
+            "embedding_cosine_full_vs_reduced": _cosine(full[0]["embedding"], reduced[0]["embedding"]) if full and reduced else None,
+            "is_real": {"full": full[0].get("is_real") if full else None, "reduced": reduced[0].get("is_real") if reduced else None},
+        }
+    return results
+
+
+@stage("face_box")
+def bench_face_box(images: Dict[str, np.ndarray], iterations: int) -> Dict[str, Any]:
+    """
+    Full pipeline against a client-supplied face box (the box the server's own detector
+    finds, standing in for the kiosk tracker): latency, embedding agreement and liveness.
+    """
+    from server.pipeline import extract_embeddings
+
+    results = {}
+    for label, image_np in images.items():
+        data = encode_jpeg(image_np)
+        try:
+            full = extract_embeddings(data, mode="full")
+        except ValueError as e:
+            results[label] = {"rejected": str(e)}
+            continue
+
+        faces = _detect_box(image_np)
+        if not faces:
+            results[label] = {"rejected": "no face for the client box"}
+            continue
+
+        box = {key: int(faces[0][key]) for key in ("x", "y", "w", "h")}
+        with_box = extract_embeddings(data, face_box=box)
+
+        results[label] = {
+            "face_box": box,
+            "full": measure(lambda: extract_embeddings(data, mode="full"), iterations, warmup=1),
+            "client_box": measure(lambda: extract_embeddings(data, face_box=box), iterations, warmup=1),
+            "embedding_cosine_full_vs_box": _cosine(full[0]["embedding"], with_box[0]["embedding"]),
+            "is_real": {"full": full[0].get("is_real"), "client_box": with_box[0].get("is_real")},
+        }
+    return results
+
+
+def _detect_box(image_np: np.ndarray) -> List[Dict[str, int]]:
+    from deepface.modules import detection
+
+    faces = detection.extract_faces(img_path=image_np, detector_backend="opencv", enforce_detection=False, anti_spoofing=False)
+    return [face["facial_area"] for face in faces if face["confidence"]]
+
+
+@stage("search")
+def bench_search(images: Dict[str, np.ndarray], iterations: int, gallery_size: int = 5000) -> Dict[str, Any]:
+    """Qdrant query (in-memory local mode) against the in-process NumPy replica."""
+    from qdrant_client import QdrantClient, models
+    from server.utils.gallery import FaceGallery
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(gallery_size, 512)).astype(np.float32)
+    ids = [str(i) for i in range(gallery_size)]
+    payloads = [{"user_id": f"user-{i}", "store_id": f"store-{i % 20}"} for i in range(gallery_size)]
+    query = (vectors[42] + rng.normal(scale=0.1, size=512)).tolist()
+
+    client = QdrantClient(":memory:")
+    client.create_collection("faces", vectors_config=models.VectorParams(size=512, distance=models.Distance.COSINE))
+    client.upload_collection("faces", vectors=vectors, payload=payloads, ids=list(range(gallery_size)))
+
+    gallery = FaceGallery(collection_name="faces", snapshot_dir="")
+    gallery._set(vectors / np.linalg.norm(vectors, axis=1, keepdims=True), ids, payloads)
+
+    return {
+        "gallery_size": gallery_size,
+        "qdrant_local_query": measure(
+            lambda: client.query_points("faces", query=query, limit=1, with_payload=["user_id"], score_threshold=0.85),
+            iterations
+        ),
+        "replica_search": measure(lambda: gallery.search(query, limit=1, with_payload=["user_id"], score_threshold=0.85), iterations),
+        "replica_search_store_scoped": measure(
+            lambda: gallery.search(query, limit=1, with_payload=["user_id"], score_threshold=0.85, store_id="store-2"),
+            iterations
+        ),
+    }
+
+
+@stage("jwt")
+def bench_jwt(images: Dict[str, np.ndarray], iterations: int) -> Dict[str, Any]:
+    """create_signed_jwt and verify_signed_jwt per algorithm."""
+    from server.utils import jwt_helper
+    from server.utils.rsa_keys import SUPPORTED_ALGORITHMS, RSAKeyManager
+
+    original = jwt_helper.rsa_manager
+    results = {}
+    try:
+        for algorithm in SUPPORTED_ALGORITHMS:
+            jwt_helper.rsa_manager = RSAKeyManager(algorithm=algorithm)
+            token = jwt_helper.create_signed_jwt(payload={"user_id": "benchmark"})
+            results[algorithm] = {
+                "sign": measure(lambda: jwt_helper.create_signed_jwt(payload={"user_id": "benchmark"}), iterations * 10),
+                "verify": measure(lambda: jwt_helper.verify_signed_jwt(token), iterations * 10),
+            }
+    finally:
+        jwt_helper.rsa_manager = original
+    return results
+
+
+def build_images(resolutions: List[Tuple[int, int]]) -> Dict[str, np.ndarray]:
+    sample = load_sample()
+    images = {f"sample_{w}x{h}": resize_to(sample, (w, h)) for w, h in resolutions}
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage microbenchmarks of the face pipeline.")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma separated, from: {', '.join(STAGES)}")
+    parser.add_argument("--resolutions", default=",".join(f"{w}x{h}" for w, h in DEFAULT_RESOLUTIONS))
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--synthetic", action="store_true", help="Also run on synthetic face-less frames")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    resolutions = parse_resolutions(args.resolutions)
+    images = build_images(resolutions)
+    if args.synthetic:
+        images.update({f"synthetic_{w}x{h}": synthetic_frame((w, h)) for w, h in resolutions})
+
+    results = {}
+    for name in args.stages.split(","):
+        logging.info(f"Running stage benchmark: {name}")
+        try:
+            results[name] = STAGES[name](images, args.iterations)
+        except Exception as e:
+            # keep going, a missing model or weight file only fails its own stage
+            logging.error(f"Stage {name} failed: {e}")
+            results[name] = {"error": str(e)}
+
+    print(save_results("stages", results, args.output))
+
+
+if __name__ == "__main__":
+    main()
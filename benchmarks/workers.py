@@ -0,0 +1,141 @@
+"""
+Per-worker memory and aggregate throughput of forked workers against one process.
+
+- "single": one process with default library threading and an inference thread pool
+  of `--workers` threads, the setup of main.py.
+- "forked": the serve.py setup. Models are preloaded and warmed in a parent, then
+  `--workers` processes are forked and share the weights copy-on-write.
+
+Each mode runs in its own interpreter (threading settings cannot be changed once the
+libraries are initialized). Every worker or thread embeds the sample image in a loop
+for `--duration` seconds; memory (RSS, PSS, private) is read at the end of the run.
+
+Usage:
+    python -m benchmarks.workers [--mode single,forked] [--workers 4] [--duration 30]
+                                 [--output results.json]
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from benchmarks.harness import SAMPLE_IMAGE, encode_jpeg, load_sample, save_results
+
+
+def _embed_loop(image_data: bytes, duration: float) -> int:
+    from server.pipeline import extract_embeddings
+
+    count = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        extract_embeddings(image_data)
+        count += 1
+    return count
+
+
+def run_single(workers: int, duration: float) -> Dict[str, Any]:
+    from server.utils.inference_pool import warm_up_model
+    from server.utils.process_memory import process_memory
+
+    image_data = encode_jpeg(load_sample())
+    warm_up_model(SAMPLE_IMAGE)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        counts = list(executor.map(lambda _: _embed_loop(image_data, duration), range(workers)))
+
+    return {
+        "throughput_per_s": sum(counts) / duration,
+        "processes": [process_memory()],
+    }
+
+
+def run_forked(workers: int, duration: float) -> Dict[str, Any]:
+    import serve
+
+    serve.configure_environment()
+    from server.utils.process_memory import process_memory
+
+    image_data = encode_jpeg(load_sample())
+    serve.preload()
+    parent_memory = process_memory()
+
+    pipes = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            count = _embed_loop(image_data, duration)
+            # read while the siblings are still alive, so PSS splits the shared pages between them
+            with os.fdopen(write_fd, "w") as f:
+                json.dump({"count": count, "memory": process_memory()}, f)
+            time.sleep(1)
+            os._exit(0)
+
+        os.close(write_fd)
+        pipes.append((pid, read_fd))
+
+    reports = []
+    for pid, read_fd in pipes:
+        with os.fdopen(read_fd) as f:
+            reports.append(json.load(f))
+        os.waitpid(pid, 0)
+
+    return {
+        "throughput_per_s": sum(report["count"] for report in reports) / duration,
+        "parent": parent_memory,
+        "processes": [report["memory"] for report in reports],
+    }
+
+
+def _summary(result: Dict[str, Any]) -> Dict[str, Any]:
+    processes: List[Dict[str, float]] = result["processes"]
+    total_pss = sum(memory["pss"] for memory in processes) + result.get("parent", {}).get("pss", 0.0)
+    return {
+        **result,
+        "max_worker_rss_mb": max(memory["rss"] for memory in processes),
+        "max_worker_private_mb": max(memory["private"] for memory in processes),
+        "total_pss_mb": total_pss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forked workers vs single process: memory and throughput.")
+    parser.add_argument("--mode", default="single,forked")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--output", default="")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run = run_forked if args.child == "forked" else run_single
+        print(json.dumps(run(args.workers, args.duration)))
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    results = {}
+    for mode in args.mode.split(","):
+        logging.info(f"Running {mode} with {args.workers} workers for {args.duration}s...")
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.workers", "--child", mode,
+             "--workers", str(args.workers), "--duration", str(args.duration)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results[mode] = _summary(json.loads(output.strip().splitlines()[-1]))
+        logging.info(
+            f"{mode}: {results[mode]['throughput_per_s']:.2f} images/s, "
+            f"total PSS {results[mode]['total_pss_mb']:.0f} MB"
+        )
+
+    print(save_results("workers", {"workers": args.workers, "duration_s": args.duration, "modes": results}, args.output))
+
+
+if __name__ == "__main__":
+    main()
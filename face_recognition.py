@@ -1,4 +1,6 @@
-﻿from typing import Union
+﻿import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy
 from PIL import Image
@@ -9,6 +11,12 @@ from deepface.models.FacialRecognition import FacialRecognition
 import cv2
 import numpy as np
 
+from server.utils import metrics
+
+# "deepface" runs the Keras/PyTorch models, "onnx" runs the exported models in ONNX Runtime
+# (needs requirements-onnx.txt)
+FACE_ENGINE = os.getenv("FACE_ENGINE", "deepface")
+
 
 def _auto_exposure(
     image_np,
@@ -65,6 +73,152 @@ def _auto_exposure(
     return balanced_image
 
 
+# per-thread scratch buffers for the fused exposure pass, keyed by image shape
+_exposure_buffers = threading.local()
+
+# every possible 8-bit value, used to evaluate per-pixel operations once per level
+_LEVELS = np.arange(256, dtype=np.uint8)
+
+
+def _get_exposure_buffers(shape: tuple) -> Dict[str, np.ndarray]:
+    buffers = getattr(_exposure_buffers, "buffers", None)
+
+    if buffers is None or buffers["rgb"].shape != shape:
+        buffers = {
+            "gray": np.empty(shape[:2], dtype=np.uint8),
+            "rgb": np.empty(shape, dtype=np.uint8),
+            "hsv": np.empty(shape, dtype=np.uint8),
+        }
+        _exposure_buffers.buffers = buffers
+
+    return buffers
+
+
+def _fused_auto_exposure(
+    image_np,
+    alpha=1.2,
+    beta=10,
+    saturation=25,
+    target_brightness=122,
+    shadow_percentile=5,
+    highlight_percentile=95
+) -> np.ndarray:
+    """
+    Same result as `_auto_exposure`, with fewer full-image passes and allocations.
+
+    The histogram is computed once and everything else is derived from it:
+    the mean of the contrast-stretched image is computed per gray level instead of
+    per pixel, contrast and brightness become one 256-entry lookup table, and the
+    saturation boost is a per-channel lookup table applied in place on the HSV image
+    (no split/merge). Intermediate buffers are reused per thread.
+
+    Parameters:
+        Same as `_auto_exposure`.
+
+    Returns:
+        numpy.ndarray: Balanced image (a new array, the scratch buffers are not exposed).
+    """
+    image_np = np.ascontiguousarray(image_np)
+    buffers = _get_exposure_buffers(image_np.shape)
+
+    gray = cv2.cvtColor(src=image_np, code=cv2.COLOR_RGB2GRAY, dst=buffers["gray"])
+
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
+    cdf = hist.cumsum()
+    cdf_normalized = cdf / cdf[-1]
+
+    shadow_threshold = np.searchsorted(cdf_normalized, shadow_percentile / 100.0)
+    highlight_threshold = np.searchsorted(cdf_normalized, highlight_percentile / 100.0)
+
+    # contrast stretching evaluated with the exact expression of `_auto_exposure`, but
+    # on the 256 gray levels only, then weighted by the histogram to get the mean
+    stretched_levels = np.clip((_LEVELS - shadow_threshold) * (255 / (highlight_threshold - shadow_threshold)), 0, 255).astype(np.uint8)
+    mean_brightness = np.dot(hist[:, 0].astype(np.float64), stretched_levels) / cdf[-1]
+    brightness_correction = target_brightness - mean_brightness
+
+    # contrast + brightness as one table, built by convertScaleAbs itself for identical rounding
+    tone_lut = cv2.convertScaleAbs(_LEVELS.reshape(1, 256), alpha=alpha, beta=beta + brightness_correction)
+    adjusted_image = cv2.LUT(image_np, tone_lut, dst=buffers["rgb"])
+
+    hsv_image = cv2.cvtColor(adjusted_image, cv2.COLOR_RGB2HSV, dst=buffers["hsv"])
+
+    # identity on H and V, saturating add on S
+    saturation_lut = np.repeat(_LEVELS.reshape(1, 256, 1), 3, axis=2)
+    saturation_lut[0, :, 1] = cv2.add(_LEVELS, saturation).reshape(256)
+    cv2.LUT(hsv_image, saturation_lut, dst=hsv_image)
+
+    return cv2.cvtColor(hsv_image, cv2.COLOR_HSV2RGB)
+
+
+def forward_batch(batch: np.ndarray, model_name: str = "Facenet512") -> np.ndarray:
+    """
+    Runs one forward pass over a batch of preprocessed faces.
+
+    Parameters:
+        batch (numpy.ndarray): Faces of shape (N, H, W, C), already resized and normalized.
+        model_name (str): Model for face recognition (default is Facenet512).
+
+    Returns:
+        numpy.ndarray: Embeddings of shape (N, dimensions).
+    """
+    if FACE_ENGINE == "onnx" and model_name == "Facenet512":
+        import onnx_engine
+        return onnx_engine.get_facenet().forward_batch(batch)
+
+    model: FacialRecognition = modeling.build_model(
+        task="facial_recognition",
+        model_name=model_name
+    )
+
+    # call the keras model directly, model.forward() only returns the first row
+    return model.model(batch, training=False).numpy()
+
+
+def detect_faces(
+        img: np.ndarray,
+        cascade: Sequence[Tuple[str, float]],
+        enforce_detection: bool = True,
+        align: bool = True,
+        expand_percentage: int = 0,
+        anti_spoofing: bool = False,
+) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    Detects faces with a cascade of detector backends.
+
+    The backends run in order, and the faces of the first one that finds a face with a
+    confidence of at least its threshold are returned. The last backend is used as is
+    and raises like `detection.extract_faces` when `enforce_detection` is set.
+
+    Args:
+        img (np.ndarray): Image to detect faces in.
+
+        cascade (list): (detector backend, minimum confidence) pairs, fastest first,
+            e.g. [("opencv", 5.0), ("retinaface", 0.0)]. The confidence scale depends
+            on the backend.
+
+    Returns:
+        The face objects of `detection.extract_faces` and the backend that found them.
+    """
+    for position, (backend, min_confidence) in enumerate(cascade):
+        last = position == len(cascade) - 1
+
+        with metrics.stage(f"detection_{backend}"):
+            img_objs = detection.extract_faces(
+                img_path=img,
+                detector_backend=backend,
+                grayscale=False,
+                enforce_detection=enforce_detection and last,
+                align=align,
+                expand_percentage=expand_percentage,
+                anti_spoofing=anti_spoofing,
+            )
+
+        # without enforce_detection, "no face" is the whole image with confidence 0
+        confidence = max((img_obj["confidence"] or 0) for img_obj in img_objs) if img_objs else 0
+        if last or (confidence > 0 and confidence >= min_confidence):
+            return img_objs, backend
+
+
 def embedding(
         image_path: Union[str, np.ndarray],
         model_name: str = "Facenet512",
@@ -74,6 +228,11 @@ def embedding(
         expand_percentage: int = 0,
         normalization: str = "base",
         anti_spoofing: bool = True,
+        forward_fn: Optional[Callable[[np.ndarray], List[float]]] = None,
+        enhancement: str = "legacy",
+        engine: Optional[str] = None,
+        detector_cascade: Optional[Sequence[Tuple[str, float]]] = None,
+        facial_area: Optional[Tuple[int, int, int, int]] = None,
 ):
     """
     Extracts multidimensional vector embeddings from the faces in the image.
@@ -108,6 +267,23 @@ def embedding(
 
         anti_spoofing (boolean): Flag to enable anti spoofing (default is True).
 
+        forward_fn (callable): Function used instead of `model.forward` to turn a preprocessed
+            face into its embedding, e.g. a micro-batching scheduler (default is None).
+
+        enhancement (string): Auto exposure implementation. Options: 'legacy' or 'fused'
+            (default is legacy).
+
+        engine (string): Inference engine for Facenet512 and anti spoofing. Options: 'deepface'
+            or 'onnx' (default is the FACE_ENGINE environment variable, else deepface).
+
+        detector_cascade (list): (detector backend, minimum confidence) pairs, tried in
+            order until one finds a confident face, see `detect_faces`. Overrides
+            `detector_backend` (default is None).
+
+        facial_area (tuple): Known face box (x, y, w, h), e.g. from the client's face
+            tracker. Detection is skipped, the box is embedded with the 'skip' backend and
+            anti spoofing still looks at the box in the whole image (default is None).
+
     Returns:
         results (List[Dict[str, Any]]): A list of dictionaries, each containing the
             following fields:
@@ -125,34 +301,78 @@ def embedding(
             to 'skip', the confidence will be 0 and is nonsensical.
 
         - is_real (bool): Flag to indicate if the face is real or spoofed. If `anti_spoofing` is set.
+
+        - detector_backend (str): Detector backend that found the face.
     """
     resp_objs = []
+    engine = engine or FACE_ENGINE
 
-    model: FacialRecognition = modeling.build_model(
-        task="facial_recognition",
-        model_name=model_name
-    )
+    if engine == "onnx" and model_name == "Facenet512":
+        import onnx_engine
+
+        model = onnx_engine.get_facenet()
+        spoof_model = onnx_engine.get_fasnet() if anti_spoofing else None
+    else:
+        model: FacialRecognition = modeling.build_model(
+            task="facial_recognition",
+            model_name=model_name
+        )
+        spoof_model = None
+
+    cascade = list(detector_cascade or [(detector_backend, 0.0)])
+    if anti_spoofing and spoof_model is None and (len(cascade) > 1 or facial_area is not None):
+        # run anti spoofing once on the accepted faces, not in every backend tried
+        spoof_model = modeling.build_model(task="spoofing", model_name="Fasnet")
 
     target_size = model.input_shape
+    forward = forward_fn or model.forward
     img = image_path
 
     if isinstance(img, str):
         pil_image = Image.open(img)
         img = numpy.array(pil_image)
 
-    balanced_image = _auto_exposure(image_np=img)
-
-    img_objs = detection.extract_faces(
-        img_path=balanced_image,
-        detector_backend=detector_backend,
-        grayscale=False,
-        enforce_detection=enforce_detection,
-        align=align,
-        expand_percentage=expand_percentage,
-        anti_spoofing=anti_spoofing,
-    )
+    with metrics.stage("exposure"):
+        if enhancement == "fused":
+            balanced_image = _fused_auto_exposure(image_np=img)
+        else:
+            balanced_image = _auto_exposure(image_np=img)
+
+    if facial_area is not None:
+        x, y, w, h = facial_area
+        img_objs = detection.extract_faces(
+            img_path=balanced_image[y:y + h, x:x + w],
+            detector_backend="skip",
+            grayscale=False,
+            enforce_detection=False,
+            align=False,
+            anti_spoofing=False,
+        )
+        # "skip" reports the crop itself, anti spoofing needs the box in the whole image
+        for img_obj in img_objs:
+            img_obj["facial_area"] = {"x": x, "y": y, "w": w, "h": h}
+        used_backend = "skip"
+    else:
+        # with the deepface engine and a single backend this includes anti spoofing
+        with metrics.stage("detection"):
+            img_objs, used_backend = detect_faces(
+                balanced_image,
+                cascade,
+                enforce_detection=enforce_detection,
+                align=align,
+                expand_percentage=expand_percentage,
+                anti_spoofing=anti_spoofing and spoof_model is None,
+            )
 
     for img_obj in img_objs:
+        if spoof_model is not None:
+            area = img_obj["facial_area"]
+            with metrics.stage("liveness"):
+                img_obj["is_real"], img_obj["antispoof_score"] = spoof_model.analyze(
+                    img=balanced_image,
+                    facial_area=(area["x"], area["y"], area["w"], area["h"])
+                )
+
         img = img_obj["face"]
 
         # rgb to bgr
@@ -169,12 +389,14 @@ def embedding(
         # custom normalization
         img = preprocessing.normalize_input(img=img, normalization=normalization)
 
-        vectors = model.forward(img)
+        with metrics.stage("embedding"):
+            vectors = forward(img)
 
         resp_objs.append(
             {
                 "embedding": vectors,
                 "face_confidence": confidence,
+                "detector_backend": used_backend,
             }
         )
 
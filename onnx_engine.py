@@ -0,0 +1,273 @@
+"""
+ONNX Runtime CPU engine for Facenet512 and the MiniFASNet anti-spoofing models.
+
+The models are exported once from the DeepFace weights (Keras Facenet512 and the two
+PyTorch MiniFASNet models), optionally with int8 dynamic quantization, and then run in
+ONNX Runtime. Workers using this engine never load the Keras or PyTorch weights.
+
+ONNX Runtime is optional: install it with `pip install -r requirements-onnx.txt`,
+which also brings tf2onnx for exporting.
+
+Usage:
+    python -m onnx_engine export [--quantize]
+    python -m onnx_engine report [--quantized] [--runs 20]
+"""
+import argparse
+import json
+import os
+import resource
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.getcwd() + "/.onnx")
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "false").lower() == "true"
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+
+FACENET_FILE = "facenet512.onnx"
+# crop scale around the face box -> model file, same pairing as DeepFace's Fasnet
+FASNET_FILES = {
+    2.7: "minifasnet_v2.onnx",
+    4.0: "minifasnet_v1se.onnx",
+}
+
+_lock = threading.Lock()
+_facenet: Optional["OnnxFacenet"] = None
+_fasnet: Optional["OnnxFasnet"] = None
+
+
+def _model_path(file_name: str, quantized: bool, model_dir: str = ONNX_MODEL_DIR) -> str:
+    if quantized:
+        file_name = file_name.replace(".onnx", ".int8.onnx")
+    return os.path.join(model_dir, file_name)
+
+
+def _create_session(path: str, threads: int = ONNX_THREADS):
+    import onnxruntime as ort
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"ONNX model not found at {path}, run `python -m onnx_engine export` first")
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        options.intra_op_num_threads = threads
+
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+class OnnxFacenet:
+    """Facenet512 in ONNX Runtime, same contract as DeepFace's FacialRecognition."""
+
+    input_shape = (160, 160)
+    output_shape = 512
+
+    def __init__(self, path: str):
+        self.session = _create_session(path)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward_batch(self, batch: np.ndarray) -> np.ndarray:
+        """Embeddings of shape (N, 512) for faces of shape (N, 160, 160, 3)."""
+        return self.session.run(None, {self.input_name: batch.astype(np.float32, copy=False)})[0]
+
+    def forward(self, img: np.ndarray) -> List[float]:
+        """Embedding of a single preprocessed face of shape (1, 160, 160, 3)."""
+        if img.ndim == 3:
+            img = np.expand_dims(img, axis=0)
+        return self.forward_batch(img)[0].tolist()
+
+
+class OnnxFasnet:
+    """The two MiniFASNet models in ONNX Runtime, same contract as DeepFace's Fasnet."""
+
+    def __init__(self, paths: Dict[float, str]):
+        self.sessions = {scale: _create_session(path) for scale, path in paths.items()}
+
+    def analyze(self, img: np.ndarray, facial_area: Union[list, tuple]) -> Tuple[bool, float]:
+        """
+        Analyze whether the face in `facial_area` (x, y, w, h) of `img` is real.
+
+        Returns:
+            is_real (bool), antispoof_score (float)
+        """
+        from deepface.models.spoofing.FasNet import crop
+
+        prediction = np.zeros((1, 3), dtype=np.float32)
+
+        for scale, session in self.sessions.items():
+            face = crop(img, tuple(facial_area), scale, 80, 80)
+            # HWC -> NCHW, no rescaling (same as the ToTensor of the PyTorch models)
+            tensor = face.transpose((2, 0, 1))[np.newaxis].astype(np.float32)
+            logits = session.run(None, {session.get_inputs()[0].name: tensor})[0]
+
+            exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+            prediction += exp / exp.sum(axis=1, keepdims=True)
+
+        label = int(np.argmax(prediction))
+        return label == 1, float(prediction[0][label] / 2)
+
+
+def get_facenet(quantized: bool = ONNX_QUANTIZED) -> OnnxFacenet:
+    """Get the process-wide Facenet512 session, created on first use."""
+    global _facenet
+    with _lock:
+        if _facenet is None:
+            _facenet = OnnxFacenet(_model_path(FACENET_FILE, quantized))
+        return _facenet
+
+
+def get_fasnet(quantized: bool = ONNX_QUANTIZED) -> OnnxFasnet:
+    """Get the process-wide MiniFASNet sessions, created on first use."""
+    global _fasnet
+    with _lock:
+        if _fasnet is None:
+            _fasnet = OnnxFasnet({scale: _model_path(name, quantized) for scale, name in FASNET_FILES.items()})
+        return _fasnet
+
+
+def export_models(model_dir: str = ONNX_MODEL_DIR, quantize: bool = False) -> List[str]:
+    """Export Facenet512 and both MiniFASNet models from DeepFace to ONNX."""
+    import tensorflow as tf
+    import tf2onnx
+    import torch
+    from deepface.modules import modeling
+
+    os.makedirs(model_dir, exist_ok=True)
+    exported = []
+
+    facenet = modeling.build_model(task="facial_recognition", model_name="Facenet512")
+    path = _model_path(FACENET_FILE, False, model_dir)
+    tf2onnx.convert.from_keras(
+        facenet.model,
+        input_signature=[tf.TensorSpec((None, 160, 160, 3), tf.float32, name="input")],
+        opset=13,
+        output_path=path,
+    )
+    exported.append(path)
+
+    fasnet = modeling.build_model(task="spoofing", model_name="Fasnet")
+    for scale, model in ((2.7, fasnet.first_model), (4.0, fasnet.second_model)):
+        path = _model_path(FASNET_FILES[scale], False, model_dir)
+        torch.onnx.export(
+            model.eval(),
+            torch.zeros(1, 3, 80, 80),
+            path,
+            input_names=["input"],
+            output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=13,
+        )
+        exported.append(path)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        for path in list(exported):
+            quantized_path = path.replace(".onnx", ".int8.onnx")
+            quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+            exported.append(quantized_path)
+
+    return exported
+
+
+def _rss_mb() -> float:
+    # current RSS from /proc, falls back to the peak on platforms without it
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _median_ms(fn, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return float(np.median(timings))
+
+
+def parity_report(image_path: str, quantized: bool = False, runs: int = 20) -> Dict:
+    """
+    Compare the ONNX engine against DeepFace on `image_path`: embedding cosine
+    similarity, anti-spoofing agreement, median latency and RSS growth of each engine.
+    """
+    from deepface.modules import detection, modeling, preprocessing
+    from PIL import Image
+    import face_recognition
+
+    image = np.array(Image.open(image_path).convert("RGB"))
+    face_obj = detection.extract_faces(img_path=image, detector_backend="opencv", anti_spoofing=False)[0]
+    area = face_obj["facial_area"]
+    facial_area = (area["x"], area["y"], area["w"], area["h"])
+    face = preprocessing.resize_image(img=face_obj["face"][:, :, ::-1], target_size=(160, 160))
+
+    rss_start = _rss_mb()
+    onnx_facenet, onnx_fasnet = get_facenet(quantized), get_fasnet(quantized)
+    rss_onnx = _rss_mb()
+    keras_facenet = modeling.build_model(task="facial_recognition", model_name="Facenet512")
+    torch_fasnet = modeling.build_model(task="spoofing", model_name="Fasnet")
+    rss_deepface = _rss_mb()
+
+    reference = np.asarray(keras_facenet.forward(face))
+    candidate = np.asarray(onnx_facenet.forward(face))
+    cosine = float(reference @ candidate / (np.linalg.norm(reference) * np.linalg.norm(candidate)))
+
+    reference_spoof = torch_fasnet.analyze(img=image, facial_area=facial_area)
+    candidate_spoof = onnx_fasnet.analyze(img=image, facial_area=facial_area)
+
+    return {
+        "image": image_path,
+        "quantized": quantized,
+        "embedding_cosine_similarity": cosine,
+        "anti_spoofing": {
+            "deepface": {"is_real": bool(reference_spoof[0]), "score": float(reference_spoof[1])},
+            "onnx": {"is_real": candidate_spoof[0], "score": candidate_spoof[1]},
+        },
+        "latency_ms": {
+            "facenet_deepface": _median_ms(lambda: keras_facenet.forward(face), runs),
+            "facenet_onnx": _median_ms(lambda: onnx_facenet.forward(face), runs),
+            "fasnet_deepface": _median_ms(lambda: torch_fasnet.analyze(img=image, facial_area=facial_area), runs),
+            "fasnet_onnx": _median_ms(lambda: onnx_fasnet.analyze(img=image, facial_area=facial_area), runs),
+            "embedding_pipeline_onnx": _median_ms(
+                lambda: face_recognition.embedding(image, engine="onnx", expand_percentage=3), runs
+            ),
+        },
+        "rss_mb": {
+            "before": rss_start,
+            "onnx_models": rss_onnx - rss_start,
+            "deepface_models": rss_deepface - rss_onnx,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX Runtime engine for the face models.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export the DeepFace models to ONNX")
+    export_parser.add_argument("--output", default=ONNX_MODEL_DIR)
+    export_parser.add_argument("--quantize", action="store_true", help="Also write int8 dynamically quantized models")
+
+    report_parser = subparsers.add_parser("report", help="Accuracy, latency and RSS against DeepFace")
+    report_parser.add_argument("--image", default=os.getcwd() + "/images/sample-face.jpg")
+    report_parser.add_argument("--quantized", action="store_true")
+    report_parser.add_argument("--runs", type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for path in export_models(args.output, quantize=args.quantize):
+            print(path)
+    else:
+        print(json.dumps(parity_report(args.image, quantized=args.quantized, runs=args.runs), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Production launcher: load and warm the face models once, then fork the web workers.
+
+The parent process imports the app, loads the DeepFace models (TensorFlow Facenet512,
+the PyTorch anti-spoofing models, the detector, or the ONNX sessions with
+FACE_ENGINE=onnx) and runs one embedding on images/sample-face.jpg. It then forks
+WEB_WORKERS uvicorn workers on one shared listening socket. The workers share the
+weights with the parent copy-on-write, so each one only adds its own private memory.
+
+Thread pools do not survive a fork, so the math libraries (TensorFlow, PyTorch,
+OpenMP, OpenCV, ONNX Runtime) run single-threaded and parallelism comes from the
+workers: run about one worker per core. Each worker uses the thread inference pool.
+
+The parent supervises the workers: a worker that dies is replaced by a new fork.
+JWT keys are rotated in the parent and written to KEY_STORE_PATH, every worker
+reloads them in place within KEY_STORE_POLL_SECONDS. The key each rotation switches
+to is published in the JWKS one rotation ahead, so while some workers still sign with
+the old key every JWKS served holds both. Send SIGUSR1 to log the memory of the
+parent and each worker (RSS, PSS and private MB).
+
+Usage:
+    python serve.py [--workers 4] [--host 0.0.0.0] [--port 8000]
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+from typing import Dict
+
+from dotenv import load_dotenv
+
+SINGLE_THREAD_ENV = {
+    "OMP_NUM_THREADS": "1",
+    "MKL_NUM_THREADS": "1",
+    "OPENBLAS_NUM_THREADS": "1",
+    "TF_NUM_INTRAOP_THREADS": "1",
+    "TF_NUM_INTEROP_THREADS": "1",
+    "ONNX_THREADS": "1",
+}
+
+SAMPLE_IMAGE = os.getcwd() + "/images/sample-face.jpg"
+# seconds given to the workers to start before the first memory report
+WORKER_START_SECONDS = float(os.getenv("WORKER_START_SECONDS", "5"))
+
+
+def configure_environment():
+    """Must run before TensorFlow, PyTorch, OpenCV or the server modules are imported."""
+    for name, value in SINGLE_THREAD_ENV.items():
+        os.environ.setdefault(name, value)
+
+    if os.getenv("INFERENCE_EXECUTOR", "thread") != "thread":
+        logging.warning("INFERENCE_EXECUTOR=process is not supported with forked workers, using thread")
+    os.environ["INFERENCE_EXECUTOR"] = "thread"
+
+    # the parent rotates the keys for all workers and shares them through the key
+    # store, see Supervisor.rotate_keys
+    os.environ["KEY_ROTATION_TASK"] = "false"
+    os.environ.setdefault("KEY_STORE_PATH", os.getcwd() + "/.keys/jwt-keys.json")
+
+
+def preload(image_path: str = SAMPLE_IMAGE):
+    """Load and warm every model in this process, so forked workers inherit them."""
+    import cv2
+
+    cv2.setNumThreads(1)
+
+    try:
+        import tensorflow as tf
+
+        tf.config.threading.set_intra_op_parallelism_threads(1)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except ImportError:
+        pass
+
+    try:
+        import torch
+
+        torch.set_num_threads(1)
+        torch.set_num_interop_threads(1)
+    except ImportError:
+        pass
+
+    from server.utils.inference_pool import warm_up_model
+
+    warm_up_model(image_path)
+
+    # Everything allocated so far lives as long as the process. Moving it out of the
+    # collector's reach stops gc passes in the workers from writing to (and so
+    # copying) the pages shared with the parent.
+    gc.collect()
+    gc.freeze()
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock: socket.socket, slot: int):
+    import uvicorn
+
+    from server.app import app
+    from server.utils import log_pipeline
+
+    log_pipeline.restart_after_fork(f"app-worker-{slot}.log")
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
+        signal.signal(signum, signal.SIG_DFL)
+
+    config = uvicorn.Config(app=app, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Forks the workers, replaces the ones that die and rotates the JWT keys."""
+
+    def __init__(self, sock: socket.socket, workers: int, rotation_seconds: float):
+        self.sock = sock
+        self.workers = workers
+        self.rotation_seconds = rotation_seconds
+
+        # pid -> worker slot
+        self.children: Dict[int, int] = {}
+        self._stopping = False
+        self._report = False
+
+    def spawn(self, slot: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.sock, slot)
+            except BaseException as e:
+                logging.error(f"Worker {slot} crashed: {e}")
+                code = 1
+            finally:
+                # os._exit skips atexit, flush the log queue first
+                from server.utils.log_pipeline import stop_logging
+                stop_logging()
+                os._exit(code)
+
+        self.children[pid] = slot
+        logging.info(f"Started worker {slot}, pid {pid}")
+        return pid
+
+    def retire(self, pid: int):
+        """Gracefully stop a worker, it is reaped (and not replaced) in the main loop."""
+        self.children.pop(pid, None)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def rotate_keys(self):
+        """
+        Rotate the keys here and write them to the key store, the workers reload it.
+
+        The new signing key was published by every worker since the last rotation (see
+        RSAKeyManager.prepare_next_key), and a worker that reloaded publishes the old one
+        as the previous key, so tokens from either side verify against any worker's JWKS.
+        """
+        from server.utils.rsa_keys import KEY_STORE_PATH, rsa_manager
+
+        rsa_manager.generate_keys()
+        rsa_manager.prepare_next_key()
+        rsa_manager.save_key_store(KEY_STORE_PATH)
+
+    def report(self):
+        from server.utils.process_memory import process_memory
+
+        parent = process_memory()
+        lines = [f"parent pid {os.getpid()}: rss {parent['rss']:.0f} MB"]
+        total_pss = parent["pss"]
+
+        for pid, slot in sorted(self.children.items(), key=lambda item: item[1]):
+            try:
+                memory = process_memory(pid)
+            except OSError:
+                continue
+            total_pss += memory["pss"]
+            lines.append(
+                f"worker {slot} pid {pid}: rss {memory['rss']:.0f} MB, "
+                f"pss {memory['pss']:.0f} MB, private {memory['private']:.0f} MB"
+            )
+
+        lines.append(f"total pss {total_pss:.0f} MB")
+        logging.info("Memory report: " + "; ".join(lines))
+
+    def run(self):
+        for slot in range(self.workers):
+            self.spawn(slot)
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGUSR1, self._request_report)
+
+        next_rotation = time.monotonic() + self.rotation_seconds
+        # first report once the workers have had time to start
+        report_at = time.monotonic() + WORKER_START_SECONDS
+
+        while not self._stopping:
+            self._reap()
+
+            if self._report or (report_at and time.monotonic() >= report_at):
+                self._report = False
+                report_at = 0
+                self.report()
+
+            if self.rotation_seconds and time.monotonic() >= next_rotation:
+                self.rotate_keys()
+                next_rotation = time.monotonic() + self.rotation_seconds
+
+            time.sleep(0.5)
+
+        self.shutdown()
+
+    def shutdown(self):
+        for pid in list(self.children):
+            self.retire(pid)
+
+        while True:
+            try:
+                os.wait()
+            except ChildProcessError:
+                break
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            slot = self.children.pop(pid, None)
+            if slot is not None and not self._stopping:
+                logging.error(f"Worker {slot} (pid {pid}) exited with status {status}, restarting")
+                self.spawn(slot)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _request_report(self, signum, frame):
+        self._report = True
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Serve the face service with preloaded, forked workers.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--host", default=os.getenv("WEB_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("WEB_PORT", "8000")))
+    args = parser.parse_args()
+
+    configure_environment()
+
+    # importing the app here puts its modules (and the key manager) in the shared pages
+    import server.app  # noqa: F401
+    import server.routes  # noqa: F401
+    from server.utils.rsa_keys import KEY_STORE_PATH, rsa_manager
+
+    # the workers fork with the key of the first rotation already in their JWKS
+    rsa_manager.prepare_next_key()
+    rsa_manager.save_key_store(KEY_STORE_PATH)
+
+    logging.info(f"Preloading models before forking {args.workers} workers...")
+    started = time.perf_counter()
+    preload()
+    logging.info(f"Models preloaded in {time.perf_counter() - started:.1f}s")
+
+    sock = bind_socket(args.host, args.port)
+    supervisor = Supervisor(sock, args.workers, rsa_manager.rotation_interval.total_seconds())
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,5 @@
-﻿
\ No newline at end of file
+﻿from dotenv import load_dotenv
+
+# Settings are read from the environment when modules are imported, so .env has to be
+# loaded before any server module is.
+load_dotenv()
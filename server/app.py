@@ -1,29 +1,32 @@
 ﻿import asyncio
 import os
 import logging
+import time
+import uuid
 
-from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 
 from contextlib import asynccontextmanager
 from qdrant_client import AsyncQdrantClient
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
 
-from .utils.rsa_keys import rsa_manager
+from .deps import ALLOWED_ORIGINS
+from .dtos import ApiResponseDto
+from .utils import metrics
+from .utils.embedding_cache import embedding_cache
+from .utils.faces_collection import ensure_collection
+from .utils.gallery import GALLERY_REPLICA, face_gallery
+from .utils.http_client import create_core_client
+from .utils.inference_pool import inference_pool
+from .utils.log_pipeline import request_id_var, setup_logging
+from .utils.rate_limiter import RATE_LIMIT_ENABLED, allow_request, is_exempt, limiters, retry_after_header
+from .utils.rsa_keys import KEY_ROTATION_TASK, KEY_STORE_PATH, KEY_STORE_POLL_SECONDS, rsa_manager
+from .utils.upload_limit import UploadLimitMiddleware
 
 
-load_dotenv()
-logging.basicConfig(
-    filename=os.getcwd() + "/logs/app.log",
-    level=logging.INFO,
-    datefmt='%Y-%m-%d %H:%M:%S',
-    format='%(asctime)s %(levelname)s %(message)s',
-)
+setup_logging()
 
 
 @asynccontextmanager
@@ -41,6 +44,28 @@ async def lifespan(fast_api: FastAPI):
         logging.error(f"Error connecting to Qdrant Cloud: {error}")
         raise error
 
+    fast_api.state.http_client = create_core_client()
+
+    try:
+        await ensure_collection(fast_api.state.qdrant_client)
+    except Exception as e:
+        # searches still work without the indexes, only slower
+        logging.error(f"Error creating the faces collection or its payload indexes: {e}")
+
+    gallery_task = None
+    if GALLERY_REPLICA:
+        try:
+            logging.info("Loading local face gallery replica...")
+
+            await face_gallery.load(fast_api.state.qdrant_client)
+            gallery_task = asyncio.create_task(face_gallery.run_refresh(fast_api.state.qdrant_client))
+
+            logging.info("Face gallery replica loaded.")
+        except Exception as e:
+            # not fatal, verification falls back to Qdrant while the replica is stale
+            logging.error(f"Error loading face gallery replica: {e}")
+            gallery_task = asyncio.create_task(face_gallery.run_refresh(fast_api.state.qdrant_client))
+
     try:
         logging.info("Loading and initializing the model...\n")
         image_path = os.getcwd() + "/images/sample-face.jpg"
@@ -49,16 +74,7 @@ async def lifespan(fast_api: FastAPI):
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"Image not found at {image_path}")
 
-        import face_recognition
-
-        face_recognition.embedding(
-            image_path,
-            expand_percentage=3,
-            model_name="Facenet512",
-            align=True,
-            normalization="base",
-            anti_spoofing=True
-        )
+        await inference_pool.start(warmup_image=image_path)
 
         logging.info("Model is loaded and initialized successfully!\n")
     except Exception as e:
@@ -76,12 +92,30 @@ async def lifespan(fast_api: FastAPI):
         logging.error(f"Failed to include routes during lifespan startup: {e}")
         raise e
 
-    rotation_task = asyncio.create_task(rsa_manager.start_rotation())
+    rotation_task = None
+    if KEY_ROTATION_TASK:
+        rotation_task = asyncio.create_task(rsa_manager.start_rotation())
+    elif KEY_STORE_PATH:
+        # a supervisor rotates the keys (see serve.py), pick them up in place
+        rotation_task = asyncio.create_task(rsa_manager.watch_key_store(KEY_STORE_PATH, KEY_STORE_POLL_SECONDS))
+    rate_limit_tasks = [asyncio.create_task(limiter.run_sync()) for limiter in limiters] if RATE_LIMIT_ENABLED else []
 
     try:
         yield
-        rotation_task.cancel()
+        if rotation_task:
+            rotation_task.cancel()
+        for task in rate_limit_tasks:
+            task.cancel()
+        if gallery_task:
+            gallery_task.cancel()
     finally:
+        inference_pool.shutdown()
+
+        await fast_api.state.http_client.aclose()
+        await embedding_cache.close()
+        for limiter in limiters:
+            await limiter.close()
+
         client = fast_api.state.qdrant_client
         if client:
             try:
@@ -93,25 +127,62 @@ async def lifespan(fast_api: FastAPI):
 
 app = FastAPI(lifespan=lifespan)
 
-# Configure Redis for rate limiting
-redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
-app.state.limiter = Limiter(
-    key_func=get_remote_address,
-    default_limits=["5/minute"],
-    storage_uri=redis_url
-)
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)  # type: ignore
-
-allowed_origins = os.getenv("ALLOWED_ORIGINS", '').split(",") \
-    if os.getenv("APP_ENV") == "production" \
-    else os.getenv("ALLOWED_ORIGINS_DEV", '').split(",")
-
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=allowed_origins,
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 app.add_middleware(GZipMiddleware, minimum_size=1000)
-app.add_middleware(SlowAPIMiddleware)
+app.add_middleware(UploadLimitMiddleware)
+
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """Time every request and, for sampled ones, report the stages in a Server-Timing header."""
+    started = time.perf_counter()
+    timings = metrics.start_request()
+
+    response = await call_next(request)
+
+    route = request.scope.get("route")
+    elapsed = time.perf_counter() - started
+    metrics.finish_request(route.path if route else "unmatched", timings, elapsed)
+
+    if timings is not None:
+        response.headers["Server-Timing"] = metrics.server_timing_header({**timings, "total": elapsed * 1000})
+
+    return response
+
+
+@app.middleware("http")
+async def rate_limit(request: Request, call_next):
+    """Per address and per device/store token buckets, decided in process (see utils.rate_limiter)."""
+    if not RATE_LIMIT_ENABLED or is_exempt(request.url.path):
+        return await call_next(request)
+
+    allowed, retry_after = allow_request(request)
+    if not allowed:
+        return JSONResponse(
+            status_code=429,
+            content=ApiResponseDto(message="Too many requests. Please try again later.", success=False, statusCode=429).model_dump(),
+            headers={"Retry-After": retry_after_header(retry_after)},
+        )
+
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def request_id(request: Request, call_next):
+    """Tag the request (and every log record written while handling it) with an ID."""
+    value = request.headers.get("x-request-id") or uuid.uuid4().hex
+    token = request_id_var.set(value)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+
+    response.headers["X-Request-ID"] = value
+    return response
+
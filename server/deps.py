@@ -1,17 +1,24 @@
 ﻿import logging
 import os
-import cv2
-import numpy
-from io import BytesIO
 from typing import List, Dict, Any, Optional
 
-from fastapi import Header, UploadFile, File, Request, HTTPException
-from PIL import Image
+import httpx
+from fastapi import Header, UploadFile, File, Request, HTTPException, WebSocket
 from qdrant_client import AsyncQdrantClient
 
-import face_recognition
+from server.pipeline import CLIENT_FACE_BOX, extract_embeddings, settings_tag
+from server.utils import metrics
+from server.utils.admission import PRIORITY_VERIFY, AdmissionRejected, admitted
+from server.utils.detector_cascade import is_no_face_error, record_detection
+from server.utils.embedding_cache import EMBEDDING_CACHE, embedding_cache
+from server.utils.inference_pool import inference_pool
+from server.utils.quality import ImageQualityError, record_rejection
+from server.utils.upload_limit import read_upload
 
 INTERNAL_SERVICE_KEY = os.getenv("INTERNAL_SERVICE_KEY", "")
+ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", '').split(",") \
+    if os.getenv("APP_ENV") == "production" \
+    else os.getenv("ALLOWED_ORIGINS_DEV", '').split(",")
 
 
 def get_qdrant_client(request: Request) -> AsyncQdrantClient:
@@ -19,31 +26,72 @@ def get_qdrant_client(request: Request) -> AsyncQdrantClient:
     return request.app.state.qdrant_client
 
 
-async def get_embeddings(image: UploadFile = File(...)) -> List[Dict[str, Any]]:
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    # Return the shared core service client stored on the FastAPI app instance
+    return request.app.state.http_client
+
+
+async def get_embeddings(
+        image: UploadFile = File(...),
+        face_box: Optional[Dict[str, int]] = None,
+        priority: int = PRIORITY_VERIFY,
+        deadline: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Embed the faces of an upload. `face_box` is the face located by the client
+    ({"x", "y", "w", "h"}), server-side detection is then skipped. It is dropped
+    when CLIENT_FACE_BOX is off, so it does not split the cache either.
+
+    The inference runs once admitted at `priority` (see utils.admission), before
+    `deadline` (time.monotonic). Raises AdmissionRejected when the server is saturated.
+    """
     if not image:
         raise HTTPException(status_code=400, detail="No image provided")
 
+    if not CLIENT_FACE_BOX:
+        face_box = None
+
     try:
-        image_data = await image.read()
-        pil_image = Image.open(BytesIO(image_data))
+        with metrics.stage("read"):
+            image_data = await read_upload(image)
 
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
+        cache_key = None
+        if EMBEDDING_CACHE:
+            with metrics.stage("cache"):
+                variant = settings_tag()
+                if face_box:
+                    variant += ":box=" + ",".join(str(face_box[key]) for key in "xywh")
+                cache_key = embedding_cache.key(image_data, variant=variant)
+                cached = await embedding_cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-        image_np = numpy.array(pil_image)
-        image_enhanced = cv2.detailEnhance(image_np, sigma_s=4, sigma_r=0.09)
+        # decode, enhancement, detection, anti-spoofing and the forward pass are all
+        # CPU-bound, keep them off the event loop
+        async with admitted(priority, deadline):
+            with metrics.stage("inference"):
+                embeddings, timings = await inference_pool.run(
+                    metrics.run_timed, metrics.is_sampled(), extract_embeddings, image_data, face_box=face_box
+                )
+        metrics.merge(timings)
+        if embeddings:
+            record_detection(embeddings[0].get("detector_backend"))
 
-        embeddings = face_recognition.embedding(
-            image_enhanced,
-            expand_percentage=3,
-            model_name="Facenet512",
-            align=True,
-            normalization="base",
-            anti_spoofing=True
-        )
+        if cache_key:
+            await embedding_cache.set(cache_key, embeddings)
 
         return embeddings
+    except AdmissionRejected as e:
+        # already logged by the controller
+        raise e
+    except ImageQualityError as e:
+        # counted here, the gate itself may run in another process
+        record_rejection(e.reason)
+        logging.info(msg=f"Image rejected by quality gate: {e}")
+        raise e
     except ValueError as e:
+        if is_no_face_error(e):
+            record_detection(None)
         logging.error(msg=str(e))
         raise e
     except Exception as e:
@@ -55,4 +103,14 @@ def verify_internal_request(x_internal_key: Optional[str] = Header(None)):
     """Dependency to verify requests from ASP.NET Core service."""
     if x_internal_key != INTERNAL_SERVICE_KEY:
         raise HTTPException(status_code=403, detail="Forbidden: Invalid internal service key")
-    return True
\ No newline at end of file
+    return True
+
+
+def verify_websocket_origin(websocket: WebSocket) -> bool:
+    """
+    Whether a WebSocket handshake comes from an allowed origin. Browsers do not apply
+    CORS to WebSockets, so the origin check of the HTTP routes is done here. Clients
+    that send no Origin (kiosk apps) pass, as they do through CORS.
+    """
+    origin = websocket.headers.get("origin")
+    return origin is None or "*" in ALLOWED_ORIGINS or origin in ALLOWED_ORIGINS
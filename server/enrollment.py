@@ -0,0 +1,480 @@
+import asyncio
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+import zipfile
+from typing import IO, Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows, a job's state is then not checked across processes
+    fcntl = None
+
+import httpx
+from fastapi import HTTPException
+from qdrant_client import AsyncQdrantClient, models
+
+from server.deps import INTERNAL_SERVICE_KEY
+from server.dtos import FaceRegisterRequestDto
+from server.pipeline import extract_embeddings
+from server.utils import metrics
+from server.utils.admission import PRIORITY_BULK, AdmissionRejected, admitted
+from server.utils.faces_collection import FACES_COLLECTION, normalize, search_params
+from server.utils.gallery import GALLERY_REPLICA, face_gallery, indexed_at
+from server.utils.http_client import request_with_retry
+from server.utils.inference_pool import InferencePool
+from server.utils.jwt_helper import create_signed_jwt
+from server.utils.query_coalescer import query_faces
+from server.utils.upload_limit import MAX_UPLOAD_BYTES
+
+BULK_ENROLL_BATCH_SIZE = int(os.getenv("BULK_ENROLL_BATCH_SIZE", "64"))
+BULK_ENROLL_CONCURRENCY = int(os.getenv("BULK_ENROLL_CONCURRENCY", "4"))
+BULK_ENROLL_DIR = os.getenv("BULK_ENROLL_DIR", os.getcwd() + "/.bulk-enroll")
+# same similarity as the duplicate check of /api/register-face
+DUPLICATE_FACE_THRESHOLD = 0.85
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+async def register_with_core(http_client: httpx.AsyncClient, request: FaceRegisterRequestDto) -> Dict[str, Any]:
+    """
+    Register the employee with the core service and return its AuthResponseDto.
+    Raises HTTPException with the status to report when the call fails.
+    """
+    payload = {
+        "firstName": request.firstName,
+        "lastName": request.lastName,
+        "email": request.email,
+        "position": request.position,
+        "departmentId": request.departmentId,
+        "storeId": request.storeId,
+        "timeLogged": request.timeLogged.isoformat()
+    }
+    with metrics.stage("jwt"):
+        signed_jwt = create_signed_jwt(payload=payload)
+
+    try:
+        with metrics.stage("core_service"):
+            auth_response = await request_with_retry(
+                http_client,
+                "POST",
+                "/api/Auth/face-register",
+                headers={
+                    "Authorization": f"Bearer {signed_jwt}",
+                    "X-Internal-Key": INTERNAL_SERVICE_KEY,
+                    "Content-Type": "application/json"
+                },
+                json=payload
+            )
+    except httpx.TimeoutException as e:
+        logging.error(f"Failed to register face: {e}")
+        raise HTTPException(status_code=504, detail="Registration service is unavailable. Please try again later.")
+    except httpx.RequestError as e:
+        logging.error(f"Failed to connect to auth service: {e}")
+        raise HTTPException(status_code=500, detail="Failed to connect to auth service")
+
+    if auth_response.status_code not in [200, 201]:
+        raise HTTPException(status_code=auth_response.status_code, detail=auth_response.text)
+
+    # Same data type as AuthResponseDto from core service
+    return auth_response.json()
+
+
+def build_face_point(user: Dict[str, Any], embedding: List[float], request: FaceRegisterRequestDto) -> models.PointStruct:
+    """Qdrant point of a registered face, with user_id as the id and the embedding L2-normalized."""
+    return models.PointStruct(
+        id=str(uuid.uuid5(uuid.NAMESPACE_DNS, user['id'])),
+        vector=normalize(embedding),
+        payload={
+            "user_id": user['id'],
+            "email": user['email'],
+            "store_id": request.storeId,
+            "department_id": request.departmentId,
+            "registered_at": request.timeLogged.isoformat(),
+            "indexed_at": indexed_at(),
+        }
+    )
+
+
+def read_manifest(manifest: str) -> List[Dict[str, str]]:
+    """
+    Parse a CSV manifest with the columns image, email, firstName, lastName, position,
+    departmentId, storeId and optionally user_id (employees already known to the core
+    service are not registered again).
+    """
+    rows = list(csv.DictReader(io.StringIO(manifest)))
+    missing = {"image", "email", "firstName", "lastName", "position", "departmentId"} - set(rows[0] if rows else {})
+    if missing:
+        raise ValueError(f"Manifest is missing columns: {', '.join(sorted(missing))}")
+    return rows
+
+
+class ImageSource:
+    """Images of a directory or a zip archive, read one at a time by relative path."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._zip = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+
+    def read(self, name: str) -> bytes:
+        if self._zip:
+            if self._zip.getinfo(name).file_size > MAX_UPLOAD_BYTES:
+                raise ValueError(f"Image is larger than {MAX_UPLOAD_BYTES} bytes: {name}")
+            return self._zip.read(name)
+
+        full_path = os.path.realpath(os.path.join(self.path, name))
+        if not full_path.startswith(os.path.realpath(self.path) + os.sep):
+            raise ValueError(f"Image path escapes the source directory: {name}")
+        if os.path.getsize(full_path) > MAX_UPLOAD_BYTES:
+            raise ValueError(f"Image is larger than {MAX_UPLOAD_BYTES} bytes: {name}")
+
+        with open(full_path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+
+
+class Checkpoint:
+    """
+    Append-only JSON lines log of processed manifest rows, used to resume a run.
+
+    "enrolled" rows are done. "registered" rows were registered with the core service
+    but their face may not be stored yet: a resumed run reuses their user instead of
+    registering the employee again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        self.registered: Dict[str, Dict[str, str]] = {}
+        # runs in worker threads (asyncio.to_thread), keep the lines of two calls apart
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    self._apply(json.loads(line))
+
+    def record(self, entries: List[Dict[str, Any]]):
+        """Append and fsync entries, blocking: call it through asyncio.to_thread from the event loop."""
+        with self._lock, open(self.path, "a") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+            for entry in entries:
+                self._apply(entry)
+
+    def _apply(self, entry: Dict[str, Any]):
+        if entry.get("status") == "enrolled":
+            self.done.add(entry["image"])
+        elif entry.get("status") == "registered":
+            self.registered[entry["image"]] = {"id": entry["user_id"], "email": entry["email"]}
+
+
+class BulkEnroller:
+    """
+    Enrolls a whole manifest of employees.
+
+    Images are embedded concurrently through the inference pool, employees without a
+    user_id are registered with the core service, and faces are upserted to Qdrant in
+    large batches. Rows are written to the checkpoint only after their batch is stored,
+    so an interrupted run resumes where it stopped. A core service registration is
+    written to the checkpoint as soon as it succeeds, so a resumed run never registers
+    the same employee twice. Point ids are derived from the user id, so a row processed
+    twice overwrites the same point.
+
+    Each face is first looked up like /api/register-face does: a row whose face is
+    already registered with the same email fails, and a face matching another employee
+    is enrolled but reported (`duplicate_of` in the checkpoint, counted in `duplicates`).
+
+    With a `priority`, every embedding first waits for an inference slot of that
+    priority (see utils.admission), and a rejected row waits and tries again. Set it
+    when the pool is shared with live traffic.
+    """
+
+    def __init__(
+        self,
+        qdrant: AsyncQdrantClient,
+        http_client: httpx.AsyncClient,
+        pool: InferencePool,
+        batch_size: int = BULK_ENROLL_BATCH_SIZE,
+        concurrency: int = BULK_ENROLL_CONCURRENCY,
+        priority: Optional[int] = None,
+    ):
+        self.qdrant = qdrant
+        self.http_client = http_client
+        self.pool = pool
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.priority = priority
+
+        self.progress = {"total": 0, "skipped": 0, "enrolled": 0, "failed": 0, "duplicates": 0}
+
+    async def run(
+        self,
+        rows: List[Dict[str, str]],
+        source: ImageSource,
+        checkpoint: Checkpoint,
+        on_flush: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> Dict[str, int]:
+        """Enroll the rows not done in the checkpoint, calling `on_flush` after each stored batch."""
+        pending = [row for row in rows if row["image"] not in checkpoint.done]
+        self.progress.update(total=len(rows), skipped=len(rows) - len(pending))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        points: List[models.PointStruct] = []
+        entries: List[Dict[str, Any]] = []
+        flush_lock = asyncio.Lock()
+
+        async def flush():
+            async with flush_lock:
+                if not entries:
+                    return
+                batch, batch_entries = list(points), list(entries)
+                points.clear()
+                entries.clear()
+
+                if batch:
+                    await self.qdrant.upsert(collection_name=FACES_COLLECTION, points=batch, wait=True)
+                    if GALLERY_REPLICA:
+                        face_gallery.upsert_many([(str(point.id), point.vector, point.payload or {}) for point in batch])
+
+                await asyncio.to_thread(checkpoint.record, batch_entries)
+                if on_flush:
+                    await on_flush()
+
+        async def enroll(row: Dict[str, str]):
+            async with semaphore:
+                entry: Dict[str, Any] = {"image": row["image"]}
+                try:
+                    point, duplicate_of = await self._enroll_row(row, source, checkpoint)
+                    points.append(point)
+                    entry.update(status="enrolled", user_id=(point.payload or {}).get("user_id"))
+                    self.progress["enrolled"] += 1
+                    if duplicate_of:
+                        logging.warning(f"Bulk enrollment of {row['image']} matches the face of user {duplicate_of}")
+                        entry["duplicate_of"] = duplicate_of
+                        self.progress["duplicates"] += 1
+                except Exception as e:
+                    detail = e.detail if isinstance(e, HTTPException) else str(e)
+                    logging.error(f"Bulk enrollment failed for {row['image']}: {detail}")
+                    entry.update(status="failed", error=detail)
+                    self.progress["failed"] += 1
+
+                entries.append(entry)
+
+            if len(entries) >= self.batch_size:
+                await flush()
+
+        try:
+            await asyncio.gather(*[enroll(row) for row in pending])
+        finally:
+            await flush()
+
+        return dict(self.progress)
+
+    async def _enroll_row(
+        self, row: Dict[str, str], source: ImageSource, checkpoint: Checkpoint
+    ) -> Tuple[models.PointStruct, Optional[str]]:
+        """The point of a row and the user id of another employee with the same face, if any."""
+        image_data = await asyncio.to_thread(source.read, row["image"])
+        embeddings = await self._embed(image_data)
+
+        if len(embeddings) != 1:
+            raise ValueError(f"Expected one face, found {len(embeddings)}")
+        if not embeddings[0].get("is_real", True):
+            raise ValueError("Liveness check failed")
+
+        request = FaceRegisterRequestDto(
+            email=row["email"],
+            firstName=row["firstName"],
+            lastName=row["lastName"],
+            position=row["position"],
+            departmentId=row["departmentId"],
+            storeId=row.get("storeId") or None,
+            timeLogged=datetime.datetime.now(datetime.timezone.utc),
+        )
+
+        if row.get("user_id"):
+            user = {"id": row["user_id"], "email": row["email"]}
+        else:
+            user = checkpoint.registered.get(row["image"])
+
+        existing_face = await query_faces(self.qdrant, models.QueryRequest(
+            query=normalize(embeddings[0]["embedding"]),
+            params=search_params(),
+            limit=1,
+            with_payload=["user_id", "email"],
+            score_threshold=DUPLICATE_FACE_THRESHOLD,
+        ))
+        existing = (existing_face[0].payload or {}) if existing_face else {}
+        duplicate_of = existing.get("user_id")
+        # a row processed again finds its own point
+        if user and duplicate_of == user["id"]:
+            duplicate_of = None
+        if duplicate_of and existing.get("email") == row["email"]:
+            raise ValueError(f"Face already registered for {row['email']}")
+
+        if user is None:
+            user = (await register_with_core(self.http_client, request))["user"]
+            await asyncio.to_thread(
+                checkpoint.record,
+                [{"image": row["image"], "status": "registered", "user_id": user["id"], "email": user["email"]}],
+            )
+
+        return build_face_point(user, embeddings[0]["embedding"], request), duplicate_of
+
+    async def _embed(self, image_data: bytes) -> List[Dict[str, Any]]:
+        if self.priority is None:
+            return await self.pool.run(extract_embeddings, image_data)
+
+        while True:
+            try:
+                async with admitted(self.priority):
+                    return await self.pool.run(extract_embeddings, image_data)
+            except AdmissionRejected as e:
+                # live traffic comes first, the job just slows down
+                await asyncio.sleep(max(1.0, e.retry_after))
+
+
+def list_images(path: str) -> Iterator[str]:
+    """Relative paths of the images in a directory or zip archive, for building manifests."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            yield from (name for name in archive.namelist() if name.lower().endswith(IMAGE_EXTENSIONS))
+        return
+
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(root, name), path)
+
+
+def checkpoint_path_for(source: str, directory: Optional[str] = None) -> str:
+    base = os.path.basename(os.path.normpath(source))
+    return os.path.join(directory or os.path.dirname(os.path.abspath(source)), f".{base}.enroll-checkpoint.jsonl")
+
+
+def _try_lock(path: str) -> Optional[IO]:
+    """Open and exclusively lock a file without blocking, None when another process or job holds it."""
+    f = open(path, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+    return f
+
+
+class BulkEnrollJobs:
+    """
+    Bulk enrollments started through the internal endpoint, run as background tasks.
+
+    The state of a job is written to job.json in its directory when it starts, after
+    each stored batch and when it ends, so any worker can report it. A running job
+    holds a lock on its directory: a "running" job.json nobody holds the lock of was
+    interrupted, and can be submitted again to resume.
+    """
+
+    def __init__(self, work_dir: str = BULK_ENROLL_DIR):
+        self.work_dir = work_dir
+        # jobs running in this process
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.work_dir, job_id)
+
+    async def start(self, job_id: str, qdrant: AsyncQdrantClient, http_client: httpx.AsyncClient, pool: InferencePool) -> Dict[str, Any]:
+        lock = await asyncio.to_thread(_try_lock, os.path.join(self.job_dir(job_id), ".lock"))
+        if lock is None:
+            raise HTTPException(status_code=409, detail="Bulk enrollment is already running")
+
+        # the endpoint embeds through the server's pool, behind verifications and registrations
+        enroller = BulkEnroller(qdrant, http_client, pool, priority=PRIORITY_BULK)
+        job = {"job_id": job_id, "status": "running", "progress": enroller.progress, "error": None}
+        self._jobs[job_id] = job
+        try:
+            await self._save(job)
+        except BaseException:
+            del self._jobs[job_id]
+            lock.close()
+            raise
+
+        task = asyncio.create_task(self._run(job, enroller, lock))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if job_id in self._jobs:
+            return self._jobs[job_id]
+        return await asyncio.to_thread(self._load, job_id)
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        directory = self.job_dir(job_id)
+        try:
+            with open(os.path.join(directory, "job.json")) as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        if job["status"] == "running":
+            lock = _try_lock(os.path.join(directory, ".lock"))
+            if lock is not None:
+                lock.close()
+                job["status"] = "interrupted"
+        return job
+
+    async def _save(self, job: Dict[str, Any]):
+        # serialized on the loop, the progress keeps changing while the file is written
+        await asyncio.to_thread(self._write, job["job_id"], json.dumps(job))
+
+    def _write(self, job_id: str, document: str):
+        directory = self.job_dir(job_id)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".job-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(document)
+            os.replace(tmp_path, os.path.join(directory, "job.json"))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    async def _run(self, job: Dict[str, Any], enroller: BulkEnroller, lock: IO):
+        directory = self.job_dir(job["job_id"])
+        source = None
+        try:
+            source = ImageSource(os.path.join(directory, "images.zip"))
+            with open(os.path.join(directory, "manifest.csv"), encoding="utf-8-sig") as f:
+                rows = read_manifest(f.read())
+
+            checkpoint = Checkpoint(os.path.join(directory, "checkpoint.jsonl"))
+            await enroller.run(rows, source, checkpoint, on_flush=lambda: self._save(job))
+            job["status"] = "completed"
+            logging.info(f"Bulk enrollment {job['job_id']} completed: {enroller.progress}")
+        except Exception as e:
+            job.update(status="failed", error=str(e))
+            logging.error(f"Bulk enrollment {job['job_id']} failed: {e}")
+        finally:
+            if source:
+                source.close()
+            try:
+                await self._save(job)
+            except Exception as e:
+                logging.error(f"Failed to save the state of bulk enrollment {job['job_id']}: {e}")
+            del self._jobs[job["job_id"]]
+            lock.close()
+
+
+# Jobs of the /internal/bulk-enroll endpoint, a job id can be submitted again to resume it
+bulk_jobs = BulkEnrollJobs()
@@ -0,0 +1,308 @@
+import json
+import os
+import cv2
+import numpy
+from io import BytesIO
+from typing import List, Dict, Any, Optional, Tuple, Union
+
+from PIL import Image
+
+import face_recognition
+from server.utils import metrics
+from server.utils.detector_cascade import DETECTOR_CASCADE
+from server.utils.forward_batcher import INFERENCE_BATCHING, forward_batcher
+from server.utils.quality import (
+    QUALITY_GATE, QUALITY_MIN_FACE_SIZE, REASON_MESSAGES, ImageQualityError, check_quality, frame_score,
+    measure_quality, quality_reason,
+)
+
+# "full" runs every stage on the whole upload, "reduced" detects on a downscaled copy
+# and only enhances and embeds the face crop
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "full")
+DECODE_MAX_SIDE = int(os.getenv("DECODE_MAX_SIDE", "1600"))
+DETECT_MAX_SIDE = int(os.getenv("DETECT_MAX_SIDE", "640"))
+# Margin added on each side of the detected box, as a fraction of its size. The
+# anti-spoofing models look at up to 4x the face box, so 1.5 keeps their full context.
+CROP_MARGIN = float(os.getenv("CROP_MARGIN", "1.5"))
+# "legacy" or "fused" auto exposure, see face_recognition._fused_auto_exposure
+ENHANCEMENT_MODE = os.getenv("ENHANCEMENT_MODE", "legacy")
+# detailEnhance is an edge-preserving filter and cannot be folded into a lookup table.
+# Turning it off saves the most expensive enhancement pass, but embeddings then drift
+# from the ones registered with it on.
+DETAIL_ENHANCE = os.getenv("DETAIL_ENHANCE", "true").lower() == "true"
+# Accept the face box of the client's face tracker and skip server-side detection.
+# Opt-in: the box comes from the client, turn it on for trusted kiosk apps only.
+CLIENT_FACE_BOX = os.getenv("CLIENT_FACE_BOX", "false").lower() == "true"
+# widest accepted width/height (and height/width) ratio of a client face box
+FACE_BOX_MAX_ASPECT = float(os.getenv("FACE_BOX_MAX_ASPECT", "2.0"))
+
+
+# enough of the file for PIL to parse a JPEG header past large EXIF segments
+_HEADER_BYTES = 256 * 1024
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def _decode_flag(image_data: bytes, max_side: Optional[int]) -> int:
+    """Largest JPEG downscale on decode that keeps the longest side at least `max_side`."""
+    if not max_side:
+        return cv2.IMREAD_COLOR
+
+    try:
+        # Image.open only parses the header, the pixels are never decoded by PIL
+        with Image.open(BytesIO(memoryview(image_data)[:_HEADER_BYTES])) as header:
+            if header.format != "JPEG":
+                return cv2.IMREAD_COLOR
+            longest = max(header.size)
+    except Exception:
+        return cv2.IMREAD_COLOR
+
+    for factor, flag in _REDUCED_FLAGS:
+        if longest // factor >= max_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_image(image_data: Union[bytes, bytearray, memoryview], max_side: Optional[int] = None) -> numpy.ndarray:
+    """
+    Decode an uploaded image to an RGB numpy array.
+
+    The upload buffer is handed to cv2.imdecode without copying, and the decoded BGR
+    array is swapped to RGB in place, so the only full-size allocation is the decoded
+    image itself. EXIF orientation is applied, the image comes out upright.
+
+    When `max_side` is set and the upload is a JPEG, the decoder is asked to scale down
+    while decoding (DCT scaling), so a 12 MP frame is never fully decoded. The result
+    is at least `max_side` on its longest side whenever the source is.
+    """
+    buffer = numpy.frombuffer(memoryview(image_data), dtype=numpy.uint8)
+    image_np = cv2.imdecode(buffer, _decode_flag(image_data, max_side)) if buffer.size else None
+    if image_np is None:
+        raise ValueError("Unable to decode image")
+
+    return cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB, dst=image_np)
+
+
+def _embed(image_np: numpy.ndarray, facial_area: Optional[Tuple[int, int, int, int]] = None) -> List[Dict[str, Any]]:
+    if DETAIL_ENHANCE:
+        with metrics.stage("detail_enhance"):
+            image_np = cv2.detailEnhance(image_np, sigma_s=4, sigma_r=0.09)
+
+    return face_recognition.embedding(
+        image_np,
+        expand_percentage=3,
+        model_name="Facenet512",
+        align=True,
+        normalization="base",
+        anti_spoofing=True,
+        forward_fn=forward_batcher.forward if INFERENCE_BATCHING else None,
+        enhancement=ENHANCEMENT_MODE,
+        detector_cascade=DETECTOR_CASCADE,
+        facial_area=facial_area,
+    )
+
+
+def detect_faces_reduced(image_np: numpy.ndarray, max_side: int) -> List[Dict[str, int]]:
+    """
+    Detect faces on a copy of the image bounded to `max_side` and map the boxes back
+    to the coordinates of `image_np`.
+    """
+    height, width = image_np.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+
+    small = image_np
+    if scale < 1.0:
+        small = cv2.resize(
+            image_np,
+            (round(width * scale), round(height * scale)),
+            interpolation=cv2.INTER_AREA
+        )
+
+    face_objs, _ = face_recognition.detect_faces(
+        face_recognition._fused_auto_exposure(image_np=small)
+        if ENHANCEMENT_MODE == "fused" else face_recognition._auto_exposure(image_np=small),
+        DETECTOR_CASCADE,
+        enforce_detection=False,
+        align=False,
+    )
+
+    boxes = []
+    for face_obj in face_objs:
+        area = face_obj["facial_area"]
+
+        # with enforce_detection off, "no face" comes back as the whole image
+        if face_obj["confidence"] == 0 and area["w"] >= small.shape[1] and area["h"] >= small.shape[0]:
+            continue
+
+        boxes.append({
+            "x": int(area["x"] / scale),
+            "y": int(area["y"] / scale),
+            "w": int(area["w"] / scale),
+            "h": int(area["h"] / scale),
+        })
+
+    return boxes
+
+
+def _crop_bounds(shape: Tuple[int, ...], box: Dict[str, int], margin: float) -> Tuple[int, int, int, int]:
+    height, width = shape[:2]
+    pad_x, pad_y = int(box["w"] * margin), int(box["h"] * margin)
+
+    x1, y1 = max(0, box["x"] - pad_x), max(0, box["y"] - pad_y)
+    x2, y2 = min(width, box["x"] + box["w"] + pad_x), min(height, box["y"] + box["h"] + pad_y)
+
+    return x1, y1, x2, y2
+
+
+def crop_face(image_np: numpy.ndarray, box: Dict[str, int], margin: float) -> numpy.ndarray:
+    """Crop `box` plus `margin` (fraction of the box size per side), clipped to the image."""
+    x1, y1, x2, y2 = _crop_bounds(image_np.shape, box, margin)
+    return image_np[y1:y2, x1:x2]
+
+
+def quality_gate_detects() -> bool:
+    """
+    Whether the quality gate counts faces. It does so with a Haar cascade, which with a
+    detector cascade would turn away the faces the later backends are there to find:
+    the gate then only checks blur and exposure, and the cascade decides on the face.
+    """
+    return len(DETECTOR_CASCADE) == 1
+
+
+def parse_face_box(value: str) -> Dict[str, int]:
+    """
+    Parse a client face box, {"x", "y", "w", "h"} as JSON or "x,y,w,h", in pixels of
+    the upright (EXIF-rotated) upload. Raises ImageQualityError when it is malformed.
+    """
+    try:
+        if value.strip().startswith("{"):
+            parsed = json.loads(value)
+            values = [parsed[key] for key in ("x", "y", "w", "h")]
+        else:
+            values = value.split(",")
+        x, y, w, h = (int(round(float(v))) for v in values)
+    except (ValueError, TypeError, KeyError, OverflowError):
+        # OverflowError: round() of an infinite coordinate
+        raise ImageQualityError("invalid_face_box", REASON_MESSAGES["invalid_face_box"])
+
+    return {"x": x, "y": y, "w": w, "h": h}
+
+
+def check_face_box(box: Dict[str, int], shape: Tuple[int, ...]) -> Dict[str, int]:
+    """
+    Plausibility check of a client face box: inside the image, big enough to embed and
+    roughly face shaped. Raises ImageQualityError with the reason.
+    """
+    height, width = shape[:2]
+    if box["x"] < 0 or box["y"] < 0 or box["x"] + box["w"] > width or box["y"] + box["h"] > height:
+        raise ImageQualityError("invalid_face_box", REASON_MESSAGES["invalid_face_box"])
+    if min(box["w"], box["h"]) < max(1, QUALITY_MIN_FACE_SIZE):
+        raise ImageQualityError("face_too_small", REASON_MESSAGES["face_too_small"])
+    if max(box["w"] / box["h"], box["h"] / box["w"]) > FACE_BOX_MAX_ASPECT:
+        raise ImageQualityError("invalid_face_box", REASON_MESSAGES["invalid_face_box"])
+
+    return box
+
+
+def _extract_reduced(image_data: bytes) -> List[Dict[str, Any]]:
+    with metrics.stage("decode"):
+        image_np = decode_image(image_data, max_side=DECODE_MAX_SIDE)
+
+    if QUALITY_GATE:
+        with metrics.stage("quality"):
+            check_quality(image_np, detect=quality_gate_detects())
+
+    with metrics.stage("detection_reduced"):
+        boxes = detect_faces_reduced(image_np, max_side=DETECT_MAX_SIDE)
+
+    if len(boxes) == 0:
+        # same error detection.extract_faces raises with enforce_detection on
+        raise ValueError("Face could not be detected in numpy array.")
+
+    results = []
+    for box in boxes:
+        crop = crop_face(image_np, box, margin=CROP_MARGIN)
+        results.extend(_embed(numpy.ascontiguousarray(crop)))
+
+    return results
+
+
+def _extract_face_box(image_data: bytes, face_box: Dict[str, int]) -> List[Dict[str, Any]]:
+    """
+    Embed the face the client already located. Only the box plus CROP_MARGIN of context
+    is enhanced, no detector runs, and anti-spoofing still sees the box in that context.
+    """
+    with metrics.stage("decode"):
+        image_np = decode_image(image_data)
+
+    box = check_face_box(face_box, image_np.shape)
+
+    if QUALITY_GATE:
+        with metrics.stage("quality"):
+            check_quality(crop_face(image_np, box, margin=0), detect=False)
+
+    x1, y1, x2, y2 = _crop_bounds(image_np.shape, box, CROP_MARGIN)
+    context = numpy.ascontiguousarray(image_np[y1:y2, x1:x2])
+
+    return _embed(context, facial_area=(box["x"] - x1, box["y"] - y1, box["w"], box["h"]))
+
+
+def score_frame(image_data: bytes) -> Dict[str, Any]:
+    """
+    Cheap check of one streamed frame: decode and quality metrics only, no enhancement
+    and no model. Returns the gate `reason` (None when the frame passes) and the frame
+    `score` used to pick the best frames (None when it fails).
+    """
+    with metrics.stage("decode"):
+        image_np = decode_image(image_data)
+
+    with metrics.stage("quality"):
+        measured = measure_quality(image_np, detect=quality_gate_detects())
+
+    reason = quality_reason(measured)
+    return {"reason": reason, "score": None if reason else frame_score(measured)}
+
+
+def settings_tag() -> str:
+    """Short description of the settings that change the pipeline output, e.g. for cache keys."""
+    detectors = "+".join(f"{backend}@{min_confidence:g}" for backend, min_confidence in DETECTOR_CASCADE)
+    return f"{PIPELINE_MODE}:{ENHANCEMENT_MODE}:{int(DETAIL_ENHANCE)}:{face_recognition.FACE_ENGINE}:{detectors}"
+
+
+def extract_embeddings(
+        image_data: bytes,
+        mode: Optional[str] = None,
+        face_box: Optional[Dict[str, int]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Decode an uploaded image and run the full face pipeline on it.
+
+    This is the CPU-bound part of a request. It is a plain synchronous function so
+    that it can be submitted to the inference pool (thread or process) instead of
+    running on the event loop.
+
+    `mode` overrides PIPELINE_MODE ("full" or "reduced").
+
+    `face_box` is the face located by the client ({"x", "y", "w", "h"}). When it is
+    set and CLIENT_FACE_BOX is on, server-side detection is skipped.
+
+    With QUALITY_GATE on, blurry, badly exposed or face-less images are rejected with
+    an ImageQualityError before enhancement, anti-spoofing and the forward pass run.
+    """
+    if face_box and CLIENT_FACE_BOX:
+        return _extract_face_box(image_data, face_box)
+
+    if (mode or PIPELINE_MODE) == "reduced":
+        return _extract_reduced(image_data)
+
+    with metrics.stage("decode"):
+        image_np = decode_image(image_data)
+
+    if QUALITY_GATE:
+        with metrics.stage("quality"):
+            check_quality(image_np, detect=quality_gate_detects())
+
+    return _embed(image_np)
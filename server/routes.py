@@ -1,24 +1,50 @@
-﻿import logging
+﻿import asyncio
+import datetime
+import logging
 import os
-from typing import Any
 import uuid
+import zipfile
+from typing import Optional
 import httpx
 
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Response
+from fastapi import APIRouter, UploadFile, File, Form, Header, Depends, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse, PlainTextResponse
 from qdrant_client import AsyncQdrantClient, models
 
-from server.deps import INTERNAL_SERVICE_KEY, get_embeddings, get_qdrant_client, verify_internal_request
+from server.deps import get_embeddings, get_http_client, get_qdrant_client, verify_internal_request, verify_websocket_origin
 from server.dtos import ApiResponseDto, FaceRegisterRequestDto
+from server.enrollment import build_face_point, bulk_jobs, register_with_core
+from server.pipeline import CLIENT_FACE_BOX, extract_embeddings, parse_face_box, score_frame
+from server.streaming import STREAM_MAX_ATTEMPTS, STREAM_MAX_FRAME_BYTES, STREAM_TIMEOUT_SECONDS, FrameReceiver, FrameSelector
+from server.utils import metrics
+from server.utils.admission import (
+    OVERLOADED_MESSAGE, PRIORITY_REGISTER, PRIORITY_VERIFY, AdmissionRejected, admission, admitted,
+)
+from server.utils.detector_cascade import is_no_face_error, record_detection
+from server.utils.faces_collection import FACES_COLLECTION, normalize, search_params, store_filter
+from server.utils.forward_batcher import forward_batcher
+from server.utils.gallery import GALLERY_REPLICA, face_gallery
+from server.utils.inference_pool import inference_pool
 from server.utils.jwt_helper import create_signed_jwt
+from server.utils.quality import REASON_MESSAGES, ImageQualityError, record_rejection, rejection_counts
+from server.utils.query_coalescer import query_coalescer, query_faces
+from server.utils.rate_limiter import RATE_LIMIT_ENABLED, allow_request, is_exempt, retry_after_header
 from server.utils.rsa_keys import rsa_manager
 
 router = APIRouter()
-logging.basicConfig(
-    filename=os.getcwd() + "/logs/app.log",
-    level=logging.INFO,
-    datefmt='%Y-%m-%d %H:%M:%S',
-    format='%(asctime)s %(levelname)s %(message)s',
-)
+
+# search the whole gallery when a store-scoped search finds no match, so an employee
+# punching in at another branch is still recognized
+STORE_SCOPE_FALLBACK = os.getenv("STORE_SCOPE_FALLBACK", "true").lower() == "true"
+
+
+def _overloaded(e: AdmissionRejected) -> JSONResponse:
+    """Fast 503 for a request the admission controller turned away."""
+    return JSONResponse(
+        status_code=503,
+        content=ApiResponseDto(message=OVERLOADED_MESSAGE, success=False, statusCode=503, data={"reason": e.reason}).model_dump(),
+        headers={"Retry-After": retry_after_header(e.retry_after)},
+    )
 
 @router.get("/health")
 def health_check():
@@ -26,64 +52,369 @@ def health_check():
 
 
 @router.get("/internal/jwks", dependencies=[Depends(verify_internal_request)])
-async def get_jwks():
+async def get_jwks(if_none_match: Optional[str] = Header(None)):
     """
     Internal endpoint for ASP.NET Core to fetch public keys in JWK format.
     This endpoint should be protected and only accessible from your backend service.
+
+    The document is encoded once per key rotation. It carries a strong ETag, answers
+    conditional requests with 304 and may be cached until the next rotation.
     """
     try:
-        jwks = rsa_manager.get_public_jwk()
-        return jwks
+        body, etag = rsa_manager.get_jwks_document()
+        next_rotation = rsa_manager.get_rotation_info()["next_rotation"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve keys: {str(e)}")
 
+    max_age = 0
+    if next_rotation:
+        remaining = datetime.datetime.fromisoformat(next_rotation) - datetime.datetime.now(datetime.timezone.utc)
+        max_age = max(0, int(remaining.total_seconds()))
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={max_age}, must-revalidate",
+    }
+
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/internal/batching-stats", dependencies=[Depends(verify_internal_request)])
+async def get_batching_stats():
+    """
+    Internal endpoint exposing batch-size and queue-wait metrics of the forward-pass batcher.
+    """
+    return forward_batcher.stats()
+
+
+@router.get("/internal/query-batching-stats", dependencies=[Depends(verify_internal_request)])
+async def get_query_batching_stats():
+    """
+    Internal endpoint exposing batch-size metrics of the Qdrant query coalescer.
+    """
+    return query_coalescer.stats()
+
+
+@router.get("/internal/admission-stats", dependencies=[Depends(verify_internal_request)])
+async def get_admission_stats():
+    """
+    Internal endpoint exposing the inference queue depth, admissions and rejections.
+    """
+    return admission.stats()
+
+
+@router.get("/metrics", dependencies=[Depends(verify_internal_request)])
+async def get_metrics():
+    """
+    Internal endpoint exposing stage and request histograms in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.post("/internal/bulk-enroll", dependencies=[Depends(verify_internal_request)])
+async def start_bulk_enroll(
+    manifest: UploadFile = File(...),
+    images: UploadFile = File(...),
+    job_id: Optional[str] = Form(None),
+    qdrant: AsyncQdrantClient = Depends(get_qdrant_client),
+    http_client: httpx.AsyncClient = Depends(get_http_client),
+):
+    """
+    Internal endpoint to enroll a whole store: a CSV manifest and a zip archive of the
+    images. Runs in the background, poll /internal/bulk-enroll/{job_id} for progress.
+    Submitting again with the same job_id resumes from its checkpoint.
+    """
+    job_id = job_id or uuid.uuid4().hex
+    if not job_id.isalnum():
+        raise HTTPException(status_code=400, detail="Invalid job id")
+
+    existing = await bulk_jobs.get(job_id)
+    if existing and existing["status"] == "running":
+        raise HTTPException(status_code=409, detail="Bulk enrollment is already running")
+
+    directory = bulk_jobs.job_dir(job_id)
+    os.makedirs(directory, exist_ok=True)
+
+    # stream both uploads to disk, the archive is read lazily one image at a time
+    for upload, file_name in ((manifest, "manifest.csv"), (images, "images.zip")):
+        with open(os.path.join(directory, file_name), "wb") as f:
+            while chunk := await upload.read(1024 * 1024):
+                await asyncio.to_thread(f.write, chunk)
+
+    if not zipfile.is_zipfile(os.path.join(directory, "images.zip")):
+        raise HTTPException(status_code=400, detail="Images must be a zip archive")
+
+    job = await bulk_jobs.start(job_id, qdrant, http_client, inference_pool)
+    return ApiResponseDto(message="Bulk enrollment started", success=True, statusCode=202, data=job)
+
+
+@router.get("/internal/bulk-enroll/{job_id}", dependencies=[Depends(verify_internal_request)])
+async def get_bulk_enroll(job_id: str):
+    """
+    Internal endpoint exposing the status and progress of a bulk enrollment.
+    """
+    job = await bulk_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Bulk enrollment not found")
+    return job
+
+
+async def _search_face(qdrant: AsyncQdrantClient, embedding: list, store_id: Optional[str]) -> list:
+    """Find the best match above the threshold, optionally scoped to one store."""
+    if GALLERY_REPLICA and face_gallery.is_fresh:
+        with metrics.stage("search_replica"):
+            points = face_gallery.search(
+                query=embedding,
+                limit=1,
+                with_payload=["user_id"],
+                score_threshold=0.85,
+                store_id=store_id,
+            )
+        # a miss may be a face registered elsewhere since the last refresh, ask Qdrant
+        if points:
+            return points
+
+    with metrics.stage("search_qdrant"):
+        return await query_faces(qdrant, models.QueryRequest(
+            query=normalize(embedding),
+            filter=store_filter(store_id),
+            params=search_params(),
+            limit=1,
+            with_payload=["user_id"],
+            score_threshold=0.85,
+        ))
+
+
+async def _match_face(qdrant: AsyncQdrantClient, embeddings: list, store_id: Optional[str]) -> dict:
+    """Check liveness, find the employee and sign their JWT. Raises HTTPException when verification fails."""
+    if len(embeddings) > 1:
+        raise HTTPException(status_code=400, detail="Multiple faces detected")
+
+    is_real = all(i['is_real'] for i in embeddings)
+
+    if not is_real:
+        raise HTTPException(status_code=400, detail="Face is not real, please try again.")
+
+    points = await _search_face(qdrant, embeddings[0]["embedding"], store_id)
+    if not points and store_id and STORE_SCOPE_FALLBACK:
+        points = await _search_face(qdrant, embeddings[0]["embedding"], None)
+
+    if not points or len(points) == 0 or points[0].payload is None:
+        raise HTTPException(status_code=404, detail="No match found. Please register your face.")
+
+    user_id = points[0].payload["user_id"]
+    with metrics.stage("jwt"):
+        jwt_token = create_signed_jwt(payload={"user_id": user_id})
+
+    return {
+        "jwt_token": jwt_token,
+        "user_id": user_id
+    }
+
+
+@router.get("/internal/quality-stats", dependencies=[Depends(verify_internal_request)])
+async def get_quality_stats():
+    """
+    Internal endpoint exposing the number of uploads rejected by the quality gate, per reason.
+    """
+    return rejection_counts()
+
 
 @router.post("/api/verify-face")
 async def verify_face(
     response: Response,
     image: UploadFile = File(...),
+    store_id: Optional[str] = Form(None, alias="storeId"),
+    face_box: Optional[str] = Form(None, alias="faceBox"),
+    x_deadline_ms: Optional[float] = Header(None),
     qdrant: AsyncQdrantClient = Depends(get_qdrant_client),
 ):
+    """
+    Verify a face against the registered employees.
+
+    `faceBox` is the face located by the client's face tracker, {"x", "y", "w", "h"} as
+    JSON or "x,y,w,h" in pixels of the upright image. The server then skips detection
+    and only checks the box is plausible. A pre-cropped upload sends the face with some
+    context around it (anti-spoofing looks at up to 4x the box) and the box within it.
+    Ignored, not even parsed, unless CLIENT_FACE_BOX is on.
+
+    `X-Deadline-Ms` is the time the client still waits for an answer. The request is
+    rejected with 503 and Retry-After when it cannot start in time or the server is
+    saturated, verifications are served before registrations.
+    """
+    deadline = admission.deadline(PRIORITY_VERIFY, x_deadline_ms)
     try:
-        embeddings = await get_embeddings(image)
-        if len(embeddings) > 1:
-            raise HTTPException(status_code=400, detail="Multiple faces detected")
+        embeddings = await get_embeddings(
+            image,
+            face_box=parse_face_box(face_box) if face_box and CLIENT_FACE_BOX else None,
+            priority=PRIORITY_VERIFY,
+            deadline=deadline,
+        )
 
-        is_real = all(i['is_real'] for i in embeddings)
+        return ApiResponseDto(
+            message="Face verified successfully",
+            success=True,
+            statusCode=200,
+            data=await _match_face(qdrant, embeddings, store_id)
+        )
+    except AdmissionRejected as e:
+        return _overloaded(e)
+    except ImageQualityError as e:
+        return ApiResponseDto(message=e.message, success=False, statusCode=400, data={"reason": e.reason})
+    except ValueError as e:
+        logging.error(msg=str(e))
+        return ApiResponseDto(
+            message="Unable to detect face, ensure the face and camera is clear",
+            success=False,
+            statusCode=400
+		)
+    except HTTPException as e:
+        logging.error(msg=str(e))
+        return ApiResponseDto(message=e.detail, success=False, statusCode=e.status_code)
+    except Exception as e:
+        logging.error(msg=str(e))
+        return ApiResponseDto(message="Something went wrong. Please try again.", success=False, statusCode=500)
 
-        if not is_real:
-            raise HTTPException(status_code=400, detail="Face is not real, please try again.")
 
-        qdrantResult = await qdrant.query_points(
-            collection_name="faces",
-            query=embeddings[0]["embedding"],
-            limit=1,
-            with_payload=["user_id"],
-            score_threshold=0.85,
+@router.websocket("/ws/verify-face")
+async def verify_face_stream(websocket: WebSocket, store_id: Optional[str] = Query(None, alias="storeId")):
+    """
+    Verify a face from a stream of low-resolution frames (binary JPEG/PNG messages).
+
+    Every frame only gets the cheap quality check, the client receives a `feedback`
+    message with the reason when a frame is unusable. Liveness and Facenet512 run on
+    the best frames only (see FrameSelector). The connection ends with one message
+    shaped like the /api/verify-face response, as soon as a frame verifies, after
+    STREAM_MAX_ATTEMPTS failed attempts or after STREAM_TIMEOUT_SECONDS, typed
+    `result`. Handshakes from an origin outside ALLOWED_ORIGINS are refused, the
+    rate limit of the HTTP routes applies per connection (the middleware only sees HTTP).
+    """
+    if not verify_websocket_origin(websocket):
+        logging.warning(f"Refused stream from origin {websocket.headers.get('origin')}")
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    if RATE_LIMIT_ENABLED and not is_exempt(websocket.url.path):
+        allowed, retry_after = allow_request(websocket)
+        if not allowed:
+            await websocket.close(
+                code=status.WS_1013_TRY_AGAIN_LATER,
+                reason=f"Too many requests, retry after {retry_after_header(retry_after)}s",
+            )
+            return
+
+    await websocket.accept()
+    receiver = FrameReceiver(websocket)
+    receiver.start()
+
+    try:
+        result = await asyncio.wait_for(
+            _verify_stream(websocket, receiver, websocket.app.state.qdrant_client, store_id),
+            timeout=STREAM_TIMEOUT_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        result = ApiResponseDto(
+            message="No usable frame in time, ensure the face and camera is clear",
+            success=False,
+            statusCode=408
         )
+    except WebSocketDisconnect:
+        return
+    finally:
+        await receiver.stop()
+
+    try:
+        await websocket.send_json({"type": "result", **result.model_dump()})
+        await websocket.close()
+    except (WebSocketDisconnect, RuntimeError):
+        pass
 
-        if not qdrantResult.points or len(qdrantResult.points) == 0 or qdrantResult.points[0].payload is None:
-            raise HTTPException(status_code=404, detail="No match found. Please register your face.")
 
-        user_id = qdrantResult.points[0].payload["user_id"]
-        jwt_token = create_signed_jwt(payload={"user_id": user_id})
+async def _verify_stream(
+    websocket: WebSocket,
+    receiver: FrameReceiver,
+    qdrant: AsyncQdrantClient,
+    store_id: Optional[str],
+) -> ApiResponseDto:
+    selector = FrameSelector()
+    attempts = 0
+
+    while True:
+        frame = await receiver.next_frame()
+
+        if len(frame) > STREAM_MAX_FRAME_BYTES:
+            await websocket.send_json({"type": "feedback", "reason": "frame_too_large", "message": "Frame is too large."})
+            continue
+
+        try:
+            # cheap, but it runs on the same pool as the verifications
+            async with admitted(PRIORITY_VERIFY):
+                scored = await inference_pool.run(score_frame, frame)
+        except AdmissionRejected:
+            await websocket.send_json({"type": "feedback", "reason": "busy", "message": OVERLOADED_MESSAGE})
+            continue
+        except Exception as e:
+            logging.error(msg=f"Unreadable stream frame: {e}")
+            await websocket.send_json({"type": "feedback", "reason": "invalid_frame", "message": "Frame could not be read."})
+            continue
+
+        if scored["reason"]:
+            record_rejection(scored["reason"])
+            await websocket.send_json({
+                "type": "feedback",
+                "reason": scored["reason"],
+                "message": REASON_MESSAGES[scored["reason"]],
+            })
+
+        best = selector.add(frame, scored["score"])
+        if best is None:
+            continue
+
+        attempts += 1
+        result = await _verify_frame(qdrant, best, store_id)
+
+        if result.success or attempts >= STREAM_MAX_ATTEMPTS:
+            return result
+
+        await websocket.send_json({"type": "feedback", "reason": "retry", "message": result.message})
+
+
+async def _verify_frame(qdrant: AsyncQdrantClient, frame: bytes, store_id: Optional[str]) -> ApiResponseDto:
+    try:
+        async with admitted(PRIORITY_VERIFY):
+            embeddings = await inference_pool.run(extract_embeddings, frame)
+        if embeddings:
+            record_detection(embeddings[0].get("detector_backend"))
 
         return ApiResponseDto(
             message="Face verified successfully",
             success=True,
             statusCode=200,
-            data={
-                "jwt_token": jwt_token,
-                "user_id": user_id
-            }
+            data=await _match_face(qdrant, embeddings, store_id)
         )
+    except AdmissionRejected as e:
+        return ApiResponseDto(
+            message=OVERLOADED_MESSAGE,
+            success=False,
+            statusCode=503,
+            data={"reason": e.reason, "retryAfter": retry_after_header(e.retry_after)}
+        )
+    except ImageQualityError as e:
+        return ApiResponseDto(message=e.message, success=False, statusCode=400, data={"reason": e.reason})
     except ValueError as e:
+        if is_no_face_error(e):
+            record_detection(None)
         logging.error(msg=str(e))
         return ApiResponseDto(
             message="Unable to detect face, ensure the face and camera is clear",
             success=False,
             statusCode=400
-		)
+        )
     except HTTPException as e:
         logging.error(msg=str(e))
         return ApiResponseDto(message=e.detail, success=False, statusCode=e.status_code)
@@ -96,10 +427,13 @@ async def verify_face(
 async def register_face(
     request: FaceRegisterRequestDto,
     image: UploadFile = File(...),
-    qdrant: AsyncQdrantClient = Depends(get_qdrant_client)
+    qdrant: AsyncQdrantClient = Depends(get_qdrant_client),
+    http_client: httpx.AsyncClient = Depends(get_http_client),
+    x_deadline_ms: Optional[float] = Header(None),
 ):
+    deadline = admission.deadline(PRIORITY_REGISTER, x_deadline_ms)
     try:
-        embeddings = await get_embeddings(image)
+        embeddings = await get_embeddings(image, priority=PRIORITY_REGISTER, deadline=deadline)
 
         if len(embeddings) == 0:
             logging.warning("No face detected in image")
@@ -123,13 +457,14 @@ async def register_face(
             )
 
 
-        existing_face = await qdrant.search(
-			collection_name="faces",
-			query_vector=embeddings[0]['embedding'],
-			limit=1,
-			with_payload=["email"],
-			score_threshold=0.85
-		)
+        with metrics.stage("search_qdrant"):
+            existing_face = await query_faces(qdrant, models.QueryRequest(
+                query=normalize(embeddings[0]['embedding']),
+                params=search_params(),
+                limit=1,
+                with_payload=["email"],
+                score_threshold=0.85
+            ))
 
         if existing_face and len(existing_face) > 0 and existing_face[0].payload and existing_face[0].payload["email"] == request.email:
             raise HTTPException(
@@ -137,59 +472,16 @@ async def register_face(
                 detail="Face already registered. Please login instead or use a different email."
             )
 
-        payload = {
-            "firstName": request.firstName,
-            "lastName": request.lastName,
-            "email": request.email,
-            "position": request.position,
-            "departmentId": request.departmentId,
-            "storeId": request.storeId,
-            "timeLogged": request.timeLogged.isoformat()
-        }
-        signed_jwt = create_signed_jwt(payload=payload)
-
-        try:
-            async with httpx.AsyncClient() as client:
-                api_url = os.getenv("API_URL")
-
-                auth_response = await client.post(
-                    url=f"{api_url}/api/Auth/face-register",
-                    headers={
-                        "Authorization": f"Bearer {signed_jwt}",
-                        "X-Internal-Key": INTERNAL_SERVICE_KEY,
-                        "Content-Type": "application/json"
-                    },
-                    json=payload
-                )
-
-                if auth_response.status_code not in [200, 201]:
-                    raise HTTPException(status_code=auth_response.status_code, detail=auth_response.text)
-                else:
-                    # Same data type as AuthResponseDto from core service
-                    data: dict[str, Any] = auth_response.json()
-
-        except httpx.TimeoutException as e:
-            logging.error(f"Failed to register face: {e}")
-            raise HTTPException(status_code=504, detail="Registration service is unavailable. Please try again later.")
-        except httpx.RequestError as e:
-            logging.error(f"Failed to connect to auth service: {e}")
-            raise HTTPException(status_code=500, detail="Failed to connect to auth service")
+        # Same data type as AuthResponseDto from core service
+        data = await register_with_core(http_client, request)
 
 		# Store the embedding in Qdrant with user_id as the id after successful registration
-        await qdrant.upsert(
-            collection_name="faces",
-            points=[
-				models.PointStruct(
-					id=str(uuid.uuid5(uuid.NAMESPACE_DNS, data['user']['id'])),
-					vector=embeddings[0]['embedding'],
-					payload={
-						"user_id": data['user']['id'],
-						"email": data['user']['email'],
-						"registered_at": request.timeLogged.isoformat()
-					}
-				)
-			]
-        )
+        point = build_face_point(data['user'], embeddings[0]['embedding'], request)
+        with metrics.stage("upsert"):
+            await qdrant.upsert(collection_name=FACES_COLLECTION, points=[point])
+
+        if GALLERY_REPLICA:
+            face_gallery.upsert(str(point.id), embeddings[0]['embedding'], point.payload or {})
 
         return ApiResponseDto(
 			message="Face registered successfully",
@@ -197,6 +489,10 @@ async def register_face(
 			statusCode=200,
 			data=data
 		)
+    except AdmissionRejected as e:
+        return _overloaded(e)
+    except ImageQualityError as e:
+        return ApiResponseDto(message=e.message, success=False, statusCode=400, data={"reason": e.reason})
     except ValueError as e:
         logging.error(msg=str(e))
         return ApiResponseDto(
@@ -0,0 +1,93 @@
+import asyncio
+import os
+from typing import Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+# frames scored before the best one so far is verified
+STREAM_SELECT_FRAMES = int(os.getenv("STREAM_SELECT_FRAMES", "5"))
+# score (0-1, see quality.frame_score) at which a frame is verified right away
+STREAM_GOOD_SCORE = float(os.getenv("STREAM_GOOD_SCORE", "0.6"))
+# full pipeline runs per connection before giving up
+STREAM_MAX_ATTEMPTS = int(os.getenv("STREAM_MAX_ATTEMPTS", "3"))
+STREAM_TIMEOUT_SECONDS = float(os.getenv("STREAM_TIMEOUT_SECONDS", "15"))
+STREAM_MAX_FRAME_BYTES = int(os.getenv("STREAM_MAX_FRAME_BYTES", str(512 * 1024)))
+# unscored frames kept while the server is busy, older ones are dropped
+STREAM_BUFFER_FRAMES = int(os.getenv("STREAM_BUFFER_FRAMES", "2"))
+
+
+class FrameSelector:
+    """
+    Picks which streamed frames get the expensive pipeline (liveness and Facenet512).
+
+    A frame scoring at least `good_score` is chosen immediately. Otherwise the best
+    passing frame of each window of `window` frames is chosen, so a kiosk facing a
+    mediocre but usable scene still gets an answer.
+    """
+
+    def __init__(self, window: int = STREAM_SELECT_FRAMES, good_score: float = STREAM_GOOD_SCORE):
+        self.window = window
+        self.good_score = good_score
+        self._best: Optional[Tuple[float, bytes]] = None
+        self._seen = 0
+
+    def add(self, frame: bytes, score: Optional[float]) -> Optional[bytes]:
+        """Add a scored frame (score None when it failed the gate), returns the frame to verify if any."""
+        self._seen += 1
+        if score is not None and (self._best is None or score > self._best[0]):
+            self._best = (score, frame)
+
+        if self._best is None:
+            return None
+
+        if self._best[0] >= self.good_score or self._seen >= self.window:
+            chosen = self._best[1]
+            self._best = None
+            self._seen = 0
+            return chosen
+
+        return None
+
+
+class FrameReceiver:
+    """
+    Reads binary frames from a WebSocket in the background and keeps only the most
+    recent ones, so a client streaming faster than frames are scored never builds up
+    a backlog of stale frames.
+    """
+
+    def __init__(self, websocket: WebSocket, buffer_frames: int = STREAM_BUFFER_FRAMES):
+        self.websocket = websocket
+        self._frames: asyncio.Queue = asyncio.Queue(maxsize=buffer_frames)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._receive())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, WebSocketDisconnect):
+                pass
+
+    async def next_frame(self) -> bytes:
+        """Next frame, raises WebSocketDisconnect when the client has gone."""
+        frame = await self._frames.get()
+        if frame is None:
+            raise WebSocketDisconnect()
+        return frame
+
+    async def _receive(self):
+        try:
+            while True:
+                frame = await self.websocket.receive_bytes()
+                if self._frames.full():
+                    self._frames.get_nowait()
+                self._frames.put_nowait(frame)
+        except Exception:
+            # disconnected (or sent a text message): wake up the consumer
+            if self._frames.full():
+                self._frames.get_nowait()
+            self._frames.put_nowait(None)
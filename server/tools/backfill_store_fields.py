@@ -0,0 +1,103 @@
+"""
+Backfill `store_id` and `department_id` on existing points of the faces collection.
+
+Faces registered before the store fields were stored only carry `user_id`, `email`
+and `registered_at`, so store-scoped searches cannot find them. This tool reads a
+CSV exported from the core service with the columns `user_id,store_id,department_id`
+and sets the fields on every point that is missing them.
+
+Usage:
+    python -m server.tools.backfill_store_fields employees.csv [--dry-run]
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from dotenv import load_dotenv
+from qdrant_client import AsyncQdrantClient, models
+
+from server.utils.faces_collection import FACES_COLLECTION, ensure_payload_indexes
+
+
+def _read_mapping(path: str) -> Dict[str, Tuple[str, str]]:
+    with open(path, newline="") as f:
+        return {
+            row["user_id"]: (row.get("store_id") or "", row.get("department_id") or "")
+            for row in csv.DictReader(f)
+        }
+
+
+async def backfill(client: AsyncQdrantClient, mapping: Dict[str, Tuple[str, str]], dry_run: bool = False) -> int:
+    """Set the store fields on points missing them. Returns the number of updated points."""
+    await ensure_payload_indexes(client)
+
+    missing_store = models.Filter(must=[models.IsEmptyCondition(is_empty=models.PayloadField(key="store_id"))])
+
+    # group point ids by their (store, department) so each group is one set_payload call
+    groups: Dict[Tuple[str, str], List] = defaultdict(list)
+    unknown = 0
+    offset = None
+
+    while True:
+        records, offset = await client.scroll(
+            collection_name=FACES_COLLECTION,
+            scroll_filter=missing_store,
+            limit=1000,
+            offset=offset,
+            with_payload=["user_id"],
+            with_vectors=False,
+        )
+
+        for record in records:
+            user_id = (record.payload or {}).get("user_id")
+            if user_id not in mapping:
+                unknown += 1
+                continue
+            groups[mapping[user_id]].append(record.id)
+
+        if offset is None:
+            break
+
+    if unknown:
+        logging.warning(f"{unknown} points have no entry in the mapping and were skipped")
+
+    updated = 0
+    for (store_id, department_id), point_ids in groups.items():
+        payload = {"store_id": store_id or None, "department_id": department_id or None}
+        logging.info(f"Setting {payload} on {len(point_ids)} points")
+
+        if not dry_run:
+            await client.set_payload(
+                collection_name=FACES_COLLECTION,
+                payload=payload,
+                points=point_ids,
+                wait=True,
+            )
+        updated += len(point_ids)
+
+    return updated
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill store_id/department_id on the faces collection.")
+    parser.add_argument("mapping", help="CSV with user_id,store_id,department_id columns")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be updated")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    client = AsyncQdrantClient(url=os.getenv("QDRANT_ENDPOINT"), api_key=os.getenv("QDRANT_API"))
+    try:
+        updated = await backfill(client, _read_mapping(args.mapping), dry_run=args.dry_run)
+        logging.info(f"Backfill done, {updated} points {'would be ' if args.dry_run else ''}updated")
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
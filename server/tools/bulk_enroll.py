@@ -0,0 +1,87 @@
+"""
+Enroll a whole store from a directory or zip archive of images and a CSV manifest.
+
+The manifest has the columns `image,email,firstName,lastName,position,departmentId,storeId`
+and optionally `user_id` for employees already registered with the core service. Images
+are embedded in parallel and upserted to Qdrant in batches. Progress is checkpointed
+next to the source, so running the same command again resumes an interrupted run.
+
+Usage:
+    python -m server.tools.bulk_enroll images/ manifest.csv [--batch-size 64] [--concurrency 4]
+    python -m server.tools.bulk_enroll images.zip --list-images > manifest.csv
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+from qdrant_client import AsyncQdrantClient
+
+from server.enrollment import (
+    BULK_ENROLL_BATCH_SIZE,
+    BULK_ENROLL_CONCURRENCY,
+    BulkEnroller,
+    Checkpoint,
+    ImageSource,
+    checkpoint_path_for,
+    list_images,
+    read_manifest,
+)
+from server.utils.faces_collection import ensure_collection
+from server.utils.http_client import create_core_client
+from server.utils.inference_pool import INFERENCE_EXECUTOR, InferencePool
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk enroll employee faces.")
+    parser.add_argument("source", help="Directory or zip archive of images")
+    parser.add_argument("manifest", nargs="?", help="CSV manifest, image paths relative to the source")
+    parser.add_argument("--list-images", action="store_true", help="Write a manifest template with the images of the source")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: next to the source)")
+    parser.add_argument("--batch-size", type=int, default=BULK_ENROLL_BATCH_SIZE, help="Points per Qdrant upsert")
+    parser.add_argument("--concurrency", type=int, default=BULK_ENROLL_CONCURRENCY, help="Images embedded in parallel")
+    args = parser.parse_args()
+
+    if args.list_images:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["image", "email", "firstName", "lastName", "position", "departmentId", "storeId", "user_id"])
+        for name in list_images(args.source):
+            writer.writerow([name] + [""] * 7)
+        return
+
+    if not args.manifest:
+        parser.error("the manifest is required")
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    with open(args.manifest, encoding="utf-8-sig") as f:
+        rows = read_manifest(f.read())
+
+    checkpoint = Checkpoint(args.checkpoint or checkpoint_path_for(args.source))
+    source = ImageSource(args.source)
+
+    client = AsyncQdrantClient(url=os.getenv("QDRANT_ENDPOINT"), api_key=os.getenv("QDRANT_API"))
+    http_client = create_core_client()
+    pool = InferencePool(kind=INFERENCE_EXECUTOR, max_workers=args.concurrency)
+
+    try:
+        await ensure_collection(client)
+        await pool.start(warmup_image=os.getcwd() + "/images/sample-face.jpg")
+
+        enroller = BulkEnroller(client, http_client, pool, batch_size=args.batch_size, concurrency=args.concurrency)
+        progress = await enroller.run(rows, source, checkpoint)
+
+        logging.info(f"Bulk enrollment done: {progress}, checkpoint at {checkpoint.path}")
+    finally:
+        pool.shutdown()
+        source.close()
+        await http_client.aclose()
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
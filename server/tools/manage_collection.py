@@ -0,0 +1,121 @@
+"""
+Create or migrate the faces collection to the tuned settings.
+
+Target settings (see server.utils.faces_collection): dot product on L2-normalized
+vectors, HNSW m/ef_construct from QDRANT_HNSW_M/QDRANT_HNSW_EF_CONSTRUCT, int8 scalar
+quantization kept in RAM, searches rescoring the quantized candidates.
+
+- `create` creates the collection when it does not exist, with its payload indexes.
+- `info` prints the current settings and what a migration would do.
+- `migrate` applies HNSW and quantization in place. A collection still on Cosine is
+  copied into a new one (normalizing every vector), because the distance cannot be
+  changed in place. With --swap, the copy is swapped in right away.
+- `swap <target>` swaps in an existing copy, e.g. one verified after `migrate`. Faces
+  registered since the copy started are copied over first (by `indexed_at`), and the
+  swap is refused unless both collections then hold the same number of points.
+  `faces` then becomes an alias of the copy. When the old collection is named `faces`
+  itself it has to be deleted first: searches fail until the alias is created, and a
+  face registered in between is lost, pause registrations for a hard guarantee.
+
+Usage:
+    python -m server.tools.manage_collection create
+    python -m server.tools.manage_collection info
+    python -m server.tools.manage_collection migrate [--swap] [--batch-size 256]
+    python -m server.tools.manage_collection swap faces_20260101120000 [--batch-size 256]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+
+from dotenv import load_dotenv
+from qdrant_client import AsyncQdrantClient
+
+from server.utils.faces_collection import (
+    FACES_COLLECTION,
+    catch_up_collection,
+    copy_collection,
+    count_points,
+    describe_collection,
+    ensure_collection,
+    swap_alias,
+    update_collection,
+)
+
+
+async def migrate(client: AsyncQdrantClient, swap: bool, batch_size: int):
+    current = await describe_collection(client)
+
+    if not current["needs_copy"]:
+        if current["needs_update"]:
+            logging.info("Updating HNSW and quantization settings in place")
+            await update_collection(client)
+        else:
+            logging.info("Collection already has the target settings")
+        return
+
+    target = await copy_collection(client, FACES_COLLECTION, batch_size=batch_size)
+    logging.info(f"Copied {FACES_COLLECTION} into {target}")
+
+    if not swap:
+        logging.info(f"Verify {target}, then run `swap {target}` to point {FACES_COLLECTION} at it")
+        return
+
+    await swap(client, target, batch_size)
+
+
+async def swap(client: AsyncQdrantClient, target: str, batch_size: int):
+    if target == FACES_COLLECTION or not await client.collection_exists(target):
+        raise SystemExit(f"No collection {target} to swap in")
+
+    aliases = await client.get_aliases()
+    is_alias = any(alias.alias_name == FACES_COLLECTION for alias in aliases.aliases)
+
+    # faces registered while the copy was made, twice: the first pass may take a while
+    for _ in range(2):
+        copied = await catch_up_collection(client, FACES_COLLECTION, target, batch_size=batch_size)
+        logging.info(f"Caught up {copied} points from {FACES_COLLECTION} into {target}")
+
+    source_count = await count_points(client, FACES_COLLECTION)
+    target_count = await count_points(client, target)
+    if source_count != target_count:
+        raise SystemExit(
+            f"{FACES_COLLECTION} has {source_count} points and {target} {target_count}, not swapping. "
+            f"Run `swap {target}` again, or copy again when points were deleted since."
+        )
+
+    await swap_alias(client, FACES_COLLECTION, target, delete_collection=None if is_alias else FACES_COLLECTION)
+    logging.info(f"{FACES_COLLECTION} now points at {target}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Create or migrate the faces collection.")
+    parser.add_argument("command", choices=["create", "info", "migrate", "swap"])
+    parser.add_argument("target", nargs="?", help="Collection to swap in (swap)")
+    parser.add_argument("--swap", action="store_true", help="Point the faces alias at the migrated copy")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    if args.command == "swap" and not args.target:
+        parser.error("swap needs the collection to swap in")
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    client = AsyncQdrantClient(url=os.getenv("QDRANT_ENDPOINT"), api_key=os.getenv("QDRANT_API"))
+    try:
+        if args.command == "create":
+            await ensure_collection(client)
+        elif args.command == "info":
+            print(json.dumps(await describe_collection(client), indent=2, default=str))
+        elif args.command == "migrate":
+            await migrate(client, args.swap, args.batch_size)
+        else:
+            await swap(client, args.target, args.batch_size)
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,220 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from server.utils import metrics
+from server.utils.inference_pool import INFERENCE_WORKERS
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+# requests running the inference pipeline at once, more would only queue in the pool
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", str(INFERENCE_WORKERS)))
+# requests waiting for a slot, beyond that they are rejected right away
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+# time budget of a request when the client does not send X-Deadline-Ms
+ADMISSION_VERIFY_DEADLINE_MS = float(os.getenv("ADMISSION_VERIFY_DEADLINE_MS", "5000"))
+ADMISSION_REGISTER_DEADLINE_MS = float(os.getenv("ADMISSION_REGISTER_DEADLINE_MS", "30000"))
+# bulk enrollment rows retry when rejected, the deadline only bounds one wait
+ADMISSION_BULK_DEADLINE_MS = float(os.getenv("ADMISSION_BULK_DEADLINE_MS", "60000"))
+
+# lower runs first
+PRIORITY_VERIFY = 0
+PRIORITY_REGISTER = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_VERIFY: "verify", PRIORITY_REGISTER: "register", PRIORITY_BULK: "bulk"}
+DEFAULT_DEADLINES_MS = {
+    PRIORITY_VERIFY: ADMISSION_VERIFY_DEADLINE_MS,
+    PRIORITY_REGISTER: ADMISSION_REGISTER_DEADLINE_MS,
+    PRIORITY_BULK: ADMISSION_BULK_DEADLINE_MS,
+}
+
+OVERLOADED_MESSAGE = "Server is busy. Please try again shortly."
+
+wait_histogram = metrics.Histogram(
+    "admission_wait_seconds",
+    "Time a request waited for an inference slot.",
+    label="priority",
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted: queue full, deadline passed or preempted."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounded priority queue in front of the inference pipeline.
+
+    At most `max_active` requests run at once. The others wait in a queue ordered by
+    priority, then arrival, and a finishing request hands its slot to the next one.
+    A request is rejected with AdmissionRejected, carrying a Retry-After estimate, when:
+    - the queue is full and holds nothing of lower priority to make room,
+    - its deadline passes while it waits (or has already passed),
+    - a request of higher priority takes its place in a full queue.
+
+    Runs on the event loop, no locking needed.
+    """
+
+    def __init__(self, max_active: int = 2, queue_size: int = 32):
+        self.max_active = max(1, max_active)
+        self.queue_size = max(0, queue_size)
+
+        self._active = 0
+        # [priority, sequence, deadline, future], cancelled or expired entries are skipped when popped
+        self._queue: List[list] = []
+        self._sequence = itertools.count()
+        # moving average of the time a request holds a slot, for Retry-After
+        self._service_seconds = 1.0
+
+        # Metrics
+        self._admitted: Counter = Counter()
+        self._rejected: Counter = Counter()
+
+    def deadline(self, priority: int, budget_ms: Optional[float] = None) -> float:
+        """Deadline (time.monotonic) of a request starting now, `budget_ms` defaults per priority."""
+        return time.monotonic() + (budget_ms if budget_ms is not None else DEFAULT_DEADLINES_MS[priority]) / 1000
+
+    @asynccontextmanager
+    async def slot(self, priority: int, deadline: float):
+        """Hold an inference slot for the duration of the block."""
+        with metrics.stage("admission"):
+            await self._acquire(priority, deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_seconds = 0.9 * self._service_seconds + 0.1 * (time.monotonic() - started)
+            self._release()
+
+    async def _acquire(self, priority: int, deadline: float):
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        now = time.monotonic()
+
+        if now >= deadline:
+            raise self._reject("deadline", name)
+
+        if self._active < self.max_active and not self.waiting():
+            self._active += 1
+            self._admitted[name] += 1
+            wait_histogram.observe(name, 0.0)
+            return
+
+        if self.waiting() >= self.queue_size and not self._preempt(priority):
+            raise self._reject("queue_full", name)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        entry = [priority, next(self._sequence), deadline, future]
+        heapq.heappush(self._queue, entry)
+
+        timer = loop.call_later(deadline - now, self._expire, entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # the client went away, give the slot on if it was already handed over
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release()
+            raise
+        finally:
+            timer.cancel()
+
+        self._admitted[name] += 1
+        wait_histogram.observe(name, time.monotonic() - now)
+
+    def _release(self):
+        now = time.monotonic()
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            if entry[3].done():
+                continue
+            if entry[2] <= now:
+                # its timer has not fired yet, the deadline is gone all the same
+                self._expire(entry)
+                continue
+
+            # hand the slot over, the number of active requests does not change
+            entry[3].set_result(None)
+            return
+        self._active -= 1
+
+    def _expire(self, entry: list):
+        if not entry[3].done():
+            entry[3].set_exception(self._reject("deadline", PRIORITY_NAMES.get(entry[0], str(entry[0]))))
+
+    def _preempt(self, priority: int) -> bool:
+        """Reject the newest waiting request of the lowest priority below `priority`, if any."""
+        live = [entry for entry in self._queue if not entry[3].done() and entry[0] > priority]
+        if not live:
+            return False
+
+        victim = max(live, key=lambda entry: (entry[0], entry[1]))
+        victim[3].set_exception(self._reject("preempted", PRIORITY_NAMES.get(victim[0], str(victim[0]))))
+        return True
+
+    def _reject(self, reason: str, name: str) -> AdmissionRejected:
+        self._rejected[(reason, name)] += 1
+        logging.info(f"Request not admitted ({reason}, {name}): {self._active} active, {self.waiting()} waiting")
+        return AdmissionRejected(reason, self.retry_after())
+
+    def waiting(self, priority: Optional[int] = None) -> int:
+        return sum(1 for entry in self._queue if not entry[3].done() and (priority is None or entry[0] == priority))
+
+    def retry_after(self) -> float:
+        """Seconds until the queue ahead of a new request should have drained."""
+        return (self.waiting() + 1) * self._service_seconds / self.max_active
+
+    def stats(self) -> Dict:
+        return {
+            "active": self._active,
+            "max_active": self.max_active,
+            "queue_size": self.queue_size,
+            "waiting": {name: self.waiting(priority) for priority, name in PRIORITY_NAMES.items()},
+            "admitted": dict(self._admitted),
+            "rejected": {f"{reason}:{name}": count for (reason, name), count in self._rejected.items()},
+            "avg_service_seconds": self._service_seconds,
+        }
+
+
+# Initialize the controller for the inference pipeline
+admission = AdmissionController(max_active=ADMISSION_MAX_ACTIVE, queue_size=ADMISSION_QUEUE_SIZE)
+
+
+@asynccontextmanager
+async def admitted(priority: int, deadline: Optional[float] = None):
+    """Inference slot of the given priority, a no-op when ADMISSION_CONTROL is off."""
+    if not ADMISSION_CONTROL:
+        yield
+        return
+
+    async with admission.slot(priority, deadline if deadline is not None else admission.deadline(priority)):
+        yield
+
+
+def _collect_metrics() -> str:
+    stats = admission.stats()
+    return (
+        metrics.format_metric(
+            "admission_queue_depth", "gauge", "Requests waiting for an inference slot, per priority.",
+            [({"priority": name}, count) for name, count in stats["waiting"].items()]
+        )
+        + metrics.format_metric("admission_active", "gauge", "Requests holding an inference slot.", [({}, stats["active"])])
+        + metrics.format_metric("admission_capacity", "gauge", "Inference slots.", [({}, stats["max_active"])])
+        + metrics.format_metric(
+            "admission_rejected_total", "counter", "Requests not admitted, per reason and priority.",
+            [({"reason": reason, "priority": name}, count) for (reason, name), count in admission._rejected.items()]
+        )
+        + wait_histogram.render()
+    )
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,86 @@
+import os
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from server.utils import metrics
+
+# Detector backends tried in order until one finds a face, fastest first, each with an
+# optional minimum confidence, e.g. "opencv:5,retinaface". The confidence scale
+# depends on the backend (opencv reports Haar cascade weights, retinaface a 0-1
+# probability). The last backend is always accepted.
+DETECTOR_MIN_CONFIDENCE = float(os.getenv("DETECTOR_MIN_CONFIDENCE", "0"))
+
+
+def parse_cascade(value: str, default_min_confidence: float = 0.0) -> List[Tuple[str, float]]:
+    """Parse "backend[:min_confidence],..." into (backend, min_confidence) pairs."""
+    cascade = []
+    for item in value.split(","):
+        backend, _, min_confidence = item.strip().partition(":")
+        if backend:
+            cascade.append((backend, float(min_confidence) if min_confidence else default_min_confidence))
+
+    if not cascade:
+        raise ValueError(f"Invalid detector cascade: {value!r}")
+    return cascade
+
+
+DETECTOR_CASCADE = parse_cascade(os.getenv("DETECTOR_CASCADE", "opencv"), DETECTOR_MIN_CONFIDENCE)
+
+_selected: Counter = Counter()
+_runs: Counter = Counter()
+_counts_lock = threading.Lock()
+
+
+def record_detection(backend: Optional[str], cascade: List[Tuple[str, float]] = DETECTOR_CASCADE):
+    """
+    Count one detection, `backend` being the one that found the face, None when none
+    did. Every backend before it in the cascade ran too.
+
+    Counted where the request is handled, detection itself may run in another process.
+    """
+    names = [name for name, _ in cascade]
+    if backend is None:
+        ran = names
+    elif backend in names:
+        ran = names[:names.index(backend) + 1]
+    else:
+        # e.g. "skip" for a face box located by the client, no backend ran
+        ran = []
+
+    with _counts_lock:
+        _selected[backend or "none"] += 1
+        for name in ran:
+            _runs[name] += 1
+
+
+def is_no_face_error(error: Exception) -> bool:
+    """Whether `error` is the one detection.extract_faces raises when no backend found a face."""
+    return isinstance(error, ValueError) and str(error).startswith("Face could not be detected")
+
+
+def detection_counts() -> Dict[str, Dict[str, int]]:
+    """Get how often each backend ran and how often it was the one that found the face."""
+    with _counts_lock:
+        return {"runs": dict(_runs), "selected": dict(_selected)}
+
+
+def _collect_metrics() -> str:
+    counts = detection_counts()
+    return (
+        metrics.format_metric(
+            "face_detector_runs_total",
+            "counter",
+            "Detector backend runs, per backend of the cascade.",
+            [({"backend": backend}, count) for backend, count in counts["runs"].items()]
+        )
+        + metrics.format_metric(
+            "face_detector_selected_total",
+            "counter",
+            "Detections accepted from each backend of the cascade, none when no face was found.",
+            [({"backend": backend}, count) for backend, count in counts["selected"].items()]
+        )
+    )
+
+
+metrics.register_collector(_collect_metrics)
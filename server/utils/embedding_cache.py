@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from server.utils import metrics
+
+EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "true").lower() == "true"
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "256"))
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "60"))
+# "memory" keeps the cache per process, "redis" also shares it between instances
+EMBEDDING_CACHE_BACKEND = os.getenv("EMBEDDING_CACHE_BACKEND", "memory")
+
+_REDIS_PREFIX = "face-embedding:"
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache with TTL for pipeline results, keyed by a hash of the uploaded bytes.
+
+    Kiosks resubmit the exact same frame after a timeout or a double tap. Those hits
+    skip detection, anti-spoofing and the forward pass. Only the fields the routes
+    use (embedding, face_confidence, is_real) are kept.
+
+    With a Redis URL, entries are also written to Redis with the same TTL and looked up
+    there on a local miss. Redis errors are logged and count as a miss.
+    """
+
+    def __init__(self, max_size: int = 256, ttl_seconds: int = 60, redis_url: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.redis_url = redis_url
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(image_data: bytes, variant: str = "") -> str:
+        """Hash of the upload, `variant` separates results of different pipeline settings."""
+        return hashlib.blake2b(image_data, digest_size=16).hexdigest() + (f":{variant}" if variant else "")
+
+    async def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+
+        if self.redis_url:
+            value = await self._redis_get(key)
+            if value is not None:
+                self._store(key, value)
+                with self._lock:
+                    self.redis_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def set(self, key: str, embeddings: List[Dict[str, Any]]):
+        value = [
+            {
+                "embedding": [float(v) for v in face["embedding"]],
+                "face_confidence": float(face["face_confidence"]),
+                **({"is_real": bool(face["is_real"])} if "is_real" in face else {}),
+            }
+            for face in embeddings
+        ]
+        self._store(key, value)
+
+        if self.redis_url:
+            await self._redis_set(key, value)
+
+    def _store(self, key: str, value: List[Dict[str, Any]]):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _get_redis(self):
+        if self._redis is None:
+            import redis.asyncio as redis
+            self._redis = redis.from_url(self.redis_url)
+        return self._redis
+
+    async def _redis_get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        try:
+            raw = await self._get_redis().get(_REDIS_PREFIX + key)
+            return json.loads(raw) if raw else None
+        except Exception as e:
+            logging.error(f"Embedding cache Redis lookup failed: {e}")
+            return None
+
+    async def _redis_set(self, key: str, value: List[Dict[str, Any]]):
+        try:
+            await self._get_redis().set(_REDIS_PREFIX + key, json.dumps(value), ex=self.ttl_seconds)
+        except Exception as e:
+            logging.error(f"Embedding cache Redis write failed: {e}")
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.redis_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+            }
+
+
+# Initialize the cache
+embedding_cache = EmbeddingCache(
+    max_size=EMBEDDING_CACHE_SIZE,
+    ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS,
+    redis_url=os.getenv("REDIS_URL", "redis://localhost:6379") if EMBEDDING_CACHE_BACKEND == "redis" else None,
+)
+
+
+def _collect_metrics() -> str:
+    stats = embedding_cache.stats()
+    return metrics.format_metric(
+        "face_embedding_cache_lookups_total",
+        "counter",
+        "Embedding cache lookups by result.",
+        [({"result": "hit"}, stats["hits"]), ({"result": "redis_hit"}, stats["redis_hits"]), ({"result": "miss"}, stats["misses"])]
+    ) + metrics.format_metric(
+        "face_embedding_cache_hit_ratio", "gauge", "Share of lookups served from the cache.", [({}, stats["hit_rate"])]
+    )
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,247 @@
+import datetime
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient, models
+
+FACES_COLLECTION = "faces"
+# Facenet512
+FACES_VECTOR_SIZE = 512
+
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "200"))
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", "128"))
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "true").lower() == "true"
+# candidates fetched with the int8 vectors per result, then rescored with the float32 ones
+QDRANT_RESCORE_OVERSAMPLING = float(os.getenv("QDRANT_RESCORE_OVERSAMPLING", "2.0"))
+# keep the float32 originals on disk, only the int8 copies stay in RAM
+QDRANT_VECTORS_ON_DISK = os.getenv("QDRANT_VECTORS_ON_DISK", "false").lower() == "true"
+
+# payload fields searches are filtered on, with their index type
+PAYLOAD_INDEXES = {
+    "store_id": models.PayloadSchemaType.KEYWORD,
+    "department_id": models.PayloadSchemaType.KEYWORD,
+    "registered_at": models.PayloadSchemaType.DATETIME,
+    # server clock at upsert, the gallery replica refreshes on it
+    "indexed_at": models.PayloadSchemaType.DATETIME,
+}
+
+
+def normalize(vector: Sequence[float]) -> list:
+    """
+    L2-normalize an embedding. Stored and query vectors are unit length, so the dot
+    product the collection uses is their cosine similarity.
+    """
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return (array / norm if norm else array).tolist()
+
+
+def vectors_config(on_disk: bool = QDRANT_VECTORS_ON_DISK) -> models.VectorParams:
+    return models.VectorParams(size=FACES_VECTOR_SIZE, distance=models.Distance.DOT, on_disk=on_disk)
+
+
+def hnsw_config() -> models.HnswConfigDiff:
+    return models.HnswConfigDiff(m=QDRANT_HNSW_M, ef_construct=QDRANT_HNSW_EF_CONSTRUCT)
+
+
+def quantization_config() -> Optional[models.ScalarQuantization]:
+    """int8 scalar quantization, kept in RAM even when the originals are on disk."""
+    if not QDRANT_QUANTIZATION:
+        return None
+
+    return models.ScalarQuantization(
+        scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+    )
+
+
+def search_params() -> models.SearchParams:
+    """Search parameters of face lookups: HNSW ef and rescoring of the quantized candidates."""
+    quantization = None
+    if QDRANT_QUANTIZATION:
+        quantization = models.QuantizationSearchParams(rescore=True, oversampling=QDRANT_RESCORE_OVERSAMPLING)
+
+    return models.SearchParams(hnsw_ef=QDRANT_HNSW_EF, quantization=quantization)
+
+
+async def ensure_collection(client: AsyncQdrantClient, collection_name: str = FACES_COLLECTION):
+    """Create the faces collection if it does not exist, then its payload indexes."""
+    if not await client.collection_exists(collection_name):
+        logging.info(f"Creating collection {collection_name}")
+        await client.create_collection(
+            collection_name=collection_name,
+            vectors_config=vectors_config(),
+            hnsw_config=hnsw_config(),
+            quantization_config=quantization_config(),
+        )
+
+    await ensure_payload_indexes(client, collection_name)
+
+
+async def describe_collection(client: AsyncQdrantClient, collection_name: str = FACES_COLLECTION) -> Dict[str, Any]:
+    """Distance, HNSW and quantization settings of the collection, and how they differ from the target."""
+    info = await client.get_collection(collection_name)
+    params = info.config.params.vectors
+    hnsw = info.config.hnsw_config
+    quantization = info.config.quantization_config
+
+    return {
+        "points": info.points_count,
+        "distance": str(params.distance),
+        "on_disk": bool(params.on_disk),
+        "hnsw": {"m": hnsw.m, "ef_construct": hnsw.ef_construct},
+        "quantization": quantization.model_dump() if quantization else None,
+        "needs_copy": params.distance != models.Distance.DOT,
+        "needs_update": (hnsw.m, hnsw.ef_construct) != (QDRANT_HNSW_M, QDRANT_HNSW_EF_CONSTRUCT)
+        or (quantization is None) == QDRANT_QUANTIZATION,
+    }
+
+
+async def update_collection(client: AsyncQdrantClient, collection_name: str = FACES_COLLECTION):
+    """Apply the HNSW and quantization settings in place. Qdrant rebuilds the index in the background."""
+    await client.update_collection(
+        collection_name=collection_name,
+        hnsw_config=hnsw_config(),
+        quantization_config=quantization_config() or models.Disabled.DISABLED,
+    )
+
+
+async def copy_collection(
+    client: AsyncQdrantClient,
+    source: str = FACES_COLLECTION,
+    target: Optional[str] = None,
+    batch_size: int = 256,
+) -> str:
+    """
+    Copy `source` into a new collection with the target settings, normalizing every
+    vector. Needed to move from Cosine to Dot, the distance cannot be changed in place.
+    Returns the name of the new collection.
+    """
+    target = target or f"{source}_{time.strftime('%Y%m%d%H%M%S')}"
+    await client.create_collection(
+        collection_name=target,
+        vectors_config=vectors_config(),
+        hnsw_config=hnsw_config(),
+        quantization_config=quantization_config(),
+    )
+    await ensure_payload_indexes(client, target)
+
+    await _copy_points(client, source, target, batch_size)
+    return target
+
+
+async def catch_up_collection(
+    client: AsyncQdrantClient,
+    source: str,
+    target: str,
+    batch_size: int = 256,
+    overlap_seconds: int = 120,
+) -> int:
+    """
+    Copy the points upserted to `source` since the newest `indexed_at` in `target`
+    (minus an overlap for upserts in flight), e.g. faces registered while
+    copy_collection was scrolling. Returns the number of points copied.
+    """
+    newest, _ = await client.scroll(
+        collection_name=target,
+        limit=1,
+        order_by=models.OrderBy(key="indexed_at", direction=models.Direction.DESC),
+        with_payload=["indexed_at"],
+    )
+
+    scroll_filter = None
+    if newest and (newest[0].payload or {}).get("indexed_at"):
+        since = datetime.datetime.fromisoformat(newest[0].payload["indexed_at"]) - datetime.timedelta(seconds=overlap_seconds)
+        scroll_filter = models.Filter(must=[
+            models.FieldCondition(key="indexed_at", range=models.DatetimeRange(gt=since))
+        ])
+
+    return await _copy_points(client, source, target, batch_size, scroll_filter=scroll_filter)
+
+
+async def count_points(client: AsyncQdrantClient, collection_name: str) -> int:
+    return (await client.count(collection_name=collection_name, exact=True)).count
+
+
+async def _copy_points(
+    client: AsyncQdrantClient,
+    source: str,
+    target: str,
+    batch_size: int,
+    scroll_filter: Optional[models.Filter] = None,
+) -> int:
+    copied = 0
+    offset = None
+    while True:
+        records, offset = await client.scroll(
+            collection_name=source,
+            scroll_filter=scroll_filter,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+
+        if records:
+            await client.upsert(
+                collection_name=target,
+                points=[
+                    models.PointStruct(id=record.id, vector=normalize(record.vector), payload=record.payload)
+                    for record in records
+                ],
+                wait=True,
+            )
+            copied += len(records)
+            logging.info(f"Copied {copied} points to {target}")
+
+        if offset is None:
+            break
+
+    return copied
+
+
+async def swap_alias(client: AsyncQdrantClient, alias: str, target: str, delete_collection: Optional[str] = None):
+    """
+    Point `alias` at `target`. When the old collection has the alias's name it has to
+    be deleted first, pass it as `delete_collection`: searches fail until the alias
+    exists, and whatever was written to it since the last catch_up_collection is lost.
+    """
+    operations = []
+    if delete_collection:
+        await client.delete_collection(delete_collection)
+    else:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+
+    operations.append(models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=target, alias_name=alias)))
+    await client.update_collection_aliases(change_aliases_operations=operations)
+
+
+async def ensure_payload_indexes(client: AsyncQdrantClient, collection_name: str = FACES_COLLECTION):
+    """Create the payload indexes of the faces collection that do not exist yet."""
+    info = await client.get_collection(collection_name)
+    existing = info.payload_schema or {}
+
+    for field_name, field_schema in PAYLOAD_INDEXES.items():
+        if field_name in existing:
+            continue
+
+        logging.info(f"Creating payload index on {collection_name}.{field_name}")
+        await client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=field_schema,
+            wait=True,
+        )
+
+
+def store_filter(store_id: Optional[str]) -> Optional[models.Filter]:
+    """Filter restricting a search to the faces registered at one store."""
+    if not store_id:
+        return None
+
+    return models.Filter(must=[
+        models.FieldCondition(key="store_id", match=models.MatchValue(value=store_id))
+    ])
@@ -0,0 +1,158 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from server.utils import metrics
+
+INFERENCE_BATCHING = os.getenv("INFERENCE_BATCHING", "false").lower() == "true"
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+
+class ForwardBatcher:
+    """
+    Dynamic micro-batching for model forward passes.
+
+    Callers (inference pool threads) submit one preprocessed face tensor each and block
+    until their embedding is ready. A single background thread collects tensors until
+    `max_batch_size` is reached or the oldest one has waited `max_wait_ms`, runs one
+    batched forward pass and hands every caller its own row back.
+
+    Batching only happens between threads of the same process, so it pays off with the
+    thread inference pool and enough workers to have several faces in flight.
+    """
+
+    def __init__(
+        self,
+        forward_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+    ):
+        self.forward_fn = forward_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes: Dict[int, int] = {}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="forward-batcher", daemon=True)
+            self._thread.start()
+
+    def forward(self, img: np.ndarray) -> List[float]:
+        """
+        Submit one face tensor of shape (1, H, W, C) or (H, W, C) and wait for its embedding.
+        """
+        self._ensure_started()
+
+        if img.ndim == 4:
+            img = img[0]
+
+        future: Future = Future()
+        self._queue.put((img, time.perf_counter(), future))
+        return future.result()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = batch[0][1] + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+
+            try:
+                vectors = self.forward_fn(np.stack([item[0] for item in batch]))
+                if len(vectors) != len(batch):
+                    raise RuntimeError(f"Forward pass returned {len(vectors)} embeddings for a batch of {len(batch)}")
+            except Exception as e:
+                logging.error(f"Batched forward pass failed: {e}")
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, _, future), vector in zip(batch, vectors):
+                future.set_result(np.asarray(vector).tolist())
+
+            self._record(batch, started)
+
+    def _record(self, batch: list, started: float):
+        waits = [started - enqueued for _, enqueued, _ in batch]
+
+        with self._lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            self._wait_total += sum(waits)
+            self._wait_max = max(self._wait_max, max(waits))
+
+    def stats(self) -> Dict:
+        """Get batch-size and queue-wait metrics since start."""
+        with self._lock:
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "avg_queue_wait_ms": self._wait_total / self._items * 1000 if self._items else 0.0,
+                "max_queue_wait_ms": self._wait_max * 1000,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+
+def _facenet_forward(batch: np.ndarray) -> np.ndarray:
+    import face_recognition
+
+    return face_recognition.forward_batch(batch, model_name="Facenet512")
+
+
+# Initialize the batcher (the worker thread starts on first use)
+forward_batcher = ForwardBatcher(
+    forward_fn=_facenet_forward,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+)
+
+
+def _collect_metrics() -> str:
+    stats = forward_batcher.stats()
+    return (
+        metrics.format_metric("face_forward_batches_total", "counter", "Batched forward passes run.", [({}, stats["batches"])])
+        + metrics.format_metric("face_forward_batched_items_total", "counter", "Faces embedded through the batcher.", [({}, stats["items"])])
+        + metrics.format_metric("face_forward_queue_wait_max_seconds", "gauge", "Longest queue wait of a face before its batch ran.", [({}, stats["max_queue_wait_ms"] / 1000)])
+    )
+
+
+metrics.register_collector(_collect_metrics)
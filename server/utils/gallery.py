@@ -0,0 +1,430 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows, snapshots are then written without the writer lock
+    fcntl = None
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient, models
+
+GALLERY_REPLICA = os.getenv("GALLERY_REPLICA", "false").lower() == "true"
+GALLERY_SNAPSHOT_DIR = os.getenv("GALLERY_SNAPSHOT_DIR", os.getcwd() + "/.gallery")
+GALLERY_REFRESH_SECONDS = int(os.getenv("GALLERY_REFRESH_SECONDS", "60"))
+GALLERY_FULL_SYNC_SECONDS = int(os.getenv("GALLERY_FULL_SYNC_SECONDS", "3600"))
+GALLERY_MAX_STALENESS_SECONDS = int(os.getenv("GALLERY_MAX_STALENESS_SECONDS", "300"))
+# delta refreshes re-read this much before the last sync, covering upserts still in
+# flight and clock skew between the instances stamping `indexed_at`
+GALLERY_REFRESH_OVERLAP_SECONDS = int(os.getenv("GALLERY_REFRESH_OVERLAP_SECONDS", "120"))
+
+_SCROLL_PAGE_SIZE = 1000
+
+
+def indexed_at() -> str:
+    """Server-side timestamp written to a point's `indexed_at` when it is upserted."""
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+@contextmanager
+def _writer_lock(directory: str):
+    """Non-blocking exclusive lock of a directory, yields whether it was acquired."""
+    if fcntl is None:
+        yield True
+        return
+
+    with open(os.path.join(directory, ".lock"), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class FaceGallery:
+    """
+    In-process replica of the Qdrant `faces` collection for exact 1:N matching.
+
+    All embeddings live in one contiguous, L2-normalized float32 matrix, so a search is
+    a single matrix-vector product (cosine similarity, same as the collection). The
+    matrix is a view of a buffer grown by doubling, so adding faces one by one stays
+    linear overall.
+
+    The replica is loaded at startup from a memory-mapped snapshot (or a full scroll
+    when there is none), updated in place when a face is registered and refreshed
+    periodically with a scroll over points upserted since the last sync, by their
+    server-assigned `indexed_at` (not `registered_at`, which is the client's clock).
+    Deleted points are dropped on the next full sync. Callers must check `is_fresh`
+    and fall back to Qdrant when the replica has not synced recently.
+    """
+
+    def __init__(
+        self,
+        collection_name: str = "faces",
+        snapshot_dir: str = GALLERY_SNAPSHOT_DIR,
+        refresh_seconds: int = 60,
+        full_sync_seconds: int = 3600,
+        max_staleness_seconds: int = 300,
+        refresh_overlap_seconds: int = 120,
+    ):
+        self.collection_name = collection_name
+        self.snapshot_dir = snapshot_dir
+        self.refresh_seconds = refresh_seconds
+        self.full_sync_seconds = full_sync_seconds
+        self.max_staleness_seconds = max_staleness_seconds
+        self.refresh_overlap_seconds = refresh_overlap_seconds
+
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        # owned buffer `_vectors` is a view of, None while it is a snapshot memory map
+        self._buffer: Optional[np.ndarray] = None
+        self._ids: List[str] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._index: Dict[str, int] = {}
+        self._store_members: Dict[str, List[int]] = {}
+        # row arrays of _store_members, built on the first search of a store
+        self._store_rows: Dict[str, np.ndarray] = {}
+        # snapshot writes in progress, rows are then replaced in a copy of the buffer
+        self._writing_snapshot = 0
+
+        # start of the last sync with Qdrant, delta refreshes scroll `indexed_at` from
+        # here (minus the overlap). Local upserts do not move it: they say nothing about
+        # what other workers and instances wrote meanwhile.
+        self._watermark: Optional[str] = None
+        self._last_sync: Optional[float] = None
+        self._last_full_sync: Optional[float] = None
+
+    @property
+    def size(self) -> int:
+        return len(self._ids)
+
+    @property
+    def is_fresh(self) -> bool:
+        """True when the replica has synced with Qdrant within the staleness budget."""
+        return self._last_sync is not None and time.time() - self._last_sync <= self.max_staleness_seconds
+
+    async def load(self, client: AsyncQdrantClient):
+        """Load the snapshot if there is one and catch up with Qdrant, else do a full sync."""
+        if self._load_snapshot():
+            logging.info(f"Loaded face gallery snapshot with {self.size} faces")
+            await self.refresh(client)
+        else:
+            await self.full_sync(client)
+
+    async def full_sync(self, client: AsyncQdrantClient):
+        """Replace the replica with a full scroll over the collection."""
+        started = indexed_at()
+        ids, payloads, vectors = [], [], []
+
+        async for record in self._scroll(client):
+            ids.append(str(record.id))
+            payloads.append(record.payload or {})
+            vectors.append(record.vector)
+
+        matrix = _normalize(np.asarray(vectors, dtype=np.float32)) if vectors else np.empty((0, 0), dtype=np.float32)
+        self._set(matrix, ids, payloads)
+        self._watermark = started
+        self._last_sync = self._last_full_sync = time.time()
+
+        logging.info(f"Face gallery synced with {self.size} faces")
+        await self.save_snapshot()
+
+    async def refresh(self, client: AsyncQdrantClient):
+        """Pull points upserted since the last sync, re-reading the overlap window."""
+        started = indexed_at()
+        scroll_filter = None
+        if self._watermark:
+            since = datetime.datetime.fromisoformat(self._watermark) - datetime.timedelta(seconds=self.refresh_overlap_seconds)
+            scroll_filter = models.Filter(must=[
+                models.FieldCondition(key="indexed_at", range=models.DatetimeRange(gt=since))
+            ])
+
+        updated = []
+        async for record in self._scroll(client, scroll_filter=scroll_filter):
+            point_id, payload = str(record.id), record.payload or {}
+            # the overlap window re-reads points the replica already has
+            if point_id in self._index and self._payloads[self._index[point_id]] == payload:
+                continue
+
+            updated.append((point_id, record.vector, payload))
+
+        self.upsert_many(updated)
+        self._watermark = started
+        self._last_sync = time.time()
+
+        if updated:
+            logging.info(f"Face gallery refreshed, {len(updated)} new or updated faces")
+            await self.save_snapshot()
+
+    async def run_refresh(self, client: AsyncQdrantClient):
+        """Background task for periodic delta refreshes and less frequent full syncs."""
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                if self._last_full_sync is None or time.time() - self._last_full_sync >= self.full_sync_seconds:
+                    await self.full_sync(client)
+                else:
+                    await self.refresh(client)
+            except Exception as e:
+                logging.error(f"Failed to refresh face gallery: {e}")
+
+    def upsert(self, point_id: str, vector: Sequence[float], payload: Dict[str, Any]):
+        """Add or replace one face, e.g. right after it is upserted to Qdrant."""
+        self.upsert_many([(point_id, vector, payload)])
+
+    def upsert_many(self, points: Sequence[Tuple[str, Sequence[float], Dict[str, Any]]]):
+        """Add or replace faces given as (point_id, vector, payload), e.g. a bulk enrollment batch."""
+        if not points:
+            return
+
+        rows = _normalize(np.asarray([vector for _, vector, _ in points], dtype=np.float32).reshape(len(points), -1))
+        replaces = any(point_id in self._index for point_id, _, _ in points)
+        self._reserve(self.size + len(points), rows.shape[1], copy=replaces and self._writing_snapshot > 0)
+
+        for (point_id, _, payload), row in zip(points, rows):
+            i = self._index.get(point_id)
+            old_store = None
+            if i is None:
+                i = len(self._ids)
+                self._ids.append(point_id)
+                self._payloads.append(payload)
+                self._index[point_id] = i
+            else:
+                old_store = self._payloads[i].get("store_id")
+                self._payloads[i] = payload
+
+            self._buffer[i] = row
+            self._move_store(i, old_store, payload.get("store_id"))
+
+        self._vectors = self._buffer[:len(self._ids)]
+
+    def search(
+        self,
+        query: Sequence[float],
+        limit: int = 1,
+        score_threshold: Optional[float] = None,
+        with_payload: Optional[Sequence[str]] = None,
+        store_id: Optional[str] = None,
+    ) -> List[models.ScoredPoint]:
+        """
+        Exact cosine search, returns points shaped like `query_points` results.
+        With `store_id`, only faces registered at that store are searched.
+        """
+        vectors, ids, payloads = self._vectors, self._ids, self._payloads
+        if len(ids) == 0:
+            return []
+
+        rows = None
+        if store_id:
+            rows = self._store_rows.get(store_id)
+            if rows is None:
+                if not self._store_members.get(store_id):
+                    return []
+                rows = self._store_rows[store_id] = np.asarray(self._store_members[store_id])
+            vectors = vectors[rows]
+
+        scores = vectors @ _normalize(np.asarray(query, dtype=np.float32))
+
+        if limit >= len(scores):
+            top = np.argsort(-scores)
+        else:
+            top = np.argpartition(-scores, limit)[:limit]
+            top = top[np.argsort(-scores[top])]
+
+        if rows is not None:
+            scores, top = scores[top], rows[top]
+        else:
+            scores = scores[top]
+
+        points = []
+        for score, i in zip(scores, top):
+            score = float(score)
+            if score_threshold is not None and score < score_threshold:
+                break
+
+            payload = payloads[i]
+            if with_payload is not None:
+                payload = {key: payload[key] for key in with_payload if key in payload}
+
+            points.append(models.ScoredPoint(id=ids[i], version=0, score=score, payload=payload))
+
+        return points
+
+    async def save_snapshot(self):
+        """Write the replica to disk, off the event loop (see _write_snapshot)."""
+        # taken here, upserts on the loop only append past the rows of this view
+        state = (self._vectors, list(self._ids), list(self._payloads), self._watermark, self._last_sync)
+        self._writing_snapshot += 1
+        try:
+            await asyncio.to_thread(self._write_snapshot, *state)
+        finally:
+            self._writing_snapshot -= 1
+
+    def _write_snapshot(
+        self,
+        vectors: np.ndarray,
+        ids: List[str],
+        payloads: List[Dict[str, Any]],
+        watermark: Optional[str],
+        synced_at: Optional[float],
+    ):
+        """
+        Write a snapshot to a directory of its own and publish it by replacing the
+        CURRENT file, so a reader never pairs the vectors of one snapshot with the
+        metadata of another. Forked workers share the snapshot directory, the one
+        holding the writer lock writes and the others skip.
+        """
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        with _writer_lock(self.snapshot_dir) as acquired:
+            if not acquired:
+                logging.info("Face gallery snapshot is being written by another process, skipped")
+                return
+
+            directory = tempfile.mkdtemp(dir=self.snapshot_dir, prefix=".tmp-")
+            try:
+                with open(os.path.join(directory, "vectors.npy"), "wb") as f:
+                    np.save(f, vectors)
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(os.path.join(directory, "meta.json"), "w") as f:
+                    json.dump({
+                        "collection": self.collection_name,
+                        "ids": ids,
+                        "payloads": payloads,
+                        "watermark": watermark,
+                        "synced_at": datetime.datetime.fromtimestamp(synced_at or time.time(), datetime.timezone.utc).isoformat(),
+                    }, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                name = f"snapshot-{time.time_ns()}-{os.getpid()}"
+                os.rename(directory, os.path.join(self.snapshot_dir, name))
+            except BaseException:
+                shutil.rmtree(directory, ignore_errors=True)
+                raise
+
+            previous = self._current_snapshot()
+            fd, current_tmp = tempfile.mkstemp(dir=self.snapshot_dir, prefix=".tmp-")
+            with os.fdopen(fd, "w") as f:
+                f.write(name)
+            os.replace(current_tmp, os.path.join(self.snapshot_dir, "CURRENT"))
+
+            # keep the one just replaced, a reader may have opened it a moment ago
+            for entry in os.listdir(self.snapshot_dir):
+                if entry.startswith("snapshot-") and entry not in (name, previous):
+                    shutil.rmtree(os.path.join(self.snapshot_dir, entry), ignore_errors=True)
+
+    def _current_snapshot(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.snapshot_dir, "CURRENT")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _load_snapshot(self) -> bool:
+        name = self._current_snapshot()
+        if not name:
+            return False
+
+        try:
+            directory = os.path.join(self.snapshot_dir, name)
+            with open(os.path.join(directory, "meta.json")) as f:
+                meta = json.load(f)
+
+            if meta.get("collection") != self.collection_name:
+                return False
+
+            vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+            if len(vectors) != len(meta["ids"]):
+                raise ValueError("Snapshot vectors and ids do not match")
+        except Exception as e:
+            logging.error(f"Ignoring unreadable face gallery snapshot: {e}")
+            return False
+
+        self._set(vectors, meta["ids"], meta["payloads"])
+        self._watermark = meta.get("watermark")
+        # a snapshot is not a sync: the replica stays stale until the first refresh
+        return True
+
+    def _set(self, vectors: np.ndarray, ids: List[str], payloads: List[Dict[str, Any]]):
+        # used as is (it may be a memory map), the first upsert copies it into a buffer
+        self._vectors = vectors
+        self._buffer = None
+        self._ids = list(ids)
+        self._payloads = list(payloads)
+        self._index = {point_id: i for i, point_id in enumerate(ids)}
+
+        self._store_members = {}
+        self._store_rows = {}
+        for i, payload in enumerate(payloads):
+            if payload.get("store_id"):
+                self._store_members.setdefault(payload["store_id"], []).append(i)
+
+    def _reserve(self, rows: int, dimensions: int, copy: bool = False):
+        """Make the buffer hold at least `rows` rows, doubling its capacity when it grows."""
+        buffer = self._buffer
+        if buffer is not None and not copy and len(buffer) >= rows and buffer.shape[1] == dimensions:
+            return
+
+        capacity = max(rows, 2 * (len(buffer) if buffer is not None else self.size), 64)
+        grown = np.empty((capacity, dimensions), dtype=np.float32)
+        if self.size:
+            grown[:self.size] = self._vectors
+        self._buffer = grown
+        self._vectors = grown[:self.size]
+
+    def _move_store(self, row: int, old: Optional[str], new: Optional[str]):
+        if old == new:
+            return
+        if old:
+            self._store_members[old].remove(row)
+            self._store_rows.pop(old, None)
+        if new:
+            self._store_members.setdefault(new, []).append(row)
+            self._store_rows.pop(new, None)
+
+    async def _scroll(self, client: AsyncQdrantClient, scroll_filter: Optional[models.Filter] = None):
+        offset = None
+        while True:
+            records, offset = await client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=scroll_filter,
+                limit=_SCROLL_PAGE_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+
+            for record in records:
+                yield record
+
+            if offset is None:
+                break
+
+
+# Initialize the replica (loaded in server.app lifespan when GALLERY_REPLICA is on)
+face_gallery = FaceGallery(
+    collection_name="faces",
+    snapshot_dir=GALLERY_SNAPSHOT_DIR,
+    refresh_seconds=GALLERY_REFRESH_SECONDS,
+    full_sync_seconds=GALLERY_FULL_SYNC_SECONDS,
+    max_staleness_seconds=GALLERY_MAX_STALENESS_SECONDS,
+    refresh_overlap_seconds=GALLERY_REFRESH_OVERLAP_SECONDS,
+)
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import random
+
+import httpx
+
+CORE_HTTP2 = os.getenv("CORE_HTTP2", "true").lower() == "true"
+CORE_MAX_CONNECTIONS = int(os.getenv("CORE_MAX_CONNECTIONS", "50"))
+CORE_MAX_KEEPALIVE = int(os.getenv("CORE_MAX_KEEPALIVE", "20"))
+CORE_CONNECT_TIMEOUT = float(os.getenv("CORE_CONNECT_TIMEOUT", "3"))
+CORE_READ_TIMEOUT = float(os.getenv("CORE_READ_TIMEOUT", "10"))
+CORE_RETRIES = int(os.getenv("CORE_RETRIES", "2"))
+CORE_RETRY_BACKOFF = float(os.getenv("CORE_RETRY_BACKOFF", "0.2"))
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
+
+def create_core_client() -> httpx.AsyncClient:
+    """
+    Create the shared client for calls to the core service.
+    One instance lives for the whole app (see server.app lifespan) so connections,
+    TLS sessions and HTTP/2 streams are reused between requests.
+    """
+    return httpx.AsyncClient(
+        base_url=os.getenv("API_URL", ""),
+        http2=CORE_HTTP2,
+        limits=httpx.Limits(
+            max_connections=CORE_MAX_CONNECTIONS,
+            max_keepalive_connections=CORE_MAX_KEEPALIVE,
+        ),
+        timeout=httpx.Timeout(
+            CORE_READ_TIMEOUT,
+            connect=CORE_CONNECT_TIMEOUT,
+        ),
+    )
+
+
+async def request_with_retry(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    retries: int = CORE_RETRIES,
+    backoff: float = CORE_RETRY_BACKOFF,
+    **kwargs
+) -> httpx.Response:
+    """
+    Send a request, retrying with exponential backoff and jitter.
+
+    Failures before the request reached the server (connect errors, connect and
+    pool timeouts) are retried for every method. Read timeouts, dropped
+    connections and 502/503/504 responses are only retried for idempotent methods,
+    so a POST is never sent twice.
+    """
+    method = method.upper()
+    idempotent = method in IDEMPOTENT_METHODS
+    attempt = 0
+
+    while True:
+        try:
+            response = await client.request(method, url, **kwargs)
+            if not (idempotent and response.status_code in RETRY_STATUS_CODES and attempt < retries):
+                return response
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+            if attempt >= retries:
+                raise
+        except (httpx.ReadTimeout, httpx.RemoteProtocolError, httpx.ReadError):
+            if not idempotent or attempt >= retries:
+                raise
+
+        await asyncio.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.0))
+        attempt += 1
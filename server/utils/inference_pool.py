@@ -0,0 +1,103 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+
+
+def warm_up_model(image_path: str) -> None:
+    """Load the DeepFace models and run one embedding so the first request is not slow."""
+    import face_recognition
+    from deepface.modules import modeling
+
+    from server.utils.detector_cascade import DETECTOR_CASCADE
+
+    face_recognition.embedding(
+        image_path,
+        expand_percentage=3,
+        model_name="Facenet512",
+        align=True,
+        normalization="base",
+        anti_spoofing=True,
+        detector_cascade=DETECTOR_CASCADE,
+    )
+
+    # the sample face is found by the first backend, load the fallbacks too
+    for backend, _ in DETECTOR_CASCADE[1:]:
+        modeling.build_model(task="face_detector", model_name=backend)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class InferencePool:
+    """
+    Runs the CPU-bound face pipeline off the asyncio event loop.
+
+    Two modes are supported:
+    - "thread": a thread pool in this process. The models are loaded once and shared,
+      OpenCV/TF/PyTorch release the GIL for most of the heavy work.
+    - "process": a spawned process pool. Every worker loads and warms its own copy of
+      the models in its initializer, so requests never pay the model load.
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: int = 2):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown inference executor: {kind}")
+
+        self.kind = kind
+        self.max_workers = max_workers
+        self._executor: Optional[Executor] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._executor is not None
+
+    async def start(self, warmup_image: str):
+        """Create the executor and make sure every worker has a warm model."""
+        if self._executor:
+            return
+
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_up_model,
+                initargs=(warmup_image,),
+            )
+            # Workers are started lazily, so submit one task per worker to force the
+            # initializer (and the model load) to run now rather than on a request.
+            pids = await asyncio.gather(*[self.run(_ping) for _ in range(self.max_workers)])
+            logging.info(f"Inference process pool ready, workers: {sorted(set(pids))}")
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="inference",
+            )
+            await self.run(warm_up_model, warmup_image)
+            logging.info(f"Inference thread pool ready, workers: {self.max_workers}")
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `fn` in the pool and await its result without blocking the event loop."""
+        if not self._executor:
+            raise RuntimeError("Inference pool is not started.")
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        if not self._executor:
+            return
+
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+
+
+# Initialize the pool (started in server.app lifespan)
+inference_pool = InferencePool(kind=INFERENCE_EXECUTOR, max_workers=INFERENCE_WORKERS)
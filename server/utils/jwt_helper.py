@@ -1,5 +1,6 @@
 import jwt
 import datetime
+import logging
 
 from typing import Dict, Optional
 from jwt import InvalidAudienceError, InvalidIssuerError, InvalidSignatureError, ExpiredSignatureError, InvalidTokenError
@@ -7,10 +8,10 @@ from .rsa_keys import rsa_manager
 
 def create_signed_jwt(payload: Dict, expires_in_minutes: int = 5) -> str:
     """
-    Create a short-lived JWT signed by the current RSA private key.
+    Create a short-lived JWT signed by the current private key.
     This JWT is used for secure communication with Main Backend.
     """
-    private_pem = rsa_manager.get_private_pem()
+    kid, private_key = rsa_manager.get_signing_key()
 
     now = datetime.datetime.now(datetime.timezone.utc)
     payload = {
@@ -22,16 +23,16 @@ def create_signed_jwt(payload: Dict, expires_in_minutes: int = 5) -> str:
     }
     return jwt.encode(
         payload,
-        private_pem,
-        algorithm="RS256",
-        headers={"kid": rsa_manager.get_current_kid()}
+        private_key,
+        algorithm=rsa_manager.algorithm,
+        headers={"kid": kid}
 	)
 
 
 def verify_signed_jwt(token: str) -> Optional[Dict]:
     """
-    Verify a JWT using the current or previous RSA public key.
-    Tries current key first, then falls back to previous key.
+    Verify a JWT using the current or previous public key.
+    Tries the key matching the token's kid first, then the others.
 
     Args:
         token: JWT token string to verify
@@ -47,21 +48,18 @@ def verify_signed_jwt(token: str) -> Optional[Dict]:
         return None
 
     # Build list of keys to try (current first, then previous)
-    keys_to_try = [(rsa_manager.get_public_pem(), rsa_manager.get_current_kid())]
-
-    if (prev_pem := rsa_manager.get_previous_public_pem()) and (prev_kid := rsa_manager.get_previous_kid()):
-        keys_to_try.append((prev_pem, prev_kid))
+    keys_to_try = list(rsa_manager.get_verification_keys().items())
 
     # Try to verify with matching kid first
     if token_kid:
-        keys_to_try.sort(key=lambda x: x[1] != token_kid)
+        keys_to_try.sort(key=lambda x: x[0] != token_kid)
 
-    for public_pem, key_kid in keys_to_try:
+    for key_kid, public_key in keys_to_try:
         try:
             decoded = jwt.decode(
                 token,
-                public_pem,
-                algorithms=["RS256"],
+                public_key,
+                algorithms=[rsa_manager.algorithm],
                 audience="core-service",
                 issuer="face-service",
                 options={
@@ -76,7 +74,7 @@ def verify_signed_jwt(token: str) -> Optional[Dict]:
 
         except ExpiredSignatureError:
             # Token expired, don't try other keys
-            print("[JWT] Token expired")
+            logging.info("[JWT] Token expired")
             return None
 
         except (InvalidSignatureError, InvalidAudienceError, InvalidIssuerError):
@@ -85,8 +83,8 @@ def verify_signed_jwt(token: str) -> Optional[Dict]:
 
         except InvalidTokenError as e:
             # Malformed token, don't try other keys
-            print(f"[JWT] Invalid token: {str(e)}")
+            logging.warning(f"[JWT] Invalid token: {str(e)}")
             return None
 
-    print("[JWT] Token verification failed with all available keys")
+    logging.warning("[JWT] Token verification failed with all available keys")
     return None
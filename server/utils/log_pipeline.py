@@ -0,0 +1,213 @@
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional, Tuple
+
+from server.utils import metrics
+
+LOG_DIR = os.getenv("LOG_DIR", os.getcwd() + "/logs")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# "json" writes one JSON object per line, "text" the previous human readable format
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# the same error is written at most once per window, with the number suppressed
+LOG_ERROR_SAMPLE_SECONDS = float(os.getenv("LOG_ERROR_SAMPLE_SECONDS", "10"))
+LOG_STDOUT = os.getenv("LOG_STDOUT", "false").lower() == "true"
+
+# id of the request being handled, set by the request_id middleware in server.app
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional["NonBlockingQueueHandler"] = None
+_dropped = 0
+
+
+class ContextFilter(logging.Filter):
+    """
+    Attach the request ID and the stage timings so far to each record.
+
+    Runs in the thread that logs, where the request's context variables are visible,
+    before the record is handed to the writer thread.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.stage_timings = metrics.current_timings()
+        return True
+
+
+class ErrorSampler(logging.Filter):
+    """
+    Let through the first occurrence of an error per `window_seconds` and drop the
+    repeats, e.g. the same Qdrant or core-service failure on every request of an
+    outage. The next record let through carries the number dropped.
+    """
+
+    def __init__(self, window_seconds: float):
+        super().__init__()
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        # (logger, message template) -> (window start, suppressed count)
+        self._seen: Dict[Tuple[str, str], Tuple[float, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.ERROR or self.window_seconds <= 0:
+            return True
+
+        key = (record.name, str(record.msg)[:200])
+        now = time.monotonic()
+
+        with self._lock:
+            started, suppressed = self._seen.get(key, (0.0, 0))
+            if now - started < self.window_seconds:
+                self._seen[key] = (started, suppressed + 1)
+                return False
+
+            self._seen[key] = (now, 0)
+            if len(self._seen) > 1000:
+                cutoff = now - self.window_seconds
+                self._seen = {k: v for k, v in self._seen.items() if v[0] >= cutoff}
+
+        record.suppressed = suppressed
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+
+        stage_timings = getattr(record, "stage_timings", None)
+        if stage_timings:
+            entry["stage_timings_ms"] = {name: round(ms, 2) for name, ms in stage_timings.items()}
+
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # already rendered on the logging thread, see NonBlockingQueueHandler.prepare
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler on a bounded queue that drops records when it is full instead of blocking."""
+
+    def enqueue(self, record: logging.LogRecord):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message and exception text here, where the arguments are still
+        # valid, but keep the extra fields so the writer can still format JSON.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _file_handlers(log_dir: str, file_name: str) -> List[logging.Handler]:
+    if LOG_FORMAT == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    os.makedirs(log_dir, exist_ok=True)
+    handlers: List[logging.Handler] = [RotatingFileHandler(
+        os.path.join(log_dir, file_name),
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUP_COUNT,
+        encoding="utf-8",
+    )]
+    if LOG_STDOUT:
+        handlers.append(logging.StreamHandler())
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def _start_listener(handlers: List[logging.Handler]):
+    global _listener
+    _queue_handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def setup_logging(log_dir: str = LOG_DIR, level: str = LOG_LEVEL):
+    """
+    Route all logging through a bounded queue to a background writer thread.
+
+    Callers only format the record and put it on the queue, the file writes and the
+    size-based rotation happen on the writer thread, so a slow disk never stalls the
+    event loop. Safe to call more than once.
+    """
+    global _queue_handler
+    if _listener is not None:
+        return
+
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(ErrorSampler(LOG_ERROR_SAMPLE_SECONDS))
+    _queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _start_listener(_file_handlers(log_dir, "app.log"))
+    atexit.register(stop_logging)
+
+
+def restart_after_fork(file_name: str, log_dir: str = LOG_DIR):
+    """
+    Start a writer thread in a forked child (threads do not survive a fork), writing
+    to its own file: processes rotating one shared file would lose records.
+    """
+    if _queue_handler is None:
+        return
+    _start_listener(_file_handlers(log_dir, file_name))
+
+
+def stop_logging():
+    """Flush the queue and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _collect_metrics() -> str:
+    return metrics.format_metric(
+        "log_records_dropped_total", "counter", "Log records dropped because the log queue was full.", [({}, _dropped)]
+    )
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,161 @@
+import bisect
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# fraction of requests whose stages are timed, the rest skip all instrumentation
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1.0"))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# stage name -> milliseconds, for the request being handled (None when not sampled)
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def format_metric(name: str, metric_type: str, help_text: str, samples: Iterable[Tuple[Dict[str, str], float]]) -> str:
+    """Render one metric family in the Prometheus text exposition format."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class Histogram:
+    """Minimal thread-safe Prometheus histogram with one label."""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label value -> (per-bucket counts, sum, count)
+        self._series: Dict[str, List[Any]] = {}
+
+    def observe(self, label_value: str, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.setdefault(label_value, [[0] * len(self.buckets), 0.0, 0])
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, (counts, total, count) in sorted(self._series.items()):
+                series = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{{{series},le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{series},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{series}}} {total}')
+                lines.append(f'{self.name}_count{{{series}}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+
+stage_duration = Histogram(
+    "face_stage_duration_seconds",
+    "Duration of face pipeline stages of sampled requests.",
+    label="stage",
+)
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests by route.",
+    label="route",
+)
+
+# functions returning extra metric families (already rendered) for /metrics
+_collectors: List[Callable[[], str]] = []
+
+
+def register_collector(collector: Callable[[], str]):
+    _collectors.append(collector)
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    return "".join([stage_duration.render(), request_duration.render()] + [collector() for collector in _collectors])
+
+
+def start_request() -> Optional[Dict[str, float]]:
+    """Start timing a request, returns its timings dict or None when it is not sampled."""
+    timings = {} if METRICS_SAMPLE_RATE >= 1.0 or random.random() < METRICS_SAMPLE_RATE else None
+    _request_timings.set(timings)
+    return timings
+
+
+def finish_request(route: str, timings: Optional[Dict[str, float]], seconds: float):
+    """Record the request duration and, when sampled, every stage into the histograms."""
+    request_duration.observe(route, seconds)
+
+    if timings:
+        for name, ms in timings.items():
+            stage_duration.observe(name, ms / 1000)
+
+
+def current_timings() -> Optional[Dict[str, float]]:
+    """Copy of the stage timings of the current request so far, None when it is not sampled."""
+    timings = _request_timings.get()
+    return dict(timings) if timings is not None else None
+
+
+def is_sampled() -> bool:
+    return _request_timings.get() is not None
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one stage of the current request. No-op when the request is not sampled."""
+    timings = _request_timings.get()
+    if timings is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+
+def merge(timings: Dict[str, float]):
+    """Add stage timings measured elsewhere (e.g. in an inference worker) to the current request."""
+    current = _request_timings.get()
+    if current is None:
+        return
+
+    for name, ms in timings.items():
+        current[name] = current.get(name, 0.0) + ms
+
+
+def run_timed(sampled: bool, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, Dict[str, float]]:
+    """
+    Run `fn` with its own stage timings and return them with the result.
+
+    Used for work submitted to the inference pool: context variables do not follow a
+    call into a pool thread or process, so the timings travel back with the result.
+    """
+    if not sampled:
+        return fn(*args, **kwargs), {}
+
+    timings: Dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        return fn(*args, **kwargs), timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
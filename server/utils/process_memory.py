@@ -0,0 +1,30 @@
+import os
+import resource
+from typing import Dict, Optional
+
+
+def process_memory(pid: Optional[int] = None) -> Dict[str, float]:
+    """
+    Memory of a process in MB, from /proc/<pid>/smaps_rollup.
+
+    `rss` counts pages shared copy-on-write with a parent in full for every process,
+    `pss` splits shared pages between the processes mapping them (the sum over workers
+    is the real footprint) and `private` is what the process alone holds.
+    Falls back to the peak RSS of this process where /proc is not available.
+    """
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared",
+              "Private_Clean": "private", "Private_Dirty": "private"}
+    memory = {"rss": 0.0, "pss": 0.0, "shared": 0.0, "private": 0.0}
+
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    memory[fields[name]] += int(value.split()[0]) / 1024
+    except OSError:
+        if pid is not None and pid != os.getpid():
+            raise
+        memory["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    return memory
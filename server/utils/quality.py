@@ -0,0 +1,155 @@
+import os
+import threading
+from collections import Counter
+from typing import Dict, Any, Optional
+
+import cv2
+import numpy as np
+
+from server.utils import metrics
+
+# off by default: the thresholds below reject uploads that were accepted before, turn
+# it on per deployment once they are validated against that deployment's kiosks
+QUALITY_GATE = os.getenv("QUALITY_GATE", "false").lower() == "true"
+QUALITY_MAX_SIDE = int(os.getenv("QUALITY_MAX_SIDE", "640"))
+QUALITY_MIN_BLUR_VARIANCE = float(os.getenv("QUALITY_MIN_BLUR_VARIANCE", "20"))
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "30"))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "225"))
+# minimum face side in pixels of the original image
+QUALITY_MIN_FACE_SIZE = int(os.getenv("QUALITY_MIN_FACE_SIZE", "80"))
+
+REASON_MESSAGES = {
+    "too_blurry": "Image is too blurry. Hold the camera still and try again.",
+    "too_dark": "Image is too dark. Please move to a brighter spot.",
+    "too_bright": "Image is too bright. Please avoid direct light on the camera.",
+    "no_face": "No face detected. Please ensure your face is clearly visible.",
+    "multiple_faces": "Multiple faces detected. Please ensure only one face is in the image.",
+    "face_too_small": "Face is too small. Please move closer to the camera.",
+    "invalid_face_box": "Face box is not a plausible face in the image.",
+}
+
+_cascades = threading.local()
+_rejections: Counter = Counter()
+_rejections_lock = threading.Lock()
+
+
+class ImageQualityError(ValueError):
+    """Raised when an upload fails the quality gate, before any model runs."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(reason, message)
+        self.reason = reason
+        self.message = message
+
+    def __str__(self):
+        return f"{self.reason}: {self.message}"
+
+
+def _face_cascade() -> cv2.CascadeClassifier:
+    # CascadeClassifier is not safe to share between threads, keep one per thread
+    cascade = getattr(_cascades, "face", None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        _cascades.face = cascade
+    return cascade
+
+
+def measure_quality(image_np: np.ndarray, max_side: int = QUALITY_MAX_SIDE, detect: bool = True) -> Dict[str, Any]:
+    """
+    Cheap quality metrics of an RGB image, computed on a copy bounded to `max_side`.
+    With `detect` off the face detection is skipped, e.g. when the face box is known.
+
+    Returns:
+        blur_variance (float): variance of the Laplacian, low means blurry.
+        brightness (float): mean gray level (0-255).
+        faces (list): face boxes (x, y, w, h) in original image coordinates, None
+            when `detect` is off.
+    """
+    height, width = image_np.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+
+    small = image_np
+    if scale < 1.0:
+        small = cv2.resize(image_np, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+    faces = None
+    if detect:
+        # same cascade parameters as DeepFace's opencv detector
+        faces = _face_cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=10)
+
+    return {
+        "blur_variance": float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        "brightness": float(gray.mean()),
+        "faces": None if faces is None else [tuple(int(v / scale) for v in face) for face in faces],
+    }
+
+
+def quality_reason(measured: Dict[str, Any]) -> Optional[str]:
+    """Reason an image with these metrics fails the gate, None when it passes."""
+    if measured["brightness"] < QUALITY_MIN_BRIGHTNESS:
+        return "too_dark"
+    if measured["brightness"] > QUALITY_MAX_BRIGHTNESS:
+        return "too_bright"
+    if measured["blur_variance"] < QUALITY_MIN_BLUR_VARIANCE:
+        return "too_blurry"
+    if measured["faces"] is None:
+        return None
+    if len(measured["faces"]) == 0:
+        return "no_face"
+    if len(measured["faces"]) > 1:
+        return "multiple_faces"
+    if min(measured["faces"][0][2:]) < QUALITY_MIN_FACE_SIZE:
+        return "face_too_small"
+    return None
+
+
+def check_quality(image_np: np.ndarray, detect: bool = True) -> Dict[str, Any]:
+    """
+    Reject an image early when it is blurry, badly exposed, has no face, more than one
+    face or a face too small to embed reliably. Raises ImageQualityError with the reason.
+    With `detect` off only blur and exposure are checked.
+    """
+    measured = measure_quality(image_np, detect=detect)
+
+    reason = quality_reason(measured)
+    if reason:
+        raise ImageQualityError(reason, REASON_MESSAGES[reason])
+
+    return measured
+
+
+def frame_score(measured: Dict[str, Any]) -> float:
+    """
+    Rank images passing the gate, from 0 to 1: sharpness and face size relative to
+    twice their minimum, weighted by exposure (1 at mid-gray, 0.5 at black or white).
+    Without face detection the size does not count.
+    """
+    sharpness = min(1.0, measured["blur_variance"] / (2 * QUALITY_MIN_BLUR_VARIANCE))
+    size = 1.0 if not measured["faces"] else min(1.0, min(measured["faces"][0][2:]) / (2 * QUALITY_MIN_FACE_SIZE))
+    exposure = 1.0 - 0.5 * abs(measured["brightness"] - 127.5) / 127.5
+    return sharpness * size * exposure
+
+
+def record_rejection(reason: str):
+    with _rejections_lock:
+        _rejections[reason] += 1
+
+
+def rejection_counts() -> Dict[str, int]:
+    """Get the number of uploads rejected by the quality gate, per reason."""
+    with _rejections_lock:
+        return {reason: _rejections.get(reason, 0) for reason in REASON_MESSAGES}
+
+
+def _collect_metrics() -> str:
+    return metrics.format_metric(
+        "face_quality_rejections_total",
+        "counter",
+        "Uploads rejected by the quality gate, per reason.",
+        [({"reason": reason}, count) for reason, count in rejection_counts().items()]
+    )
+
+
+metrics.register_collector(_collect_metrics)
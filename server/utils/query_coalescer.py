@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from qdrant_client import AsyncQdrantClient, models
+
+from server.utils import metrics
+from server.utils.faces_collection import FACES_COLLECTION
+
+QUERY_COALESCING = os.getenv("QUERY_COALESCING", "true").lower() == "true"
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "16"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "2"))
+
+batch_size_histogram = metrics.Histogram(
+    "qdrant_query_batch_size",
+    "Lookups sent per query_batch_points call.",
+    label="collection",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+queue_wait_histogram = metrics.Histogram(
+    "qdrant_query_queue_wait_seconds",
+    "Time a lookup waited for its batch to be sent.",
+    label="collection",
+)
+
+
+class QueryCoalescer:
+    """
+    Coalesces concurrent Qdrant lookups into `query_batch_points` calls.
+
+    Runs on the event loop: each lookup is queued with a future and the caller awaits
+    it. The queue is sent as one batch as soon as it holds `max_batch_size` lookups or
+    the oldest one has waited `max_wait_ms`, and every caller gets its own points back.
+    Batches are sent concurrently, a slow round trip does not hold the next window.
+
+    Under light traffic a lookup pays at most `max_wait_ms` extra, under load many
+    lookups share one round trip to Qdrant Cloud.
+    """
+
+    def __init__(self, collection_name: str = FACES_COLLECTION, max_batch_size: int = 16, max_wait_ms: float = 2.0):
+        self.collection_name = collection_name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._pending: List[tuple] = []
+        self._client: Optional[AsyncQdrantClient] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+        # Metrics
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+
+    async def query(self, client: AsyncQdrantClient, request: models.QueryRequest) -> List[models.ScoredPoint]:
+        """Queue one lookup and wait for its points."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        self._client = client
+        self._pending.append((request, time.perf_counter(), future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.get_running_loop().create_task(self._send(self._client, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, client: AsyncQdrantClient, batch: List[tuple]):
+        started = time.perf_counter()
+        for _, enqueued, _ in batch:
+            queue_wait_histogram.observe(self.collection_name, started - enqueued)
+        batch_size_histogram.observe(self.collection_name, len(batch))
+
+        try:
+            responses = await client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=[request for request, _, _ in batch],
+            )
+        except Exception as e:
+            logging.error(f"Batched Qdrant query failed: {e}")
+            self._errors += 1
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self._batches += 1
+        self._items += len(batch)
+
+        for (_, _, future), response in zip(batch, responses):
+            # the caller may have given up (cancelled request) while the batch was in flight
+            if not future.done():
+                future.set_result(response.points)
+
+    def stats(self) -> Dict:
+        return {
+            "batches": self._batches,
+            "items": self._items,
+            "errors": self._errors,
+            "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+# Initialize the coalescer for the faces collection
+query_coalescer = QueryCoalescer(
+    collection_name=FACES_COLLECTION,
+    max_batch_size=QUERY_BATCH_MAX_SIZE,
+    max_wait_ms=QUERY_BATCH_MAX_WAIT_MS,
+)
+
+
+async def query_faces(client: AsyncQdrantClient, request: models.QueryRequest) -> List[models.ScoredPoint]:
+    """One lookup in the faces collection, coalesced with concurrent ones when QUERY_COALESCING is on."""
+    if QUERY_COALESCING:
+        return await query_coalescer.query(client, request)
+
+    response = await client.query_points(
+        collection_name=FACES_COLLECTION,
+        query=request.query,
+        query_filter=request.filter,
+        search_params=request.params,
+        limit=request.limit,
+        with_payload=request.with_payload,
+        score_threshold=request.score_threshold,
+    )
+    return response.points
+
+
+def _collect_metrics() -> str:
+    stats = query_coalescer.stats()
+    return (
+        batch_size_histogram.render()
+        + queue_wait_histogram.render()
+        + metrics.format_metric("qdrant_query_batch_errors_total", "counter", "Failed query_batch_points calls.", [({}, stats["errors"])])
+    )
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,252 @@
+import asyncio
+import itertools
+import logging
+import math
+import os
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from starlette.requests import HTTPConnection
+
+from server.utils import metrics
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# requests per period and key, e.g. "5/minute", "100/hour", "2/second"
+RATE_LIMIT = os.getenv("RATE_LIMIT", "5/minute")
+# per store, for kiosks sending no device ID: every kiosk of the branch shares it
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "60/minute")
+# ceiling per remote address on top of RATE_LIMIT, the device and store IDs are sent by
+# the client and a client changing them would otherwise get a fresh bucket each time.
+# Sized for all the kiosks of a branch behind one NAT address.
+RATE_LIMIT_IP = os.getenv("RATE_LIMIT_IP", "60/minute")
+# token buckets kept per process and limiter, the oldest are dropped beyond that
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+# "memory" limits per process, "redis" also shares the counts between processes and instances
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "redis")
+RATE_LIMIT_SYNC_SECONDS = float(os.getenv("RATE_LIMIT_SYNC_SECONDS", "1"))
+# paths never limited, entries ending with "/" match as prefixes
+RATE_LIMIT_EXEMPT = os.getenv("RATE_LIMIT_EXEMPT", "/health,/metrics,/internal/").split(",")
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_REDIS_PREFIX = "face-rate-limit:"
+
+
+def parse_limit(value: str) -> Tuple[int, int]:
+    """Parse "5/minute" into (5, 60)."""
+    count, _, period = value.partition("/")
+    if period.rstrip("s") not in _PERIODS:
+        raise ValueError(f"Invalid rate limit: {value}")
+    return int(count), _PERIODS[period.rstrip("s")]
+
+
+def client_address(connection: HTTPConnection) -> str:
+    return connection.client.host if connection.client else "unknown"
+
+
+def client_key(connection: HTTPConnection) -> str:
+    """
+    Key a request is limited by: the kiosk's X-Device-Id, else its store (X-Store-Id
+    header or storeId query parameter), else the remote address. Kiosks of a branch
+    usually share one NAT address, so the address is only a last resort.
+
+    The IDs are not authenticated, see allow_request for the ceiling per address.
+    """
+    device_id = connection.headers.get("x-device-id")
+    if device_id:
+        return f"device:{device_id}"
+
+    store_id = connection.headers.get("x-store-id") or connection.query_params.get("storeId")
+    if store_id:
+        return f"store:{store_id}"
+
+    return f"ip:{client_address(connection)}"
+
+
+class HybridRateLimiter:
+    """
+    Token buckets kept in process, synchronized with Redis in the background.
+
+    Every decision is local, so a request never waits on Redis and a Redis outage only
+    makes the limit per process until it comes back. Each bucket holds up to `limit`
+    tokens and refills at `limit / period` per second.
+
+    Every `sync_seconds`, the requests admitted since the last sync are added to a
+    fixed-window counter per key in Redis with one pipelined INCRBY per key, and each
+    bucket is capped to what is left of the limit across all processes. The limit can
+    be overshot by at most what the other processes admit within one sync interval.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        period: int,
+        redis_url: Optional[str] = None,
+        sync_seconds: float = 1.0,
+        max_buckets: int = 100000,
+    ):
+        self.limit = limit
+        self.period = period
+        self.rate = limit / period
+        self.redis_url = redis_url
+        self.sync_seconds = sync_seconds
+        self.max_buckets = max(1, max_buckets)
+
+        # key -> [tokens, last refill (monotonic)]
+        self._buckets: Dict[str, list] = {}
+        # requests admitted since the last sync, per key
+        self._pending: Counter = Counter()
+        self._redis = None
+
+        self.rejections: Counter = Counter()
+        self.sync_errors = 0
+
+    @property
+    def size(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, key: str) -> Tuple[bool, float]:
+        """Take a token for `key`. Returns whether the request is allowed and, if not, seconds until it would be."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._make_room()
+            bucket = self._buckets[key] = [float(self.limit), now]
+        else:
+            bucket[0] = min(float(self.limit), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            self._pending[key] += 1
+            return True, 0.0
+
+        self.rejections[key.partition(":")[0]] += 1
+        return False, (1.0 - bucket[0]) / self.rate
+
+    async def run_sync(self):
+        """Background task pushing local counts to Redis and pulling the global ones."""
+        while True:
+            await asyncio.sleep(self.sync_seconds)
+            try:
+                await self.sync()
+            except Exception as e:
+                self.sync_errors += 1
+                logging.error(f"Rate limiter sync failed: {e}")
+
+    async def sync(self):
+        self._evict_idle()
+        if not self.redis_url or not self._buckets:
+            return
+
+        pending, self._pending = self._pending, Counter()
+        window = int(time.time() // self.period)
+        keys = list(self._buckets)
+
+        pipeline = self._get_redis().pipeline(transaction=False)
+        for key in keys:
+            redis_key = f"{_REDIS_PREFIX}{key}:{window}"
+            # INCRBY 0 reads the count of keys other processes are using
+            pipeline.incrby(redis_key, pending.get(key, 0))
+            pipeline.expire(redis_key, self.period * 2)
+
+        try:
+            results = await pipeline.execute()
+        except Exception:
+            # keep the counts for the next attempt
+            self._pending.update(pending)
+            raise
+
+        for key, used in zip(keys, results[::2]):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(bucket[0], float(max(0, self.limit - int(used))))
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    def _evict_idle(self):
+        # a bucket idle for a whole period is full again, same as a missing one
+        cutoff = time.monotonic() - self.period
+        for key in [key for key, bucket in self._buckets.items() if bucket[1] < cutoff and key not in self._pending]:
+            del self._buckets[key]
+
+    def _make_room(self):
+        self._evict_idle()
+        # still full: drop the oldest tenth at once so the scan above stays rare, their
+        # keys start over with a full bucket
+        if len(self._buckets) >= self.max_buckets:
+            for key in list(itertools.islice(self._buckets, max(1, self.max_buckets // 10))):
+                del self._buckets[key]
+
+    def _get_redis(self):
+        if self._redis is None:
+            import redis.asyncio as redis
+            self._redis = redis.from_url(self.redis_url)
+        return self._redis
+
+
+def is_exempt(path: str) -> bool:
+    return any(path.startswith(rule) if rule.endswith("/") else path == rule for rule in RATE_LIMIT_EXEMPT if rule)
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+def allow_request(connection: HTTPConnection) -> Tuple[bool, float]:
+    """
+    Take a token from the ceiling of the remote address, then from the bucket of the
+    client key, RATE_LIMIT_STORE for a store key. Returns whether the request is
+    allowed and, if not, seconds until it would be.
+    """
+    allowed, retry_after = ip_rate_limiter.allow(f"ceiling:{client_address(connection)}")
+    if not allowed:
+        return allowed, retry_after
+
+    key = client_key(connection)
+    return (store_rate_limiter if key.startswith("store:") else rate_limiter).allow(key)
+
+
+# Initialize the limiters (sync tasks started in server.app lifespan)
+_redis_url = os.getenv("REDIS_URL", "redis://localhost:6379") if RATE_LIMIT_BACKEND == "redis" else None
+rate_limiter = HybridRateLimiter(
+    *parse_limit(RATE_LIMIT),
+    redis_url=_redis_url,
+    sync_seconds=RATE_LIMIT_SYNC_SECONDS,
+    max_buckets=RATE_LIMIT_MAX_BUCKETS,
+)
+store_rate_limiter = HybridRateLimiter(
+    *parse_limit(RATE_LIMIT_STORE),
+    redis_url=_redis_url,
+    sync_seconds=RATE_LIMIT_SYNC_SECONDS,
+    max_buckets=RATE_LIMIT_MAX_BUCKETS,
+)
+ip_rate_limiter = HybridRateLimiter(
+    *parse_limit(RATE_LIMIT_IP),
+    redis_url=_redis_url,
+    sync_seconds=RATE_LIMIT_SYNC_SECONDS,
+    max_buckets=RATE_LIMIT_MAX_BUCKETS,
+)
+limiters = (rate_limiter, store_rate_limiter, ip_rate_limiter)
+
+
+def _collect_metrics() -> str:
+    return metrics.format_metric(
+        "rate_limit_rejections_total",
+        "counter",
+        "Requests rejected by the rate limiter, by key kind.",
+        [({"key": kind}, count) for kind, count in sorted(sum((limiter.rejections for limiter in limiters), Counter()).items())]
+    ) + metrics.format_metric(
+        "rate_limit_sync_errors_total", "counter", "Failed Redis synchronizations.",
+        [({}, sum(limiter.sync_errors for limiter in limiters))]
+    ) + metrics.format_metric(
+        "rate_limit_buckets", "gauge", "Token buckets held in this process.",
+        [({}, sum(limiter.size for limiter in limiters))]
+    )
+
+
+metrics.register_collector(_collect_metrics)
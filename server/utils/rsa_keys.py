@@ -2,17 +2,36 @@
 import asyncio
 import base64
 import datetime
+import hashlib
+import json
+import logging
+import os
 import secrets
-from typing import Optional, Dict
+import tempfile
+from typing import Optional, Dict, Tuple
 from threading import Lock
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
 from cryptography.hazmat.primitives import serialization
 
+# RS256 is what the core service has always verified. ES256 and EdDSA sign much faster,
+# but the consumer must accept them before switching.
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "RS256")
+SUPPORTED_ALGORITHMS = ("RS256", "ES256", "EdDSA")
+# off when a supervisor rotates the keys for all workers (see serve.py)
+KEY_ROTATION_TASK = os.getenv("KEY_ROTATION_TASK", "true").lower() == "true"
+# file a supervisor shares rotated keys through, every process reloads it in place
+KEY_STORE_PATH = os.getenv("KEY_STORE_PATH", "")
+KEY_STORE_POLL_SECONDS = float(os.getenv("KEY_STORE_POLL_SECONDS", "2"))
+
 
 class RSAKeyManager:
-    def __init__(self, rotation_interval_minutes: int = 60, is_prod: bool = False):
+    def __init__(self, rotation_interval_minutes: int = 60, is_prod: bool = False, algorithm: str = "RS256"):
+        if algorithm not in SUPPORTED_ALGORITHMS:
+            raise ValueError(f"Unsupported JWT algorithm: {algorithm}")
+
         self.rotation_interval = datetime.timedelta(minutes=rotation_interval_minutes)
         self.is_prod = is_prod
+        self.algorithm = algorithm
         self._lock = Lock()  # Thread safety
 
         # Key storage
@@ -23,8 +42,22 @@ class RSAKeyManager:
         self._previous_public_key = None
         self._previous_kid = None
 
+        # Key the next rotation switches to, published ahead of use (see prepare_next_key)
+        self._next_private_key = None
+        self._next_kid = None
+
         self._last_rotation = None
 
+        # Ready-to-use key objects, rebuilt on every rotation so signing and
+        # verification never serialize or parse PEMs
+        self._signing_key: Optional[Tuple[str, object]] = None
+        self._verification_keys: Dict[str, object] = {}
+
+        # JWKS document, encoded once per rotation and served as-is
+        self._jwks: Optional[Dict] = None
+        self._jwks_bytes: Optional[bytes] = None
+        self._jwks_etag: Optional[str] = None
+
         # Generate initial keys
         self.generate_keys()
 
@@ -34,18 +67,118 @@ class RSAKeyManager:
             await asyncio.sleep(self.rotation_interval.total_seconds())
             self.generate_keys()
 
+    async def watch_key_store(self, path: str, interval: float = 2.0):
+        """Background task reloading the keys whenever the key store file changes."""
+        stamp = None
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                stat = os.stat(path)
+                if (stat.st_mtime_ns, stat.st_size) == stamp:
+                    continue
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                self.load_key_store(path)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logging.error(f"[RSA] Failed to reload the key store: {e}")
+
+    def save_key_store(self, path: str):
+        """Write the private keys and their IDs to `path` (mode 600), replaced atomically."""
+        with self._lock:
+            document = {
+                "algorithm": self.algorithm,
+                "last_rotation": self._last_rotation.isoformat() if self._last_rotation else None,
+                "current": {"kid": self._current_kid, "private_key": self._private_pem(self._current_private_key)},
+                "previous": {
+                    "kid": self._previous_kid,
+                    "public_key": self._public_pem(self._previous_public_key),
+                } if self._previous_public_key else None,
+                "next": {
+                    "kid": self._next_kid,
+                    "private_key": self._private_pem(self._next_private_key),
+                } if self._next_private_key else None,
+            }
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # mkstemp creates the file readable by this user only
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".keys-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(document, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def load_key_store(self, path: str) -> bool:
+        """Load the keys written by save_key_store. Returns whether they differ from the ones in use."""
+        with open(path) as f:
+            document = json.load(f)
+
+        if document["algorithm"] != self.algorithm:
+            raise ValueError(f"Key store holds {document['algorithm']} keys, {self.algorithm} configured")
+
+        current, previous, next_key = document["current"], document.get("previous"), document.get("next")
+        with self._lock:
+            if current["kid"] == self._current_kid and (next_key or {}).get("kid") == self._next_kid:
+                return False
+
+            self._current_private_key = self._load_private_pem(current["private_key"])
+            self._current_public_key = self._current_private_key.public_key()
+            self._current_kid = current["kid"]
+
+            self._previous_public_key = serialization.load_pem_public_key(previous["public_key"].encode()) if previous else None
+            self._previous_kid = previous["kid"] if previous else None
+
+            self._next_private_key = self._load_private_pem(next_key["private_key"]) if next_key else None
+            self._next_kid = next_key["kid"] if next_key else None
+
+            if document.get("last_rotation"):
+                self._last_rotation = datetime.datetime.fromisoformat(document["last_rotation"])
+
+            self._signing_key = (self._current_kid, self._current_private_key)
+            self._publish()
+
+        logging.info(f"[RSA] Keys reloaded from the key store, kid: {current['kid']}")
+        return True
+
+    @staticmethod
+    def _private_pem(private_key) -> str:
+        return private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        ).decode()
+
+    @staticmethod
+    def _public_pem(public_key) -> str:
+        return public_key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+
+    @staticmethod
+    def _load_private_pem(pem: str):
+        return serialization.load_pem_private_key(pem.encode(), password=None)
+
     def generate_keys(self):
         """Generate or load RSA keypair based on environment."""
         with self._lock:
-            if not self.is_prod:
-                print("[RSA] Generating new local development RSA keypair...")
-                private_key = rsa.generate_private_key(
-                    public_exponent=65537,
-                    key_size=2048
-                )
+            next_kid = None
+            if self._next_private_key:
+                private_key, next_kid = self._next_private_key, self._next_kid
+                self._next_private_key = None
+                self._next_kid = None
+            elif not self.is_prod:
+                logging.info(f"[RSA] Generating new local development {self.algorithm} keypair...")
+                private_key = self._generate_private_key()
             else:
                 # TODO: Load from secure key management service (AWS KMS, Azure Key Vault, etc.)
-                print("[RSA] Loading RSA keys from secure storage...")
+                logging.info("[RSA] Loading RSA keys from secure storage...")
                 raise NotImplementedError("Production RSA key loading not yet implemented.")
 
             # Store previous key for grace period
@@ -56,10 +189,49 @@ class RSAKeyManager:
             # Update current keys
             self._current_private_key = private_key
             self._current_public_key = private_key.public_key()
-            self._current_kid = self._generate_kid()
+            self._current_kid = next_kid or self._generate_kid()
             self._last_rotation = datetime.datetime.now(datetime.timezone.utc)
 
-            print(f"[RSA] Key rotated at {self._last_rotation.isoformat()}, kid: {self._current_kid}")
+            self._signing_key = (self._current_kid, self._current_private_key)
+            self._publish()
+
+            logging.info(f"[RSA] Key rotated at {self._last_rotation.isoformat()}, kid: {self._current_kid}")
+
+    def prepare_next_key(self):
+        """
+        Generate the key the next rotation switches to and publish it in the JWKS now.
+        With several processes serving the JWKS, each one then knows the new key before
+        any of them signs with it.
+        """
+        with self._lock:
+            self._next_private_key = self._generate_private_key()
+            self._next_kid = self._generate_kid()
+            self._publish()
+
+            logging.info(f"[RSA] Published next key, kid: {self._next_kid}")
+
+    def _publish(self):
+        """Rebuild the verification keys and the JWKS. Must be called with the lock held."""
+        self._verification_keys = {self._current_kid: self._current_public_key}
+        if self._previous_public_key and self._previous_kid:
+            self._verification_keys[self._previous_kid] = self._previous_public_key
+        if self._next_private_key and self._next_kid:
+            self._verification_keys[self._next_kid] = self._next_private_key.public_key()
+
+        self._build_jwks()
+
+    def _generate_private_key(self):
+        """Generate a private key for the configured algorithm."""
+        if self.algorithm == "ES256":
+            return ec.generate_private_key(ec.SECP256R1())
+
+        if self.algorithm == "EdDSA":
+            return ed25519.Ed25519PrivateKey.generate()
+
+        return rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=2048
+        )
 
     def _generate_kid(self) -> str:
         """Generate a unique key identifier."""
@@ -74,6 +246,20 @@ class RSAKeyManager:
                 raise RuntimeError("RSA private key not initialized.")
             return self._current_private_key
 
+    def get_signing_key(self) -> Tuple[str, object]:
+        """Get the current key ID and private key object together, consistent across a rotation."""
+        with self._lock:
+            if not self._signing_key:
+                raise RuntimeError("RSA private key not initialized.")
+            return self._signing_key
+
+    def get_verification_keys(self) -> Dict[str, object]:
+        """Get public key objects by key ID, current key first."""
+        with self._lock:
+            if not self._verification_keys:
+                raise RuntimeError("RSA public key not initialized.")
+            return self._verification_keys
+
     def get_private_pem(self) -> bytes:
         """Get current private key in PEM format."""
         if not self._current_private_key:
@@ -122,23 +308,72 @@ class RSAKeyManager:
         Returns current and optionally previous key.
         """
         with self._lock:
-            if not self._current_public_key:
+            if not self._jwks:
                 raise RuntimeError("RSA public key not initialized.")
+            return self._jwks
 
-            if not self._current_kid:
-                raise RuntimeError("Key ID not initialized.")
+    def get_jwks_document(self) -> Tuple[bytes, str]:
+        """
+        Get the encoded JWKS document and its strong ETag.
+        Both only change when the keys rotate.
+        """
+        with self._lock:
+            if not self._jwks_bytes or not self._jwks_etag:
+                raise RuntimeError("RSA public key not initialized.")
+            return self._jwks_bytes, self._jwks_etag
+
+    def _build_jwks(self):
+        """Build the JWKS document for the current keys. Must be called with the lock held."""
+        if not self._current_public_key:
+            raise RuntimeError("RSA public key not initialized.")
 
-            jwks = {"keys": [self._key_to_jwk(self._current_public_key, self._current_kid)]}
+        if not self._current_kid:
+            raise RuntimeError("Key ID not initialized.")
 
-            if self._previous_public_key and self._previous_kid:
-                jwks["keys"].append(
-                    self._key_to_jwk(self._previous_public_key, self._previous_kid)
-                )
+        jwks = {"keys": [self._key_to_jwk(self._current_public_key, self._current_kid)]}
+
+        if self._previous_public_key and self._previous_kid:
+            jwks["keys"].append(
+                self._key_to_jwk(self._previous_public_key, self._previous_kid)
+            )
+
+        if self._next_private_key and self._next_kid:
+            jwks["keys"].append(
+                self._key_to_jwk(self._next_private_key.public_key(), self._next_kid)
+            )
 
-            return jwks
+        self._jwks = jwks
+        self._jwks_bytes = json.dumps(jwks, separators=(",", ":")).encode()
+        self._jwks_etag = f'"{hashlib.sha256(self._jwks_bytes).hexdigest()[:32]}"'
 
     def _key_to_jwk(self, public_key, kid: str) -> dict:
-        """Convert RSA public key to JWK format."""
+        """Convert public key to JWK format."""
+        if isinstance(public_key, ec.EllipticCurvePublicKey):
+            numbers = public_key.public_numbers()
+            return {
+                "kty": "EC",
+                "alg": "ES256",
+                "use": "sig",
+                "kid": kid,
+                "crv": "P-256",
+                "x": self._b64url(numbers.x.to_bytes(32, "big")),
+                "y": self._b64url(numbers.y.to_bytes(32, "big")),
+            }
+
+        if isinstance(public_key, ed25519.Ed25519PublicKey):
+            raw = public_key.public_bytes(
+                encoding=serialization.Encoding.Raw,
+                format=serialization.PublicFormat.Raw
+            )
+            return {
+                "kty": "OKP",
+                "alg": "EdDSA",
+                "use": "sig",
+                "kid": kid,
+                "crv": "Ed25519",
+                "x": self._b64url(raw),
+            }
+
         numbers = public_key.public_numbers()
 
         # Convert to bytes with proper length
@@ -158,6 +393,10 @@ class RSAKeyManager:
             "e": e,
         }
 
+    @staticmethod
+    def _b64url(data: bytes) -> str:
+        return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
     def get_rotation_info(self) -> Dict:
         """Get information about key rotation status."""
         with self._lock:
@@ -170,9 +409,11 @@ class RSAKeyManager:
                 "next_rotation": next_rotation.isoformat() if next_rotation else None,
                 "current_kid": self._current_kid,
                 "previous_kid": self._previous_kid,
+                "next_kid": self._next_kid,
+                "algorithm": self.algorithm,
                 "rotation_interval_minutes": self.rotation_interval.total_seconds() / 60
             }
 
 
 # Initialize the manager
-rsa_manager = RSAKeyManager(rotation_interval_minutes=15, is_prod=False)
\ No newline at end of file
+rsa_manager = RSAKeyManager(rotation_interval_minutes=15, is_prod=False, algorithm=JWT_ALGORITHM)
\ No newline at end of file
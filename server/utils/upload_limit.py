@@ -0,0 +1,106 @@
+import json
+import os
+
+from fastapi import HTTPException, UploadFile
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# largest accepted image upload
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+# request bodies also carry the multipart framing and the other form fields
+_BODY_OVERHEAD_BYTES = 64 * 1024
+# paths whose uploads are not single images, e.g. bulk enrollment archives
+INTERNAL_UPLOAD_PREFIX = os.getenv("INTERNAL_UPLOAD_PREFIX", "/internal/")
+# largest request body accepted under INTERNAL_UPLOAD_PREFIX
+MAX_INTERNAL_UPLOAD_BYTES = int(os.getenv("MAX_INTERNAL_UPLOAD_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+TOO_LARGE_MESSAGE = "Image is too large. Please upload a smaller image."
+
+
+async def read_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytearray:
+    """
+    Read an uploaded file in chunks, failing with 413 as soon as it exceeds `max_bytes`
+    instead of after the whole file is in memory.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise HTTPException(status_code=413, detail=TOO_LARGE_MESSAGE)
+
+    buffer = bytearray()
+    while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+        if len(buffer) + len(chunk) > max_bytes:
+            raise HTTPException(status_code=413, detail=TOO_LARGE_MESSAGE)
+        buffer += chunk
+
+    return buffer
+
+
+class UploadLimitMiddleware:
+    """
+    Reject request bodies larger than the upload limit before they are parsed.
+
+    FastAPI parses (and spools) the whole multipart body before a route runs, so the
+    limit has to be enforced while the body is received: by Content-Length when the
+    client sends it, else by counting the chunks. The 413 is sent by this middleware
+    and whatever the app answers afterwards is dropped. Internal endpoints get their
+    own, larger limit.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_bytes: int = MAX_UPLOAD_BYTES + _BODY_OVERHEAD_BYTES,
+        internal_max_bytes: int = MAX_INTERNAL_UPLOAD_BYTES,
+    ):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.internal_max_bytes = internal_max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self._limit(scope["path"])
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            await _send_too_large(send)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    rejected = True
+                    await _send_too_large(send)
+                    return {"type": "http.disconnect"}
+
+            return message
+
+        async def guarded_send(message: Message):
+            if not rejected:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+
+    def _limit(self, path: str) -> int:
+        if INTERNAL_UPLOAD_PREFIX and path.startswith(INTERNAL_UPLOAD_PREFIX):
+            return self.internal_max_bytes
+        return self.max_bytes
+
+
+async def _send_too_large(send: Send):
+    body = json.dumps({"message": TOO_LARGE_MESSAGE, "success": False, "statusCode": 413, "data": None}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,223 @@
+import asyncio
+import time
+from typing import List
+
+import pytest
+
+from server.utils.admission import PRIORITY_BULK, PRIORITY_REGISTER, PRIORITY_VERIFY, AdmissionController, AdmissionRejected
+
+
+def _later(seconds: float = 5.0) -> float:
+    return time.monotonic() + seconds
+
+
+async def _hold(controller: AdmissionController, priority: int, name: str, order: List[str], release: asyncio.Event):
+    async with controller.slot(priority, _later()):
+        order.append(name)
+        await release.wait()
+
+
+async def _settle():
+    # let every task reach its next await
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    async def run():
+        controller = AdmissionController(max_active=1, queue_size=8)
+        order: List[str] = []
+        release = asyncio.Event()
+
+        holder = asyncio.create_task(_hold(controller, PRIORITY_REGISTER, "holder", order, release))
+        await _settle()
+        waiters = []
+        for priority, name in [
+            (PRIORITY_BULK, "bulk"),
+            (PRIORITY_REGISTER, "register-1"),
+            (PRIORITY_VERIFY, "verify"),
+            (PRIORITY_REGISTER, "register-2"),
+        ]:
+            waiters.append(asyncio.create_task(_hold(controller, priority, name, order, release)))
+            await _settle()
+
+        assert controller.waiting() == 4
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        return order, controller.stats()
+
+    order, stats = asyncio.run(run())
+
+    assert order == ["holder", "verify", "register-1", "register-2", "bulk"]
+    assert stats["active"] == 0
+    assert stats["admitted"] == {"register": 3, "verify": 1, "bulk": 1}
+
+
+def test_verification_takes_the_place_of_a_waiting_registration():
+    async def run():
+        controller = AdmissionController(max_active=1, queue_size=1)
+        order: List[str] = []
+        release = asyncio.Event()
+
+        holder = asyncio.create_task(_hold(controller, PRIORITY_VERIFY, "holder", order, release))
+        await _settle()
+        register = asyncio.create_task(_hold(controller, PRIORITY_REGISTER, "register", order, release))
+        await _settle()
+        verify = asyncio.create_task(_hold(controller, PRIORITY_VERIFY, "verify", order, release))
+        await _settle()
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            await register
+        release.set()
+        await asyncio.gather(holder, verify)
+        return order, rejected.value, controller.stats()
+
+    order, rejected, stats = asyncio.run(run())
+
+    assert rejected.reason == "preempted"
+    assert rejected.retry_after > 0
+    assert order == ["holder", "verify"]
+    assert stats["rejected"] == {"preempted:register": 1}
+
+
+def test_full_queue_rejects_when_nothing_waits_at_lower_priority():
+    async def run():
+        controller = AdmissionController(max_active=1, queue_size=1)
+        release = asyncio.Event()
+
+        holder = asyncio.create_task(_hold(controller, PRIORITY_VERIFY, "holder", [], release))
+        await _settle()
+        waiter = asyncio.create_task(_hold(controller, PRIORITY_VERIFY, "waiter", [], release))
+        await _settle()
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with controller.slot(PRIORITY_REGISTER, _later()):
+                pass
+
+        release.set()
+        await asyncio.gather(holder, waiter)
+        return rejected.value
+
+    assert asyncio.run(run()).reason == "queue_full"
+
+
+def test_deadline_passing_while_waiting_rejects_and_frees_the_queue():
+    async def run():
+        controller = AdmissionController(max_active=1, queue_size=8)
+        release = asyncio.Event()
+
+        holder = asyncio.create_task(_hold(controller, PRIORITY_VERIFY, "holder", [], release))
+        await _settle()
+
+        started = time.monotonic()
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with controller.slot(PRIORITY_VERIFY, _later(0.05)):
+                pass
+        waited = time.monotonic() - started
+
+        waiting = controller.waiting()
+        release.set()
+        await holder
+        return rejected.value, waited, waiting, controller.stats()
+
+    rejected, waited, waiting, stats = asyncio.run(run())
+
+    assert rejected.reason == "deadline"
+    assert 0.04 <= waited < 1.0
+    assert waiting == 0
+    assert stats["active"] == 0
+
+
+def test_past_deadline_is_rejected_without_waiting():
+    async def run():
+        controller = AdmissionController(max_active=1, queue_size=8)
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with controller.slot(PRIORITY_VERIFY, time.monotonic() - 1):
+                pass
+        return rejected.value, controller.stats()
+
+    rejected, stats = asyncio.run(run())
+
+    assert rejected.reason == "deadline"
+    assert stats["active"] == 0
+    assert stats["rejected"] == {"deadline:verify": 1}
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        controller = AdmissionController(max_active=1, queue_size=8)
+        order: List[str] = []
+        release = asyncio.Event()
+
+        holder = asyncio.create_task(_hold(controller, PRIORITY_VERIFY, "holder", order, release))
+        await _settle()
+        cancelled = asyncio.create_task(_hold(controller, PRIORITY_VERIFY, "cancelled", order, release))
+        await _settle()
+        last = asyncio.create_task(_hold(controller, PRIORITY_REGISTER, "last", order, release))
+        await _settle()
+
+        cancelled.cancel()
+        await _settle()
+        waiting = controller.waiting()
+
+        release.set()
+        await asyncio.gather(holder, last)
+        return order, waiting, controller.stats()
+
+    order, waiting, stats = asyncio.run(run())
+
+    assert waiting == 1
+    assert order == ["holder", "last"]
+    assert stats["active"] == 0
+
+
+def test_slot_handed_to_a_waiter_cancelled_before_it_resumed_is_passed_on():
+    async def run():
+        controller = AdmissionController(max_active=1, queue_size=8)
+        release = asyncio.Event()
+
+        holder = asyncio.create_task(_hold(controller, PRIORITY_VERIFY, "holder", [], release))
+        await _settle()
+        waiter = asyncio.create_task(_hold(controller, PRIORITY_VERIFY, "waiter", [], release))
+        await _settle()
+
+        release.set()
+        # the holder leaves its slot and hands it to the waiter, which has not resumed yet
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(holder, waiter, return_exceptions=True)
+
+        active = controller.stats()["active"]
+        # the slot is free again: the next request is admitted right away
+        async with controller.slot(PRIORITY_VERIFY, _later(0.01)):
+            pass
+        return active, waiter.cancelled()
+
+    active, cancelled = asyncio.run(run())
+
+    assert cancelled
+    assert active == 0
+
+
+def test_retry_after_grows_with_the_queue():
+    async def run():
+        controller = AdmissionController(max_active=2, queue_size=8)
+        idle = controller.retry_after()
+
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(_hold(controller, PRIORITY_VERIFY, str(i), [], release)) for i in range(5)]
+        await _settle()
+        busy = controller.retry_after()
+
+        release.set()
+        await asyncio.gather(*tasks)
+        return idle, busy, controller.stats()
+
+    idle, busy, stats = asyncio.run(run())
+
+    # one second per request until measured, two slots
+    assert idle == pytest.approx(0.5)
+    # three waiting ahead of the next one
+    assert busy == pytest.approx(2.0)
+    # the quick slots above pulled the moving average down
+    assert stats["avg_service_seconds"] < 1.0
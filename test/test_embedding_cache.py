@@ -0,0 +1,121 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from server.utils import embedding_cache as caching
+from server.utils.embedding_cache import EmbeddingCache
+
+FACES = [{"embedding": [0.5, 0.25], "face_confidence": 0.98, "is_real": True, "facial_area": {"x": 1}}]
+CACHED = [{"embedding": [0.5, 0.25], "face_confidence": 0.98, "is_real": True}]
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(caching, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+class _FakeRedis:
+    """Shared store standing in for Redis, `fail` makes every call raise."""
+
+    def __init__(self, fail: bool = False):
+        self.values = {}
+        self.expiries = {}
+        self.fail = fail
+
+    async def get(self, key):
+        if self.fail:
+            raise ConnectionError("redis down")
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.values[key] = value.encode()
+        self.expiries[key] = ex
+
+
+def _cache(redis: _FakeRedis = None, **kwargs) -> EmbeddingCache:
+    cache = EmbeddingCache(redis_url="redis://fake" if redis else None, **kwargs)
+    cache._redis = redis
+    return cache
+
+
+def test_hit_keeps_only_the_fields_the_routes_use(clock):
+    cache = _cache()
+
+    async def run():
+        await cache.set("a", FACES)
+        return await cache.get("a"), await cache.get("b")
+
+    assert asyncio.run(run()) == (CACHED, None)
+    assert cache.stats() == {"size": 1, "hits": 1, "redis_hits": 0, "misses": 1, "hit_rate": 0.5}
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = _cache(ttl_seconds=60)
+    asyncio.run(cache.set("a", FACES))
+
+    clock.now += 59
+    assert asyncio.run(cache.get("a")) == CACHED
+
+    clock.now += 2
+    assert asyncio.run(cache.get("a")) is None
+    # the expired entry was dropped
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = _cache(max_size=2)
+
+    async def run():
+        await cache.set("a", FACES)
+        await cache.set("b", FACES)
+        # a is now more recent than b
+        await cache.get("a")
+        await cache.set("c", FACES)
+        return [await cache.get(key) is not None for key in ("a", "b", "c")]
+
+    assert asyncio.run(run()) == [True, False, True]
+    assert cache.stats()["size"] == 2
+
+
+def test_local_miss_falls_back_to_redis(clock):
+    redis = _FakeRedis()
+    writer, reader = _cache(redis, ttl_seconds=30), _cache(redis, ttl_seconds=30)
+
+    async def run():
+        await writer.set("a", FACES)
+        # another instance, nothing cached locally yet
+        first = await reader.get("a")
+        second = await reader.get("a")
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first == second == CACHED
+    assert redis.expiries == {"face-embedding:a": 30}
+    # the Redis hit was kept locally for the next lookup
+    assert reader.stats()["redis_hits"] == 1 and reader.stats()["hits"] == 1
+
+
+def test_redis_errors_count_as_a_miss(clock):
+    cache = _cache(_FakeRedis(fail=True))
+
+    async def run():
+        # the write still lands in the local cache
+        await cache.set("a", FACES)
+        return await cache.get("a"), await cache.get("b")
+
+    assert asyncio.run(run()) == (CACHED, None)
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient
+
+from server import enrollment
+from server.enrollment import BulkEnroller, BulkEnrollJobs, Checkpoint, ImageSource
+from server.utils import query_coalescer
+from server.utils.faces_collection import FACES_COLLECTION, FACES_VECTOR_SIZE, ensure_collection
+
+
+class _FakePool:
+    """Embeds an image into a random vector seeded by its content, one face each."""
+
+    def __init__(self):
+        self.embedded: List[bytes] = []
+
+    async def run(self, func, image_data: bytes):
+        self.embedded.append(image_data)
+        vector = np.random.default_rng(int(image_data)).normal(size=FACES_VECTOR_SIZE).tolist()
+        return [{"embedding": vector, "is_real": True}]
+
+
+def _rows(count: int) -> List[Dict[str, str]]:
+    return [
+        {"image": f"{i}.jpg", "email": f"employee-{i}@example.com", "firstName": "First", "lastName": f"Last {i}",
+         "position": "Cashier", "departmentId": "d1", "storeId": "s1"}
+        for i in range(count)
+    ]
+
+
+def _source(tmp_path, images: Dict[str, str]) -> ImageSource:
+    directory = tmp_path / "images"
+    directory.mkdir(exist_ok=True)
+    for name, content in images.items():
+        (directory / name).write_text(content)
+    return ImageSource(str(directory))
+
+
+def _registrations(monkeypatch) -> List[str]:
+    registered = []
+
+    async def register_with_core(http_client, request):
+        registered.append(request.email)
+        return {"user": {"id": f"user-{request.email}", "email": request.email}}
+
+    monkeypatch.setattr(enrollment, "register_with_core", register_with_core)
+    monkeypatch.setattr(query_coalescer, "QUERY_COALESCING", False)
+    return registered
+
+
+async def _points(client: AsyncQdrantClient) -> Dict[str, str]:
+    points, _ = await client.scroll(collection_name=FACES_COLLECTION, limit=100, with_payload=True)
+    return {point.payload["email"]: point.payload["user_id"] for point in points}
+
+
+def test_resumed_run_skips_enrolled_rows_and_reuses_registrations(tmp_path, monkeypatch):
+    registered = _registrations(monkeypatch)
+    rows = _rows(6)
+    source = _source(tmp_path, {row["image"]: str(i) for i, row in enumerate(rows)})
+    path = str(tmp_path / "checkpoint.jsonl")
+
+    # an earlier run stored rows 0 and 1 and registered row 2 before it stopped
+    Checkpoint(path).record([
+        {"image": "0.jpg", "status": "enrolled", "user_id": "user-0"},
+        {"image": "1.jpg", "status": "enrolled", "user_id": "user-1"},
+        {"image": "2.jpg", "status": "registered", "user_id": "user-2", "email": "employee-2@example.com"},
+    ])
+
+    async def run():
+        client = AsyncQdrantClient(":memory:")
+        try:
+            await ensure_collection(client)
+            pool = _FakePool()
+            progress = await BulkEnroller(client, None, pool, batch_size=2).run(rows, source, Checkpoint(path))
+
+            again = _FakePool()
+            progress_again = await BulkEnroller(client, None, again, batch_size=2).run(rows, source, Checkpoint(path))
+            return pool.embedded, progress, again.embedded, progress_again, await _points(client)
+        finally:
+            await client.close()
+
+    embedded, progress, embedded_again, progress_again, points = asyncio.run(run())
+
+    assert sorted(embedded) == [b"2", b"3", b"4", b"5"]
+    # row 2 kept the user registered before the interruption
+    assert sorted(registered) == [f"employee-{i}@example.com" for i in (3, 4, 5)]
+    assert progress == {"total": 6, "skipped": 2, "enrolled": 4, "failed": 0, "duplicates": 0}
+    assert points["employee-2@example.com"] == "user-2"
+    assert points["employee-4@example.com"] == "user-employee-4@example.com"
+
+    # everything is in the checkpoint now
+    assert embedded_again == []
+    assert progress_again["skipped"] == 6
+
+
+def test_faces_already_registered_are_rejected_or_reported(tmp_path, monkeypatch):
+    registered = _registrations(monkeypatch)
+    rows = _rows(3)
+    # row 1 is the face of row 0 again, under a new email; row 2 is row 0's email again
+    rows[2]["email"] = rows[0]["email"]
+    source = _source(tmp_path, {"0.jpg": "0", "1.jpg": "0", "2.jpg": "0"})
+
+    async def run():
+        client = AsyncQdrantClient(":memory:")
+        try:
+            await ensure_collection(client)
+            enroller = BulkEnroller(client, None, _FakePool())
+            await enroller.run(rows[:1], source, Checkpoint(str(tmp_path / "first.jsonl")))
+            checkpoint = Checkpoint(str(tmp_path / "second.jsonl"))
+            progress = await BulkEnroller(client, None, _FakePool(), concurrency=1).run(rows[1:], source, checkpoint)
+            return progress, await _points(client)
+        finally:
+            await client.close()
+
+    progress, points = asyncio.run(run())
+
+    with open(tmp_path / "second.jsonl") as f:
+        entries = {entry["image"]: entry for entry in map(json.loads, f) if entry["status"] != "registered"}
+
+    assert entries["1.jpg"]["status"] == "enrolled"
+    assert entries["1.jpg"]["duplicate_of"] == "user-employee-0@example.com"
+    assert entries["2.jpg"]["status"] == "failed"
+    assert progress["duplicates"] == 1 and progress["failed"] == 1
+    # the rejected row was not registered with the core service
+    assert registered == ["employee-0@example.com", "employee-1@example.com"]
+    assert set(points) == {"employee-0@example.com", "employee-1@example.com"}
+
+
+def test_job_state_is_read_from_disk_by_other_workers(tmp_path):
+    jobs = BulkEnrollJobs(work_dir=str(tmp_path))
+    os.makedirs(jobs.job_dir("abc"))
+    job = {"job_id": "abc", "status": "running", "progress": {"enrolled": 3}, "error": None}
+    jobs._write("abc", json.dumps(job))
+
+    # a worker that never ran the job, and nothing holds its lock
+    assert asyncio.run(BulkEnrollJobs(work_dir=str(tmp_path)).get("abc"))["status"] == "interrupted"
+
+    lock = enrollment._try_lock(os.path.join(jobs.job_dir("abc"), ".lock"))
+    try:
+        assert asyncio.run(BulkEnrollJobs(work_dir=str(tmp_path)).get("abc")) == job
+    finally:
+        lock.close()
+
+    assert asyncio.run(jobs.get("missing")) is None
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import face_recognition
+
+
+def _gradient(height: int = 120, width: int = 160) -> np.ndarray:
+    ramp = np.linspace(0, 255, width, dtype=np.float32)
+    image = np.stack([np.tile(ramp, (height, 1)), np.tile(ramp[::-1], (height, 1)), np.full((height, width), 128.0)], axis=2)
+    return image.astype(np.uint8)
+
+
+def _noise(seed: int, low: int = 0, high: int = 256) -> np.ndarray:
+    return np.random.default_rng(seed).integers(low, high, size=(96, 128, 3), dtype=np.uint8)
+
+
+IMAGES = {
+    "gradient": _gradient(),
+    "noise": _noise(0),
+    "dark": _noise(1, 0, 40),
+    "bright": _noise(2, 215, 256),
+    "flat_gray": np.full((64, 64, 3), 128, dtype=np.uint8),
+    "flat_black": np.zeros((64, 64, 3), dtype=np.uint8),
+    "saturated_white": np.full((64, 64, 3), 255, dtype=np.uint8),
+    "saturated_red": np.dstack([np.full((64, 64), 255), np.zeros((64, 64)), np.zeros((64, 64))]).astype(np.uint8),
+    "odd_shape": _noise(3)[:37, :53],
+}
+
+
+@pytest.mark.parametrize("name", list(IMAGES))
+def test_fused_auto_exposure_matches_legacy(name):
+    image = IMAGES[name]
+
+    # flat images have no contrast to stretch, both versions divide by zero the same way
+    with np.errstate(divide="ignore", invalid="ignore"):
+        legacy = face_recognition._auto_exposure(image_np=image)
+        fused = face_recognition._fused_auto_exposure(image_np=image)
+
+    assert fused.shape == legacy.shape
+    assert fused.dtype == legacy.dtype
+    # the mean brightness is summed per gray level instead of per pixel, the float
+    # rounding may move a level by one
+    assert np.abs(fused.astype(np.int16) - legacy.astype(np.int16)).max() <= 1
+
+
+def test_fused_auto_exposure_does_not_modify_or_share_buffers():
+    image = IMAGES["noise"].copy()
+
+    first = face_recognition._fused_auto_exposure(image_np=image)
+    second = face_recognition._fused_auto_exposure(image_np=IMAGES["gradient"][:96, :128])
+
+    assert np.array_equal(image, IMAGES["noise"])
+    assert not np.shares_memory(first, second)
+    assert np.array_equal(first, face_recognition._fused_auto_exposure(image_np=image))
@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from server.utils.forward_batcher import ForwardBatcher
+
+
+def _faces(count: int) -> list:
+    return [np.full((1, 4, 4, 3), i, dtype=np.float32) for i in range(count)]
+
+
+def test_every_caller_gets_its_own_row():
+    # the embedding of a face is its fill value, so rows can be told apart
+    batcher = ForwardBatcher(lambda batch: batch.reshape(len(batch), -1)[:, :2], max_batch_size=4, max_wait_ms=50)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(batcher.forward, _faces(8)))
+
+    assert results == [[float(i), float(i)] for i in range(8)]
+    assert batcher.stats()["items"] == 8
+    assert batcher.stats()["avg_batch_size"] > 1
+
+
+def test_short_forward_pass_fails_every_caller():
+    # drops the last row of each batch
+    batcher = ForwardBatcher(lambda batch: batch.reshape(len(batch), -1)[:-1, :2], max_batch_size=4, max_wait_ms=50)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(batcher.forward, face) for face in _faces(4)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="returned"):
+                future.result(timeout=5)
+
+    assert batcher.stats()["batches"] == 0
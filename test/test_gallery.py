@@ -0,0 +1,110 @@
+import asyncio
+import json
+import os
+import threading
+
+import numpy as np
+
+from server.utils.gallery import FaceGallery, _writer_lock
+
+DIMENSIONS = 16
+
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(count, DIMENSIONS)).astype(np.float32)
+
+
+def _gallery(tmp_path) -> FaceGallery:
+    return FaceGallery(collection_name="faces", snapshot_dir=str(tmp_path / "gallery"))
+
+
+def test_upserts_one_by_one_match_the_vectors():
+    gallery = FaceGallery(collection_name="faces", snapshot_dir="")
+    vectors = _vectors(200)
+    for i, vector in enumerate(vectors):
+        gallery.upsert(str(i), vector, {"user_id": f"user-{i}", "store_id": f"store-{i % 3}"})
+
+    assert gallery.size == 200
+    # the buffer grew by doubling, not by one row per face
+    assert len(gallery._buffer) < 400
+    for i in (0, 63, 64, 199):
+        assert gallery.search(vectors[i], limit=1)[0].id == str(i)
+    assert gallery.search(vectors[5], limit=1, store_id="store-2")[0].id == "5"
+    assert gallery.search(vectors[5], limit=1, store_id="store-1")[0].id != "5"
+
+
+def test_upsert_many_replaces_existing_faces():
+    gallery = FaceGallery(collection_name="faces", snapshot_dir="")
+    vectors = _vectors(10)
+    gallery.upsert_many([(str(i), vectors[i], {"store_id": "a"}) for i in range(10)])
+
+    moved = _vectors(1, seed=1)[0]
+    gallery.upsert_many([("3", moved, {"store_id": "b"}), ("10", vectors[0], {"store_id": "a"})])
+
+    assert gallery.size == 11
+    assert gallery.search(moved, limit=1)[0].id == "3"
+    assert [point.id for point in gallery.search(moved, limit=5, store_id="b")] == ["3"]
+    assert "3" not in [point.id for point in gallery.search(moved, limit=20, store_id="a")]
+
+
+def test_snapshot_round_trip(tmp_path):
+    gallery = _gallery(tmp_path)
+    vectors = _vectors(50)
+    gallery.upsert_many([(str(i), vectors[i], {"user_id": f"user-{i}"}) for i in range(50)])
+    gallery._watermark = "2026-01-01T00:00:00+00:00"
+    asyncio.run(gallery.save_snapshot())
+
+    loaded = _gallery(tmp_path)
+    assert loaded._load_snapshot()
+    assert loaded.size == 50
+    assert loaded._watermark == "2026-01-01T00:00:00+00:00"
+    assert loaded.search(vectors[7], limit=1)[0].payload == {"user_id": "user-7"}
+
+    # upserting into a loaded (memory-mapped) snapshot copies it first
+    loaded.upsert("7", vectors[8], {"user_id": "user-7"})
+    assert np.array_equal(np.load(os.path.join(gallery.snapshot_dir, loaded._current_snapshot(), "vectors.npy"))[7], gallery._vectors[7])
+
+
+def test_snapshots_publish_vectors_and_meta_together(tmp_path):
+    first, second = _gallery(tmp_path), _gallery(tmp_path)
+    first.upsert_many([(f"a{i}", vector, {}) for i, vector in enumerate(_vectors(5, seed=1))])
+    second.upsert_many([(f"b{i}", vector, {}) for i, vector in enumerate(_vectors(5, seed=2))])
+
+    asyncio.run(first.save_snapshot())
+    asyncio.run(second.save_snapshot())
+    asyncio.run(first.save_snapshot())
+
+    loaded = _gallery(tmp_path)
+    assert loaded._load_snapshot()
+    assert loaded._ids == first._ids
+    assert np.allclose(loaded._vectors, first._vectors)
+    # the current snapshot and the one it replaced are kept
+    assert len([name for name in os.listdir(first.snapshot_dir) if name.startswith("snapshot-")]) == 2
+
+
+def test_snapshot_is_skipped_while_another_process_writes(tmp_path):
+    gallery = _gallery(tmp_path)
+    gallery.upsert("1", _vectors(1)[0], {})
+    os.makedirs(gallery.snapshot_dir)
+
+    holding, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with _writer_lock(gallery.snapshot_dir) as acquired:
+            assert acquired
+            holding.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    holding.wait(5)
+    try:
+        asyncio.run(gallery.save_snapshot())
+        assert gallery._current_snapshot() is None
+    finally:
+        release.set()
+        holder.join()
+
+    asyncio.run(gallery.save_snapshot())
+    with open(os.path.join(gallery.snapshot_dir, gallery._current_snapshot(), "meta.json")) as f:
+        assert json.load(f)["ids"] == ["1"]
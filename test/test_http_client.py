@@ -0,0 +1,108 @@
+import asyncio
+from typing import Callable, List
+
+import httpx
+import pytest
+
+from server.utils.http_client import request_with_retry
+
+
+def _client(handler: Callable[[httpx.Request], httpx.Response]) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://core.test")
+
+
+def _send(handler, method: str, retries: int = 2) -> httpx.Response:
+    async def send():
+        async with _client(handler) as client:
+            return await request_with_retry(client, method, "/api/resource", retries=retries, backoff=0)
+    return asyncio.run(send())
+
+
+def _failing(errors: List[Exception], calls: List[httpx.Request]):
+    """Raise the given errors in order, then answer 200."""
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if errors:
+            error = errors.pop(0)
+            error.request = request
+            raise error
+        return httpx.Response(200, json={"ok": True})
+    return handler
+
+
+def test_get_is_retried_on_unavailable_responses():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503 if len(calls) < 3 else 200)
+
+    assert _send(handler, "GET").status_code == 200
+    assert len(calls) == 3
+
+
+def test_get_returns_the_last_response_when_retries_run_out():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(502)
+
+    assert _send(handler, "GET", retries=2).status_code == 502
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("method", ["GET", "POST"])
+def test_connect_errors_are_retried_for_every_method(method):
+    calls = []
+    handler = _failing([httpx.ConnectError("refused"), httpx.ConnectTimeout("connect timeout")], calls)
+
+    assert _send(handler, method).status_code == 200
+    assert len(calls) == 3
+
+
+def test_connect_errors_raise_when_retries_run_out():
+    calls = []
+    handler = _failing([httpx.ConnectError("refused") for _ in range(5)], calls)
+
+    with pytest.raises(httpx.ConnectError):
+        _send(handler, "POST", retries=2)
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("error", [httpx.ReadTimeout("read timeout"), httpx.RemoteProtocolError("dropped")])
+def test_post_is_not_resent_once_it_reached_the_server(error):
+    calls = []
+    handler = _failing([error], calls)
+
+    with pytest.raises(type(error)):
+        _send(handler, "POST")
+    assert len(calls) == 1
+
+
+def test_post_is_not_retried_on_unavailable_responses():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    assert _send(handler, "POST").status_code == 503
+    assert len(calls) == 1
+
+
+def test_get_is_retried_on_read_timeouts():
+    calls = []
+    handler = _failing([httpx.ReadTimeout("read timeout"), httpx.ReadTimeout("read timeout")], calls)
+
+    assert _send(handler, "GET").status_code == 200
+    assert len(calls) == 3
+
+
+def test_read_timeouts_raise_when_retries_run_out():
+    calls = []
+    handler = _failing([httpx.ReadTimeout("read timeout") for _ in range(5)], calls)
+
+    with pytest.raises(httpx.ReadTimeout):
+        _send(handler, "GET", retries=1)
+    assert len(calls) == 2
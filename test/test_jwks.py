@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+import jwt
+import pytest
+
+from server import routes
+from server.utils import jwt_helper
+from server.utils.rsa_keys import RSAKeyManager
+
+PAYLOAD = {"email": "employee@example.com", "storeId": "s1"}
+
+
+def _published_key(manager: RSAKeyManager, kid: str):
+    """Key of `kid` as the core service reads it from the JWKS document."""
+    keys = json.loads(manager.get_jwks_document()[0])["keys"]
+    return jwt.PyJWK(next(key for key in keys if key["kid"] == kid)).key
+
+
+@pytest.mark.parametrize("algorithm", ["RS256", "ES256", "EdDSA"])
+def test_signed_jwt_verifies_with_the_published_key(monkeypatch, algorithm):
+    manager = RSAKeyManager(algorithm=algorithm)
+    monkeypatch.setattr(jwt_helper, "rsa_manager", manager)
+
+    token = jwt_helper.create_signed_jwt(PAYLOAD)
+    kid = jwt.get_unverified_header(token)["kid"]
+
+    assert kid == manager.get_current_kid()
+    decoded = jwt.decode(token, _published_key(manager, kid), algorithms=[algorithm], audience="core-service", issuer="face-service")
+    assert decoded["email"] == PAYLOAD["email"]
+    assert jwt_helper.verify_signed_jwt(token)["storeId"] == "s1"
+
+
+@pytest.mark.parametrize("algorithm", ["RS256", "ES256", "EdDSA"])
+def test_token_signed_before_a_rotation_still_verifies(monkeypatch, algorithm):
+    manager = RSAKeyManager(algorithm=algorithm)
+    monkeypatch.setattr(jwt_helper, "rsa_manager", manager)
+    token = jwt_helper.create_signed_jwt(PAYLOAD)
+    old_kid = manager.get_current_kid()
+
+    manager.generate_keys()
+
+    # the previous key stays published until the next rotation
+    assert jwt.decode(token, _published_key(manager, old_kid), algorithms=[algorithm], audience="core-service")["email"] == PAYLOAD["email"]
+    assert jwt_helper.verify_signed_jwt(token)["email"] == PAYLOAD["email"]
+
+
+def test_token_of_an_unknown_key_is_rejected(monkeypatch):
+    signer = RSAKeyManager(algorithm="ES256")
+    monkeypatch.setattr(jwt_helper, "rsa_manager", signer)
+    token = jwt_helper.create_signed_jwt(PAYLOAD)
+
+    monkeypatch.setattr(jwt_helper, "rsa_manager", RSAKeyManager(algorithm="ES256"))
+
+    assert jwt_helper.verify_signed_jwt(token) is None
+
+
+def test_jwks_answers_a_matching_if_none_match_with_304(monkeypatch):
+    manager = RSAKeyManager(algorithm="ES256")
+    monkeypatch.setattr(routes, "rsa_manager", manager)
+
+    first = asyncio.run(routes.get_jwks(if_none_match=None))
+    etag = first.headers["etag"]
+
+    assert first.status_code == 200
+    assert json.loads(first.body) == manager.get_public_jwk()
+    assert "max-age=" in first.headers["cache-control"]
+
+    for if_none_match in (etag, f'"stale", {etag}', "*"):
+        cached = asyncio.run(routes.get_jwks(if_none_match=if_none_match))
+        assert cached.status_code == 304
+        assert cached.body == b""
+        assert cached.headers["etag"] == etag
+
+    assert asyncio.run(routes.get_jwks(if_none_match='"stale"')).status_code == 200
+
+
+def test_jwks_etag_changes_with_a_rotation(monkeypatch):
+    manager = RSAKeyManager(algorithm="EdDSA")
+    monkeypatch.setattr(routes, "rsa_manager", manager)
+    etag = asyncio.run(routes.get_jwks(if_none_match=None)).headers["etag"]
+
+    manager.generate_keys()
+    rotated = asyncio.run(routes.get_jwks(if_none_match=etag))
+
+    assert rotated.status_code == 200
+    assert rotated.headers["etag"] != etag
+    assert [key["kid"] for key in json.loads(rotated.body)["keys"]][:2] == [manager.get_current_kid(), manager.get_previous_kid()]
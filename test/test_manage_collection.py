@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+
+import numpy as np
+import pytest
+from qdrant_client import AsyncQdrantClient, models
+
+from server.tools.manage_collection import swap
+from server.utils.faces_collection import FACES_COLLECTION, FACES_VECTOR_SIZE, copy_collection
+
+
+def _points(ids, minutes_ago: int):
+    stamp = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=minutes_ago)).isoformat()
+    rng = np.random.default_rng(ids[0])
+    return [
+        models.PointStruct(id=i, vector=rng.normal(size=FACES_VECTOR_SIZE).tolist(), payload={"user_id": str(i), "indexed_at": stamp})
+        for i in ids
+    ]
+
+
+async def _client_with_cosine_faces() -> AsyncQdrantClient:
+    client = AsyncQdrantClient(":memory:")
+    await client.create_collection(
+        collection_name=FACES_COLLECTION,
+        vectors_config=models.VectorParams(size=FACES_VECTOR_SIZE, distance=models.Distance.COSINE),
+    )
+    await client.upsert(collection_name=FACES_COLLECTION, points=_points(range(20), minutes_ago=60))
+    return client
+
+
+def test_swap_catches_up_faces_registered_during_the_copy():
+    async def run():
+        client = await _client_with_cosine_faces()
+        try:
+            target = await copy_collection(client, FACES_COLLECTION, target="faces_copy", batch_size=8)
+            # registered after the copy finished scrolling
+            await client.upsert(collection_name=FACES_COLLECTION, points=_points(range(20, 25), minutes_ago=0))
+
+            await swap(client, target, batch_size=8)
+
+            aliases = (await client.get_aliases()).aliases
+            count = (await client.count(collection_name=FACES_COLLECTION, exact=True)).count
+            return target, aliases, count
+        finally:
+            await client.close()
+
+    target, aliases, count = asyncio.run(run())
+
+    assert [(alias.alias_name, alias.collection_name) for alias in aliases] == [(FACES_COLLECTION, target)]
+    assert count == 25
+
+
+def test_swap_refuses_a_copy_that_differs():
+    async def run():
+        client = await _client_with_cosine_faces()
+        try:
+            target = await copy_collection(client, FACES_COLLECTION, target="faces_copy", batch_size=8)
+            # deleted after the copy, the catch-up only adds points
+            await client.delete(collection_name=FACES_COLLECTION, points_selector=models.PointIdsList(points=[3]))
+
+            with pytest.raises(SystemExit):
+                await swap(client, target, batch_size=8)
+
+            return await client.collection_exists(FACES_COLLECTION), (await client.get_aliases()).aliases
+        finally:
+            await client.close()
+
+    exists, aliases = asyncio.run(run())
+
+    # the live collection was left alone
+    assert exists
+    assert aliases == []
+
+
+def test_swap_needs_an_existing_copy():
+    async def run():
+        client = await _client_with_cosine_faces()
+        try:
+            with pytest.raises(SystemExit):
+                await swap(client, "faces_missing", batch_size=8)
+        finally:
+            await client.close()
+
+    asyncio.run(run())
@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+import pytest
+
+from server import pipeline
+
+
+def _jpeg(image_rgb: np.ndarray) -> bytes:
+    ok, encoded = cv2.imencode(".jpg", cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 95])
+    assert ok
+    return encoded.tobytes()
+
+
+# sharp and well exposed, but nothing the Haar cascade takes for a face
+NO_HAAR_FACE = _jpeg(np.random.default_rng(0).integers(60, 200, size=(240, 320, 3), dtype=np.uint8))
+
+
+def test_stream_frame_without_haar_face_is_rejected_with_one_detector(monkeypatch):
+    monkeypatch.setattr(pipeline, "DETECTOR_CASCADE", [("opencv", 0.0)])
+
+    scored = pipeline.score_frame(NO_HAAR_FACE)
+
+    assert scored == {"reason": "no_face", "score": None}
+
+
+def test_stream_frame_without_haar_face_reaches_the_cascade(monkeypatch):
+    monkeypatch.setattr(pipeline, "DETECTOR_CASCADE", [("opencv", 5.0), ("retinaface", 0.0)])
+
+    scored = pipeline.score_frame(NO_HAAR_FACE)
+
+    assert scored["reason"] is None
+    assert 0 < scored["score"] <= 1
+
+
+@pytest.mark.parametrize("cascade, detects", [([("opencv", 0.0)], True), ([("opencv", 5.0), ("retinaface", 0.0)], False)])
+def test_quality_gate_counts_faces_only_without_a_cascade(monkeypatch, cascade, detects):
+    monkeypatch.setattr(pipeline, "DETECTOR_CASCADE", cascade)
+
+    assert pipeline.quality_gate_detects() is detects
+
+
+@pytest.mark.parametrize("value", ['{"x": 10, "y": 20, "w": 100, "h": 120}', "10,20,100,120", " 10.4, 19.6, 100, 120 "])
+def test_parse_face_box_forms(value):
+    assert pipeline.parse_face_box(value) == {"x": 10, "y": 20, "w": 100, "h": 120}
+
+
+@pytest.mark.parametrize("value", [
+    "10,20,100",
+    "a,b,c,d",
+    '{"x": 10, "y": 20, "w": 100}',
+    '{"x": 10, "y": 20, "w": 100, "h": null}',
+    "10,20,inf,120",
+    "10,20,100,-inf",
+    "nan,20,100,120",
+    '{"x": 1e999, "y": 20, "w": 100, "h": 120}',
+])
+def test_parse_face_box_rejects_malformed_boxes(value):
+    with pytest.raises(pipeline.ImageQualityError) as rejected:
+        pipeline.parse_face_box(value)
+
+    assert rejected.value.reason == "invalid_face_box"
+
+
+def test_check_face_box_accepts_a_plausible_box():
+    box = {"x": 100, "y": 50, "w": 160, "h": 200}
+
+    assert pipeline.check_face_box(box, (480, 640, 3)) == box
+
+
+@pytest.mark.parametrize("box, reason", [
+    ({"x": -1, "y": 50, "w": 160, "h": 200}, "invalid_face_box"),
+    ({"x": 500, "y": 50, "w": 160, "h": 200}, "invalid_face_box"),
+    ({"x": 100, "y": 300, "w": 160, "h": 200}, "invalid_face_box"),
+    # wider than FACE_BOX_MAX_ASPECT
+    ({"x": 0, "y": 0, "w": 500, "h": 200}, "invalid_face_box"),
+    ({"x": 0, "y": 0, "w": 200, "h": 450}, "invalid_face_box"),
+    ({"x": 0, "y": 0, "w": 40, "h": 50}, "face_too_small"),
+])
+def test_check_face_box_rejects_implausible_boxes(box, reason):
+    with pytest.raises(pipeline.ImageQualityError) as rejected:
+        pipeline.check_face_box(box, (480, 640, 3))
+
+    assert rejected.value.reason == reason
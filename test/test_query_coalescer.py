@@ -0,0 +1,113 @@
+import asyncio
+from typing import List
+
+from qdrant_client import AsyncQdrantClient, models
+
+from server.utils.query_coalescer import QueryCoalescer
+
+COLLECTION = "faces"
+DIMENSIONS = 8
+
+
+def _vector(index: int) -> List[float]:
+    return [1.0 if i == index else 0.0 for i in range(DIMENSIONS)]
+
+
+async def _client() -> AsyncQdrantClient:
+    client = AsyncQdrantClient(":memory:")
+    await client.create_collection(
+        collection_name=COLLECTION,
+        vectors_config=models.VectorParams(size=DIMENSIONS, distance=models.Distance.COSINE),
+    )
+    await client.upsert(
+        collection_name=COLLECTION,
+        points=[models.PointStruct(id=i, vector=_vector(i), payload={"index": i}) for i in range(DIMENSIONS)],
+    )
+    return client
+
+
+def _request(index: int) -> models.QueryRequest:
+    return models.QueryRequest(query=_vector(index), limit=1, with_payload=True)
+
+
+def test_concurrent_lookups_are_batched_and_answered_separately():
+    coalescer = QueryCoalescer(collection_name=COLLECTION, max_batch_size=3, max_wait_ms=50)
+
+    async def lookups():
+        client = await _client()
+        try:
+            # each caller looks up a different point, in reverse order of the ids
+            return await asyncio.gather(*(coalescer.query(client, _request(i)) for i in reversed(range(DIMENSIONS))))
+        finally:
+            await client.close()
+
+    results = asyncio.run(lookups())
+
+    for i, points in zip(reversed(range(DIMENSIONS)), results):
+        assert [point.id for point in points] == [i]
+        assert points[0].payload == {"index": i}
+
+    stats = coalescer.stats()
+    # 8 lookups: two full batches of 3, the last 2 sent when the wait runs out
+    assert stats["batches"] == 3
+    assert stats["items"] == DIMENSIONS
+    assert stats["avg_batch_size"] > 1
+    assert stats["errors"] == 0
+
+
+def test_single_lookup_is_sent_after_the_wait():
+    coalescer = QueryCoalescer(collection_name=COLLECTION, max_batch_size=16, max_wait_ms=1)
+
+    async def lookup():
+        client = await _client()
+        try:
+            return await coalescer.query(client, _request(5))
+        finally:
+            await client.close()
+
+    assert [point.id for point in asyncio.run(lookup())] == [5]
+    assert coalescer.stats()["batches"] == 1
+
+
+def test_failed_batch_reaches_every_waiter():
+    coalescer = QueryCoalescer(collection_name="missing", max_batch_size=16, max_wait_ms=5)
+
+    async def lookups():
+        client = await _client()
+        try:
+            return await asyncio.gather(
+                *(coalescer.query(client, _request(i)) for i in range(4)), return_exceptions=True
+            )
+        finally:
+            await client.close()
+
+    results = asyncio.run(lookups())
+
+    assert len(results) == 4
+    assert all(isinstance(result, Exception) for result in results)
+    # one batch failed, every caller got that same error
+    assert len({id(result) for result in results}) == 1
+    stats = coalescer.stats()
+    assert stats["errors"] == 1
+    assert stats["batches"] == 0
+
+
+def test_cancelled_caller_does_not_affect_the_rest_of_its_batch():
+    coalescer = QueryCoalescer(collection_name=COLLECTION, max_batch_size=16, max_wait_ms=20)
+
+    async def lookups():
+        client = await _client()
+        try:
+            tasks = [asyncio.ensure_future(coalescer.query(client, _request(i))) for i in range(3)]
+            await asyncio.sleep(0)
+            tasks[1].cancel()
+            return await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            await client.close()
+
+    first, cancelled, last = asyncio.run(lookups())
+
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert [point.id for point in first] == [0]
+    assert [point.id for point in last] == [2]
+
@@ -0,0 +1,162 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from server.utils import rate_limiter as rate_limiting
+from server.utils.rate_limiter import HybridRateLimiter, parse_limit
+
+
+def _connection(host: str = "10.0.0.1", device_id: str = None, store_id: str = None):
+    headers = {}
+    if device_id:
+        headers["x-device-id"] = device_id
+    if store_id:
+        headers["x-store-id"] = store_id
+    return SimpleNamespace(headers=headers, query_params={}, client=SimpleNamespace(host=host))
+
+
+def _age(limiter: HybridRateLimiter, key: str, seconds: float):
+    """Move the last refill of a bucket back in time."""
+    limiter._buckets[key][1] -= seconds
+
+
+class _FakeRedis:
+    """Answers INCRBY with the count other processes already used plus the increment."""
+
+    def __init__(self, used_elsewhere: int, fail: bool = False):
+        self.used_elsewhere = used_elsewhere
+        self.fail = fail
+        self.increments = []
+
+    def pipeline(self, transaction: bool = True):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, redis: _FakeRedis):
+        self.redis = redis
+        self.results = []
+
+    def incrby(self, key, amount):
+        self.redis.increments.append((key, amount))
+        self.results += [self.redis.used_elsewhere + amount, True]
+
+    def expire(self, key, seconds):
+        pass
+
+    async def execute(self):
+        if self.redis.fail:
+            raise ConnectionError("redis down")
+        return self.results
+
+
+def test_parse_limit():
+    assert parse_limit("5/minute") == (5, 60)
+    assert parse_limit("100/hours") == (100, 3600)
+    with pytest.raises(ValueError):
+        parse_limit("5/fortnight")
+
+
+def test_bucket_refills_over_time():
+    limiter = HybridRateLimiter(2, 1)
+
+    assert limiter.allow("device:a") == (True, 0.0)
+    assert limiter.allow("device:a") == (True, 0.0)
+    allowed, retry_after = limiter.allow("device:a")
+    assert not allowed
+    assert 0 < retry_after <= 0.5
+
+    _age(limiter, "device:a", 0.5)
+    assert limiter.allow("device:a")[0]
+    assert not limiter.allow("device:a")[0]
+    assert limiter.rejections == {"device": 2}
+
+
+def test_buckets_are_per_key():
+    limiter = HybridRateLimiter(1, 60)
+
+    assert limiter.allow("device:a")[0]
+    assert not limiter.allow("device:a")[0]
+    assert limiter.allow("device:b")[0]
+
+
+def test_changing_device_id_does_not_escape_the_address_ceiling(monkeypatch):
+    monkeypatch.setattr(rate_limiting, "rate_limiter", HybridRateLimiter(5, 60))
+    monkeypatch.setattr(rate_limiting, "store_rate_limiter", HybridRateLimiter(60, 60))
+    monkeypatch.setattr(rate_limiting, "ip_rate_limiter", HybridRateLimiter(10, 60))
+
+    results = [rate_limiting.allow_request(_connection(device_id=f"kiosk-{i}"))[0] for i in range(15)]
+
+    assert results == [True] * 10 + [False] * 5
+    # the rejected requests never got a bucket of their own
+    assert rate_limiting.rate_limiter.size == 10
+    # another address is not affected
+    assert rate_limiting.allow_request(_connection(host="10.0.0.2", device_id="kiosk-0"))[0]
+
+
+def test_store_key_has_its_own_limit(monkeypatch):
+    monkeypatch.setattr(rate_limiting, "rate_limiter", HybridRateLimiter(5, 60))
+    monkeypatch.setattr(rate_limiting, "store_rate_limiter", HybridRateLimiter(20, 60))
+    monkeypatch.setattr(rate_limiting, "ip_rate_limiter", HybridRateLimiter(100, 60))
+
+    store = [rate_limiting.allow_request(_connection(store_id="branch-1"))[0] for _ in range(21)]
+    address = [rate_limiting.allow_request(_connection(host="10.0.0.9"))[0] for _ in range(6)]
+
+    # kiosks of a branch sending no device ID share more than one kiosk's limit
+    assert store == [True] * 20 + [False]
+    assert address == [True] * 5 + [False]
+
+
+def test_buckets_are_capped():
+    limiter = HybridRateLimiter(5, 60, max_buckets=10)
+    for i in range(10):
+        limiter.allow(f"device:{i}")
+
+    limiter.allow("device:new")
+
+    assert limiter.size <= 10
+    # the oldest bucket made room
+    assert "device:0" not in limiter._buckets
+    assert "device:new" in limiter._buckets
+
+
+def test_idle_buckets_are_evicted_before_the_oldest():
+    limiter = HybridRateLimiter(5, 60, max_buckets=10)
+    for i in range(10):
+        limiter.allow(f"device:{i}")
+    limiter._pending.clear()
+    for i in (5, 6):
+        _age(limiter, f"device:{i}", 61)
+
+    limiter.allow("device:new")
+
+    assert "device:0" in limiter._buckets
+    assert "device:5" not in limiter._buckets and "device:6" not in limiter._buckets
+    assert limiter.size == 9
+
+
+def test_sync_caps_the_local_bucket_to_the_global_count():
+    limiter = HybridRateLimiter(10, 60, redis_url="redis://fake")
+    limiter._redis = _FakeRedis(used_elsewhere=7)
+    limiter.allow("device:a")
+
+    asyncio.run(limiter.sync())
+
+    # 7 used by other processes plus the one admitted here
+    assert limiter._buckets["device:a"][0] == pytest.approx(2.0)
+    assert [amount for _, amount in limiter._redis.increments] == [1]
+    assert not limiter._pending
+
+
+def test_failed_sync_keeps_the_counts_for_the_next_one():
+    limiter = HybridRateLimiter(10, 60, redis_url="redis://fake")
+    limiter._redis = _FakeRedis(used_elsewhere=0, fail=True)
+    limiter.allow("device:a")
+    limiter.allow("device:a")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(limiter.sync())
+
+    assert limiter._pending == {"device:a": 2}
+    assert limiter._buckets["device:a"][0] == pytest.approx(8.0, abs=0.01)
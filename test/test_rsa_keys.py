@@ -0,0 +1,57 @@
+import json
+import os
+import stat
+
+import pytest
+
+from server.utils.rsa_keys import RSAKeyManager
+
+
+@pytest.mark.parametrize("algorithm", ["RS256", "ES256", "EdDSA"])
+def test_key_store_round_trip(tmp_path, algorithm):
+    path = str(tmp_path / "keys" / "jwt-keys.json")
+    parent = RSAKeyManager(algorithm=algorithm)
+    parent.generate_keys()
+    parent.prepare_next_key()
+    parent.save_key_store(path)
+
+    worker = RSAKeyManager(algorithm=algorithm)
+    assert worker.load_key_store(path)
+
+    assert worker.get_signing_key()[0] == parent.get_current_kid()
+    assert worker.get_previous_kid() == parent.get_previous_kid()
+    assert worker.get_public_jwk() == parent.get_public_jwk()
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    # nothing changed since, a second load is a no-op
+    assert not worker.load_key_store(path)
+
+
+def test_worker_picks_up_a_rotation(tmp_path):
+    path = str(tmp_path / "jwt-keys.json")
+    parent = RSAKeyManager(algorithm="ES256")
+    parent.prepare_next_key()
+    parent.save_key_store(path)
+
+    worker = RSAKeyManager(algorithm="ES256")
+    worker.load_key_store(path)
+    old_kid, next_kid = worker.get_current_kid(), parent.get_rotation_info()["next_kid"]
+    # published before any process signs with it
+    assert next_kid in worker.get_verification_keys()
+
+    parent.generate_keys()
+    parent.prepare_next_key()
+    parent.save_key_store(path)
+
+    assert worker.load_key_store(path)
+    assert worker.get_current_kid() == next_kid
+    assert worker.get_previous_kid() == old_kid
+    kids = [key["kid"] for key in json.loads(worker.get_jwks_document()[0])["keys"]]
+    assert kids == [next_kid, old_kid, parent.get_rotation_info()["next_kid"]]
+
+
+def test_key_store_of_another_algorithm_is_refused(tmp_path):
+    path = str(tmp_path / "jwt-keys.json")
+    RSAKeyManager(algorithm="ES256").save_key_store(path)
+
+    with pytest.raises(ValueError):
+        RSAKeyManager(algorithm="EdDSA").load_key_store(path)
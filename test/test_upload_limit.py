@@ -0,0 +1,121 @@
+import asyncio
+import io
+import json
+from typing import List, Optional
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from server.utils.upload_limit import UPLOAD_CHUNK_BYTES, UploadLimitMiddleware, read_upload
+
+
+def _upload(data: bytes, size: Optional[int] = None) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), size=size)
+
+
+def test_read_upload_returns_the_whole_file():
+    data = bytes(range(256)) * (UPLOAD_CHUNK_BYTES // 64)
+
+    assert asyncio.run(read_upload(_upload(data, size=len(data)), max_bytes=len(data))) == data
+
+
+def test_read_upload_rejects_a_declared_size_without_reading():
+    upload = _upload(b"x" * 100, size=100)
+
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(read_upload(upload, max_bytes=99))
+
+    assert rejected.value.status_code == 413
+    assert upload.file.tell() == 0
+
+
+def test_read_upload_stops_at_the_chunk_past_the_limit():
+    # no declared size, e.g. a chunked upload
+    upload = _upload(b"x" * (UPLOAD_CHUNK_BYTES * 4))
+
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(read_upload(upload, max_bytes=UPLOAD_CHUNK_BYTES + 1))
+
+    assert rejected.value.status_code == 413
+    assert upload.file.tell() == UPLOAD_CHUNK_BYTES * 2
+
+
+class _App:
+    """Reads the whole body, then answers 200 with its length."""
+
+    def __init__(self):
+        self.received = 0
+        self.disconnected = False
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                self.disconnected = True
+                break
+            self.received += len(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": str(self.received).encode()})
+
+
+def _request(middleware: UploadLimitMiddleware, path: str, chunks: List[bytes], content_length: Optional[int] = None):
+    headers = [] if content_length is None else [(b"content-length", str(content_length).encode())]
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1} for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    statuses = [message["status"] for message in sent if message["type"] == "http.response.start"]
+    bodies = [message["body"] for message in sent if message["type"] == "http.response.body"]
+    return statuses, bodies, messages
+
+
+def test_content_length_over_the_limit_is_rejected_before_the_app_runs():
+    app = _App()
+
+    statuses, bodies, unread = _request(UploadLimitMiddleware(app, max_bytes=1000), "/api/verify-face", [b"x" * 2000], content_length=2000)
+
+    assert statuses == [413]
+    assert json.loads(bodies[0])["statusCode"] == 413
+    assert app.received == 0
+    assert len(unread) == 1
+
+
+def test_streamed_body_over_the_limit_is_cut_off():
+    app = _App()
+    chunks = [b"x" * 400] * 5
+
+    statuses, bodies, unread = _request(UploadLimitMiddleware(app, max_bytes=1000), "/api/verify-face", chunks)
+
+    # only the 413 reaches the client, the app's own answer is dropped
+    assert statuses == [413]
+    assert len(bodies) == 1
+    assert app.disconnected
+    # the chunks past the limit were never read
+    assert len(unread) == 2
+
+
+def test_body_under_the_limit_passes():
+    app = _App()
+
+    statuses, bodies, _ = _request(UploadLimitMiddleware(app, max_bytes=1000), "/api/verify-face", [b"x" * 500] * 2, content_length=1000)
+
+    assert statuses == [200]
+    assert bodies == [b"1000"]
+
+
+def test_internal_paths_have_their_own_limit():
+    middleware = UploadLimitMiddleware(_App(), max_bytes=1000, internal_max_bytes=5000)
+
+    assert _request(middleware, "/internal/bulk-enroll", [b"x" * 1000] * 4, content_length=4000)[0] == [200]
+    assert _request(middleware, "/internal/bulk-enroll", [b"x" * 1000] * 6, content_length=6000)[0] == [413]
+    assert _request(middleware, "/internal/bulk-enroll", [b"x" * 1000] * 6)[0] == [413]